@@ -0,0 +1,161 @@
+"""
+US address normalization helpers
+
+Canonicalizes the pieces of a street address (case, whitespace, punctuation,
+street suffixes, directionals, state names and ZIP+4) so that differently
+written versions of the same address compare equal.
+"""
+
+import re
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s#]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_HOUSE_NUMBER_RE = re.compile(r'^(\d+[a-z]?)\s+(.+)$')
+_UNIT_RE = re.compile(r'\s+(?:#|apt|apartment|unit|ste|suite|bldg|building|fl|floor|rm|room|lot|spc|space)\s*\w*$')
+_ZIP_RE = re.compile(r'^(\d{5})(?:-?\d{4})?$')
+
+STREET_SUFFIXES = {
+    'alley': 'aly', 'aly': 'aly',
+    'avenue': 'ave', 'av': 'ave', 'ave': 'ave', 'aven': 'ave', 'avenu': 'ave',
+    'boulevard': 'blvd', 'blvd': 'blvd', 'boul': 'blvd',
+    'circle': 'cir', 'cir': 'cir', 'circ': 'cir',
+    'court': 'ct', 'ct': 'ct',
+    'cove': 'cv', 'cv': 'cv',
+    'crossing': 'xing', 'xing': 'xing',
+    'drive': 'dr', 'dr': 'dr', 'drv': 'dr',
+    'expressway': 'expy', 'expy': 'expy',
+    'freeway': 'fwy', 'fwy': 'fwy',
+    'highway': 'hwy', 'hwy': 'hwy',
+    'lane': 'ln', 'ln': 'ln',
+    'loop': 'loop',
+    'parkway': 'pkwy', 'pkwy': 'pkwy', 'pky': 'pkwy',
+    'place': 'pl', 'pl': 'pl',
+    'plaza': 'plz', 'plz': 'plz',
+    'point': 'pt', 'pt': 'pt',
+    'road': 'rd', 'rd': 'rd',
+    'run': 'run',
+    'square': 'sq', 'sq': 'sq',
+    'street': 'st', 'st': 'st', 'str': 'st',
+    'terrace': 'ter', 'ter': 'ter',
+    'trail': 'trl', 'trl': 'trl',
+    'way': 'way', 'wy': 'way',
+}
+
+DIRECTIONALS = {
+    'north': 'n', 'n': 'n', 'south': 's', 's': 's', 'east': 'e', 'e': 'e', 'west': 'w', 'w': 'w',
+    'northeast': 'ne', 'ne': 'ne', 'northwest': 'nw', 'nw': 'nw',
+    'southeast': 'se', 'se': 'se', 'southwest': 'sw', 'sw': 'sw',
+}
+
+STATE_ABBREVIATIONS = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca',
+    'colorado': 'co', 'connecticut': 'ct', 'delaware': 'de', 'district of columbia': 'dc',
+    'florida': 'fl', 'georgia': 'ga', 'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il',
+    'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks', 'kentucky': 'ky', 'louisiana': 'la',
+    'maine': 'me', 'maryland': 'md', 'massachusetts': 'ma', 'michigan': 'mi', 'minnesota': 'mn',
+    'mississippi': 'ms', 'missouri': 'mo', 'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv',
+    'new hampshire': 'nh', 'new jersey': 'nj', 'new mexico': 'nm', 'new york': 'ny',
+    'north carolina': 'nc', 'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok', 'oregon': 'or',
+    'pennsylvania': 'pa', 'rhode island': 'ri', 'south carolina': 'sc', 'south dakota': 'sd',
+    'tennessee': 'tn', 'texas': 'tx', 'utah': 'ut', 'vermont': 'vt', 'virginia': 'va',
+    'washington': 'wa', 'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+    'puerto rico': 'pr',
+}
+_STATE_CODES = set(STATE_ABBREVIATIONS.values())
+
+
+def normalize_text(value):
+    """Lowercase, strip punctuation and collapse whitespace"""
+    if value is None:
+        return ''
+    text = _PUNCTUATION_RE.sub(' ', str(value).lower())
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def normalize_street(street):
+    """Canonical street name: standard suffix/directional abbreviations, no unit"""
+    text = _UNIT_RE.sub('', normalize_text(street)).replace('#', ' ').strip()
+    tokens = text.split()
+    if not tokens:
+        return ''
+    # Directionals may lead or trail the street name ("N Main St", "Main St NW")
+    if len(tokens) > 1 and tokens[0] in DIRECTIONALS:
+        tokens[0] = DIRECTIONALS[tokens[0]]
+    if len(tokens) > 1 and tokens[-1] in DIRECTIONALS:
+        tokens[-1] = DIRECTIONALS[tokens[-1]]
+        suffix_position = len(tokens) - 2
+    else:
+        suffix_position = len(tokens) - 1
+    if suffix_position > 0 and tokens[suffix_position] in STREET_SUFFIXES:
+        tokens[suffix_position] = STREET_SUFFIXES[tokens[suffix_position]]
+    return ' '.join(tokens)
+
+
+def street_base(street):
+    """Street name without its suffix and directionals, for fuzzy matching"""
+    tokens = normalize_street(street).split()
+    while len(tokens) > 1 and tokens[0] in DIRECTIONALS:
+        tokens = tokens[1:]
+    while len(tokens) > 1 and tokens[-1] in DIRECTIONALS:
+        tokens = tokens[:-1]
+    if len(tokens) > 1 and tokens[-1] in STREET_SUFFIXES.values():
+        tokens = tokens[:-1]
+    return ' '.join(tokens)
+
+
+def split_house_number(address_line):
+    """Split '123 Main St' into ('123', 'main st'); number is '' if absent"""
+    text = normalize_text(address_line)
+    match = _HOUSE_NUMBER_RE.match(text)
+    if match:
+        return match.group(1), normalize_street(match.group(2))
+    return '', normalize_street(text)
+
+
+def normalize_zip(zip_code):
+    """Five-digit ZIP from ZIP, ZIP+4 ('75201-1234', '752011234') or '75201.0'"""
+    text = str(zip_code or '').strip()
+    if text.endswith('.0'):
+        text = text[:-2]
+    match = _ZIP_RE.match(text)
+    if match:
+        return match.group(1)
+    if text.isdigit() and len(text) < 5:
+        return text.zfill(5)  # Leading zeros lost by a spreadsheet
+    return normalize_text(text)
+
+
+def normalize_state(state):
+    text = normalize_text(state)
+    return STATE_ABBREVIATIONS.get(text, text)
+
+
+def parse_full_address(full_address):
+    """Parse an 'Address, City, State, Zip' string into normalized parts"""
+    parts = [part.strip() for part in str(full_address).split(',') if part.strip()]
+    zip_code = state = city = ''
+    if len(parts) > 1 and _ZIP_RE.match(parts[-1]):
+        zip_code = normalize_zip(parts.pop())
+    if len(parts) > 1:
+        # "TX 75201" style trailing state + zip
+        tail = parts[-1].split()
+        if not zip_code and len(tail) == 2 and _ZIP_RE.match(tail[1]):
+            zip_code = normalize_zip(tail[1])
+            parts[-1] = tail[0]
+        if normalize_state(parts[-1]) in _STATE_CODES:
+            state = normalize_state(parts.pop())
+    if len(parts) > 1:
+        city = normalize_text(parts.pop())
+    number, street = split_house_number(parts[0] if parts else '')
+    return {'number': number, 'street': street, 'city': city, 'state': state, 'zip': zip_code}
+
+
+def address_key(address, city='', state='', zip_code=''):
+    """Canonical key for an address, equal for differently written copies.
+
+    '12 N. Main Street Apt 4', 'Dallas', 'Texas', '75201-1234' and
+    '12 north main st', 'dallas', 'TX', '75201' give the same key.
+    """
+    number, street = split_house_number(address)
+    return '|'.join((f'{number} {street}'.strip(), normalize_text(city),
+                     normalize_state(state), normalize_zip(zip_code)))
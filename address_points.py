@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Offline address-point index
+
+Imports an OpenAddresses-style CSV (house number, street, city, state, zip,
+lat, lon) once into a compact SQLite index, which the "offline" geocoder
+backend then queries without any network calls.
+
+Lookups try, in order:
+  1. the exact house number on the normalized street in the same ZIP (or
+     city/state when the address has no ZIP),
+  2. the same, ignoring street suffix/directionals ("Main St" vs "Main Ave N"),
+  3. the nearest house number on that street (within MAX_NUMBER_GAP), which
+     places the marker on the right block.
+
+Usage:
+    python address_points.py import points.csv [points2.csv ...] [--db address_points.sqlite]
+    python address_points.py lookup "123 Main St, Dallas, TX, 75201" [--db address_points.sqlite]
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from address_normalize import (normalize_state, normalize_text, normalize_zip,
+                               parse_full_address, split_house_number, street_base)
+
+DEFAULT_INDEX_PATH = 'address_points.sqlite'
+IMPORT_CHUNK_SIZE = 100_000
+MAX_NUMBER_GAP = 200  # house numbers; farther than this is not "the same block"
+
+# Accepted column names (case-insensitive) for each field
+COLUMN_ALIASES = {
+    'number': ['number', 'house_number', 'housenumber', 'addr:housenumber', 'num'],
+    'street': ['street', 'street_name', 'addr:street', 'road'],
+    'address': ['address', 'address_line', 'full_address'],
+    'city': ['city', 'locality', 'town', 'addr:city', 'district'],
+    'state': ['region', 'state', 'province', 'addr:state'],
+    'zip': ['postcode', 'zip', 'zipcode', 'postal_code', 'addr:postcode'],
+    'lat': ['lat', 'latitude', 'y'],
+    'lon': ['lon', 'lng', 'long', 'longitude', 'x'],
+}
+
+_LEADING_DIGITS_RE = re.compile(r'^(\d+)')
+
+
+def _number_int(number):
+    match = _LEADING_DIGITS_RE.match(number or '')
+    return int(match.group(1)) if match else None
+
+
+def _resolve_columns(columns):
+    lookup = {str(col).strip().lower(): col for col in columns}
+    resolved = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lookup:
+                resolved[field] = lookup[alias]
+                break
+    missing = [f for f in ('lat', 'lon') if f not in resolved]
+    if 'street' not in resolved and 'address' not in resolved:
+        missing.append('street')
+    if missing:
+        raise ValueError(f"Address-point file is missing columns: {', '.join(missing)}")
+    return resolved
+
+
+def _point_rows(chunk, columns):
+    """Yield normalized index rows for one CSV chunk"""
+    chunk = chunk.fillna('').astype(str)
+    latitudes = pd.to_numeric(chunk[columns['lat']], errors='coerce')
+    longitudes = pd.to_numeric(chunk[columns['lon']], errors='coerce')
+    empty = pd.Series('', index=chunk.index)
+    numbers = chunk[columns['number']] if 'number' in columns else empty
+    streets = chunk[columns['street']] if 'street' in columns else chunk[columns['address']]
+    cities = chunk[columns['city']] if 'city' in columns else empty
+    states = chunk[columns['state']] if 'state' in columns else empty
+    zips = chunk[columns['zip']] if 'zip' in columns else empty
+
+    for number, street, city, state, zip_code, lat, lon in zip(
+            numbers, streets, cities, states, zips, latitudes, longitudes):
+        if pd.isna(lat) or pd.isna(lon):
+            continue
+        if number.strip():
+            number = normalize_text(number)
+            street = split_house_number(f'0 {street}')[1]
+        else:
+            number, street = split_house_number(street)
+        if not street:
+            continue
+        yield (number, _number_int(number), street, street_base(street), normalize_text(city),
+               normalize_state(state), normalize_zip(zip_code), float(lat), float(lon))
+
+
+def build_index(csv_paths, index_path=DEFAULT_INDEX_PATH, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import address-point CSVs into a fresh index file; returns row count"""
+    tmp_path = index_path + '.building'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute(
+        'CREATE TABLE points ('
+        ' number TEXT, number_int INTEGER, street TEXT, street_base TEXT,'
+        ' city TEXT, state TEXT, zip TEXT, latitude REAL, longitude REAL)'
+    )
+    total = 0
+    started = time.time()
+    try:
+        for csv_path in csv_paths:
+            reader = pd.read_csv(csv_path, dtype=str, chunksize=chunk_size, keep_default_na=False)
+            columns = None
+            for chunk in reader:
+                if columns is None:
+                    columns = _resolve_columns(chunk.columns)
+                rows = list(_point_rows(chunk, columns))
+                conn.executemany('INSERT INTO points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                total += len(rows)
+                print(f"Imported {total} address points ({time.time() - started:.1f}s)")
+        # Indexes are built once after the bulk load, which is much faster
+        print("Building lookup indexes...")
+        conn.execute('CREATE INDEX ix_zip ON points (zip, street, number_int)')
+        conn.execute('CREATE INDEX ix_city ON points (state, city, street, number_int)')
+        conn.execute('CREATE INDEX ix_zip_base ON points (zip, street_base, number_int)')
+        conn.execute('CREATE INDEX ix_city_base ON points (state, city, street_base, number_int)')
+        conn.execute('ANALYZE')
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    os.replace(tmp_path, index_path)
+    print(f"Address-point index ready: {total} points in {index_path} ({time.time() - started:.1f}s)")
+    return total
+
+
+class AddressPointsIndex:
+    """Read-only lookups against an index built by build_index()"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, max_number_gap=MAX_NUMBER_GAP):
+        self.path = path
+        self.max_number_gap = max_number_gap
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'file:{os.path.abspath(self.path)}?mode=ro', uri=True,
+                                   check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _area_filters(self, parts):
+        """(SQL, params) pairs restricting to the address's ZIP or city/state"""
+        filters = []
+        if parts['zip']:
+            filters.append(('zip = ?', [parts['zip']]))
+        if parts['city'] and parts['state']:
+            filters.append(('state = ? AND city = ?', [parts['state'], parts['city']]))
+        return filters
+
+    def lookup(self, full_address):
+        """Return (lat, lon) for an address, or None when it is not covered"""
+        parts = parse_full_address(full_address)
+        number_int = _number_int(parts['number'])
+        if not parts['street'] or number_int is None:
+            return None  # Only street addresses with a house number are covered
+        base = street_base(parts['street'])
+        conn = self._conn()
+
+        for area_sql, area_params in self._area_filters(parts):
+            for street_column, street in (('street', parts['street']), ('street_base', base)):
+                where = f'{area_sql} AND {street_column} = ?'
+                params = area_params + [street]
+                # Exact house number
+                row = conn.execute(
+                    f'SELECT latitude, longitude FROM points WHERE {where} AND number_int = ? AND number = ? LIMIT 1',
+                    params + [number_int, parts['number']]).fetchone()
+                if row:
+                    return row
+                row = conn.execute(
+                    f'SELECT latitude, longitude FROM points WHERE {where} AND number_int = ? LIMIT 1',
+                    params + [number_int]).fetchone()
+                if row:
+                    return row
+
+        # Nearest house number on the same street (same block)
+        for area_sql, area_params in self._area_filters(parts):
+            where = f'{area_sql} AND street = ?'
+            params = area_params + [parts['street']]
+            below = conn.execute(
+                f'SELECT number_int, latitude, longitude FROM points WHERE {where} AND number_int <= ? '
+                f'ORDER BY number_int DESC LIMIT 1', params + [number_int]).fetchone()
+            above = conn.execute(
+                f'SELECT number_int, latitude, longitude FROM points WHERE {where} AND number_int >= ? '
+                f'ORDER BY number_int ASC LIMIT 1', params + [number_int]).fetchone()
+            candidates = [c for c in (below, above) if c and abs(c[0] - number_int) <= self.max_number_gap]
+            if candidates:
+                best = min(candidates, key=lambda c: abs(c[0] - number_int))
+                return best[1], best[2]
+        return None
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM points').fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline address-point index for geocoding')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='build the index from address-point CSV files')
+    import_parser.add_argument('csv_files', nargs='+')
+    import_parser.add_argument('--db', default=os.environ.get('ADDRESS_POINTS_PATH', DEFAULT_INDEX_PATH))
+
+    lookup_parser = subparsers.add_parser('lookup', help='look up one address in the index')
+    lookup_parser.add_argument('address')
+    lookup_parser.add_argument('--db', default=os.environ.get('ADDRESS_POINTS_PATH', DEFAULT_INDEX_PATH))
+
+    args = parser.parse_args(argv)
+    if args.command == 'import':
+        build_index(args.csv_files, args.db)
+    else:
+        if not os.path.exists(args.db):
+            print(f"No address-point index at {args.db}. Run the import command first.")
+            return 1
+        result = AddressPointsIndex(args.db).lookup(args.address)
+        print(f"{args.address} -> {result[0]}, {result[1]}" if result else f"{args.address} -> not found")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
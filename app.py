@@ -15,19 +15,37 @@ Author: Family Mapping App Team
 Version: 0.0.3
 """
 
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, session
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, stream_with_context
 from werkzeug.utils import secure_filename
+import numpy as np
 import pandas as pd
-import io
-import math
 import json
+import logging
 import time
 import os
 import uuid
-from datetime import datetime
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-import threading
+from geocode_cache import GeocodeCache
+from dataset_store import DatasetStore
+from dataset_update import PreviousVersion
+from sqlite_store import SqliteDatasetStore
+from spatial import haversine_m
+from geocoders import GeocodingEngine, backends_from_config
+from job_queue import JobQueue, STATUS_RUNNING
+from data_api import dataset_rows_response, markers_response
+from csv_export import dataframe_csv_response
+from zones import zones_export_response
+from nearest import nearest_response
+from grouping import groups_response
+from progress_store import ProgressStore, TERMINAL_STATUSES
+from ingest import COLUMNS, full_addresses, group_rows_by_address, iter_clean_chunks, sniff_layout
+from checkpoint import GeocodeCheckpoint, RESUMABLE_STATUSES, find_job, list_jobs, mark_interrupted_jobs
+from metrics import (CACHE_LOOKUPS, GEOCODE_JOBS, GEOCODE_ROWS, GEOCODE_STAGE_SECONDS, REGISTRY,
+                     instrument_app, metrics_response)
+from profiling import profile_requested, profile_requests, profile_response, profiled, profiles_response
+from structured_log import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'  # Change this in production
@@ -35,14 +53,54 @@ app.secret_key = 'your-secret-key-change-this'  # Change this in production
 # Configuration
 UPLOAD_FOLDER = 'datasets'
 ALLOWED_EXTENSIONS = {'csv'}
-COLUMNS = ['Family Name', 'Address', 'City', 'State', 'Zip', 'PeopleID']
+FAILED_COLUMNS = COLUMNS + ['Full_Address', 'Failure_Reason']  # Stored for rows that could not be geocoded
+DATASET_BACKEND = os.environ.get('DATASET_BACKEND', 'columnar')  # or 'sqlite' (see sqlite_store.py)
+DATASETS_DB_PATH = os.environ.get('DATASETS_DB_PATH', 'datasets.sqlite')
+GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH', 'geocode_cache.sqlite')
+GEOCODE_CACHE_MISS_TTL_DAYS = float(os.environ.get('GEOCODE_CACHE_MISS_TTL_DAYS', '30'))
+GEOCODER_BACKENDS = os.environ.get('GEOCODER_BACKENDS', '')  # JSON list, see geocoders.py
+ADDRESS_POINTS_PATH = os.environ.get('ADDRESS_POINTS_PATH', 'address_points.sqlite')  # Offline index
+GEOCODE_JOBS_PATH = os.environ.get('GEOCODE_JOBS_PATH', 'geocode_jobs.sqlite')
+GEOCODE_PROGRESS_PATH = os.environ.get('GEOCODE_PROGRESS_PATH', 'geocode_progress.sqlite')  # Shared by server processes
+GEOCODE_WORKERS = int(os.environ.get('GEOCODE_WORKERS', '2'))  # Jobs geocoded at the same time
+GEOCODE_RUNNER = os.environ.get('GEOCODE_RUNNER', 'web')  # or 'external': only geocode_runner.py runs jobs
+PROGRESS_HEARTBEAT = 15  # seconds; keep-alive comment when nothing changes
+PROGRESS_QUEUE_REFRESH = 2  # seconds; queue position re-check while a job waits
+GEOCODER_STATE_INTERVAL = 1  # seconds; how often a job copies the geocoder pacing state into its progress
+METRICS_DIR = os.environ.get('METRICS_DIR', '')  # Shared by server processes, see metrics.py
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Global progress tracking
-geocoding_progress = {}
-geocoding_cancel_flags = {}  # Track cancellation requests
+# Geocode cache shared by every dataset (kept outside UPLOAD_FOLDER so that
+# clearing all datasets does not throw away already-paid-for lookups)
+geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH, miss_ttl=GEOCODE_CACHE_MISS_TTL_DAYS * 24 * 60 * 60)
+
+# Parsed datasets kept in memory between requests, stored as column files in
+# each dataset directory or all together in one SQLite database
+if DATASET_BACKEND == 'sqlite':
+    dataset_store = SqliteDatasetStore(DATASETS_DB_PATH)
+else:
+    dataset_store = DatasetStore(UPLOAD_FOLDER)
+
+# Geocoder backends (public Nominatim at 1 req/s unless GEOCODER_BACKENDS is set).
+# If an offline address-point index exists it is tried before any network provider.
+geocoding_engine = GeocodingEngine(backends_from_config(GEOCODER_BACKENDS, offline_index=ADDRESS_POINTS_PATH))
+
+# Progress and cancel requests of every job, readable from any server process
+geocoding_progress = ProgressStore(GEOCODE_PROGRESS_PATH)
+
+# Request latency for /metrics, summed over every server process when METRICS_DIR is set
+instrument_app(app)
+REGISTRY.share(METRICS_DIR)
+
+# cProfile for requests (and jobs) sent with the PROFILING_TOKEN; off by default
+profile_requests(app)
+
+def recover_interrupted_jobs():
+    """Jobs still marked running were cut off by a restart; offer them for resume"""
+    for interrupted_dataset in mark_interrupted_jobs(UPLOAD_FOLDER):
+        logger.info(f"Geocoding job for '{interrupted_dataset}' was interrupted; it can be resumed")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -52,86 +110,72 @@ def get_datasets():
     datasets = []
     if os.path.exists(UPLOAD_FOLDER):
         try:
-            for item in os.listdir(UPLOAD_FOLDER):
-                dataset_path = os.path.join(UPLOAD_FOLDER, item)
-                if os.path.isdir(dataset_path):
-                    cache_file = os.path.join(dataset_path, 'geocoded_cache.csv')
-                    if os.path.exists(cache_file):
-                        # Check if file is not empty/corrupted
-                        if os.path.getsize(cache_file) < 10:
-                            print(f"Warning: Skipping corrupted dataset {item} (cache file too small)")
-                            continue
-                            
-                        # Get file modification time
-                        mod_time = datetime.fromtimestamp(os.path.getmtime(cache_file))
-                        # Count addresses
-                        try:
-                            df = pd.read_csv(cache_file)
-                            count = len(df)
-                        except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
-                            print(f"Warning: Skipping corrupted dataset {item}: {str(e)}")
-                            continue
-                        except Exception as e:
-                            print(f"Warning: Error reading dataset {item}: {str(e)}")
-                            count = 0
-                            
-                        datasets.append({
-                            'name': item,
-                            'path': dataset_path,
-                            'last_modified': mod_time.strftime('%Y-%m-%d %H:%M'),
-                            'address_count': count
-                        })
+            datasets = dataset_store.list_datasets()
         except (PermissionError, OSError) as e:
-            print(f"Warning: Cannot access datasets directory: {str(e)}")
+            logger.warning(f"Cannot access datasets directory: {str(e)}")
             # Recreate the directory if it doesn't exist or has permission issues
             try:
                 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
             except Exception as create_error:
-                print(f"Error recreating datasets directory: {str(create_error)}")
+                logger.error(f"Error recreating datasets directory: {str(create_error)}")
     else:
         # Create the directory if it doesn't exist
         try:
             os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         except Exception as create_error:
-            print(f"Error creating datasets directory: {str(create_error)}")
+            logger.error(f"Error creating datasets directory: {str(create_error)}")
     
-    return sorted(datasets, key=lambda x: x['last_modified'], reverse=True)
+    return datasets
+
+def load_dataset(dataset_name=None):
+    """Get the in-memory Dataset for a dataset name (None = legacy file)"""
+    return dataset_store.get(dataset_name)
 
 def load_valid_addresses(dataset_name=None):
-    """Load addresses from a specific dataset or default"""
-    if dataset_name:
-        cache_file = os.path.join(UPLOAD_FOLDER, dataset_name, 'geocoded_cache.csv')
-    else:
-        cache_file = 'geocoded_cache.csv'  # Default legacy file
-    
-    if not os.path.exists(cache_file):
+    """Load addresses from a specific dataset or default (read-only DataFrame)"""
+    dataset = load_dataset(dataset_name)
+    if dataset is None:
         return pd.DataFrame()
+    return dataset.df
+
+def geocode_dataset(dataset_name, csv_file_path, progress_id, resume=False, update=False, profile=None):
+    """Geocode a dataset in the background.
     
-    # Check if file is empty or too small
-    if os.path.getsize(cache_file) < 10:  # Less than 10 bytes is likely empty/corrupted
-        print(f"Warning: {cache_file} is empty or corrupted (size: {os.path.getsize(cache_file)} bytes)")
-        return pd.DataFrame()
+    Finished rows are checkpointed to the dataset directory as they arrive, so
+    with resume=True a canceled or interrupted job continues where it stopped
+    (csv_file_path is ignored; the upload kept with the checkpoint is used).
+    With update=True the upload replaces an existing dataset and addresses it
+    already has keep their coordinates (see dataset_update.py).
+    """
+    upload_file = csv_file_path
+    checkpoint = None
+    log_fields = {'dataset': dataset_name, 'progress_id': progress_id}
+    stage_started = time.perf_counter()
     
-    try:
-        df = pd.read_csv(cache_file)
-    except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
-        print(f"Error reading {cache_file}: {str(e)}")
-        return pd.DataFrame()
+    def end_stage(stage):
+        nonlocal stage_started
+        now = time.perf_counter()
+        GEOCODE_STAGE_SECONDS.observe(now - stage_started, stage=stage)
+        stage_started = now
     
-    # Check if DataFrame is empty or missing required columns
-    if df.empty or 'Latitude' not in df.columns or 'Longitude' not in df.columns:
-        return pd.DataFrame()
+    def dataset_deleted():
+        # delete_dataset and clear_all_datasets remove the dataset directory,
+        # while the job may still be running: neither the upload nor, once
+        # the job is done, the original.csv it became is left
+        return checkpoint is not None and not any(
+            os.path.exists(path) for path in (checkpoint.upload_path, os.path.join(dataset_path, 'original.csv')))
+    
+    def finish_deleted():
+        logger.info("Dataset deleted during geocoding; nothing written for progress_id: %s", progress_id,
+                    extra=log_fields)
+        GEOCODE_JOBS.inc(status='canceled')
+        try:
+            os.rmdir(dataset_path)  # Left empty by a dataset writer that was already open
+        except OSError:
+            pass
+        geocoding_progress[progress_id].update(
+            status='canceled', completed=True, resumable=False, dataset_name=dataset_name)
     
-    # Filter out rows with missing or invalid lat/lon
-    df = df.dropna(subset=['Latitude', 'Longitude'])
-    df = df[(df['Latitude'].apply(lambda x: isinstance(x, (int, float)) or str(x).replace('.', '', 1).isdigit())) &
-            (df['Longitude'].apply(lambda x: isinstance(x, (int, float)) or str(x).replace('.', '', 1).isdigit()))]
-    df['Latitude'] = df['Latitude'].astype(float)
-    df['Longitude'] = df['Longitude'].astype(float)
-    return df
-
-def geocode_dataset(dataset_name, csv_file_path, progress_id):
-    """Geocode a dataset in the background"""
     try:
         # Initialize progress
         geocoding_progress[progress_id] = {
@@ -140,265 +184,314 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
             'total': 0,
             'current_address': '',
             'completed': False,
-            'error': None
+            'error': None,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'profile': profile,
         }
         
-        # Create dataset directory
+        # Create dataset directory and move the upload next to its checkpoint
         dataset_path = os.path.join(UPLOAD_FOLDER, dataset_name)
-        os.makedirs(dataset_path, exist_ok=True)
-        
-        # Read the uploaded CSV
-        print(f"Reading CSV file: {csv_file_path}")
-        raw_df = pd.read_csv(csv_file_path)
-        print(f"Raw CSV has {len(raw_df)} rows and columns: {list(raw_df.columns)}")
-        
-        # Check if the first row contains data instead of headers
-        # This happens when CSV doesn't have proper column names
-        first_row_values = raw_df.iloc[0].tolist() if len(raw_df) > 0 else []
-        columns_look_like_data = any(
-            str(val).strip() and (
-                any(char.isdigit() for char in str(val)) or  # Contains numbers
-                len(str(val).split()) > 1 or  # Multiple words
-                str(val).lower() in ['tx', 'ca', 'ny', 'fl']  # State abbreviations
-            ) for val in first_row_values[:5]  # Check first 5 columns
-        )
-        
-        if columns_look_like_data:
-            print("Detected that first row contains data, not headers. Using positional mapping.")
-            # Read again without treating first row as headers
-            raw_df = pd.read_csv(csv_file_path, header=None)
-            print(f"Re-read CSV without headers: {len(raw_df)} rows and {len(raw_df.columns)} columns")
-            
-            # Use positional mapping for CSV without headers
-            df = pd.DataFrame()
-            df['Family Name'] = raw_df.iloc[:, 0] if len(raw_df.columns) > 0 else ''
-            df['Address'] = raw_df.iloc[:, 1] if len(raw_df.columns) > 1 else ''
-            df['City'] = raw_df.iloc[:, 3] if len(raw_df.columns) > 3 else ''
-            df['State'] = raw_df.iloc[:, 4] if len(raw_df.columns) > 4 else ''
-            df['Zip'] = raw_df.iloc[:, 5] if len(raw_df.columns) > 5 else ''
-            df['PeopleID'] = raw_df.iloc[:, 6] if len(raw_df.columns) > 6 else ''
-            print("Using positional mapping (no headers)")
+        checkpoint = GeocodeCheckpoint(dataset_path)
+        if resume:
+            checkpoint.resume(progress_id)
+            update = update or checkpoint.job.get('update', False)
         else:
-            # Try to map columns automatically using column names
-            df_columns = raw_df.columns.tolist()
-            column_mapping = {}
-            
-            # More robust column mapping logic for files with headers
-            for i, col in enumerate(df_columns):
-                col_lower = str(col).lower()
-                if i == 0 or 'family' in col_lower or ('name' in col_lower and 'file' not in col_lower):
-                    column_mapping['Family Name'] = col
-                elif i == 1 or ('address' in col_lower and 'email' not in col_lower):
-                    column_mapping['Address'] = col
-                elif i == 3 or 'city' in col_lower:
-                    column_mapping['City'] = col
-                elif i == 4 or 'state' in col_lower:
-                    column_mapping['State'] = col
-                elif i == 5 or 'zip' in col_lower or 'postal' in col_lower:
-                    column_mapping['Zip'] = col
-                elif i == 6 or 'people' in col_lower or 'id' in col_lower:
-                    column_mapping['PeopleID'] = col
-            
-            print(f"Column mapping: {column_mapping}")
-            
-            # If we have the exact columns, use them directly
-            if all(col in df_columns for col in COLUMNS):
-                df = raw_df[COLUMNS].copy()
-                print("Using exact column match")
-            elif len(column_mapping) >= 4:  # At least name, address, city, state
-                # Rename columns to match our expected format
-                df = raw_df.rename(columns=column_mapping)
-                # Fill missing columns with empty strings
-                for col in COLUMNS:
-                    if col not in df.columns:
-                        df[col] = ''
-                df = df[COLUMNS].copy()
-                print("Using column mapping")
-            else:
-                # Use positional mapping based on typical CSV structure
-                # Assume: Name, Address, Extra, City, State, Zip, PeopleID
-                df = pd.DataFrame()
-                df['Family Name'] = raw_df.iloc[:, 0] if len(raw_df.columns) > 0 else ''
-                df['Address'] = raw_df.iloc[:, 1] if len(raw_df.columns) > 1 else ''
-                df['City'] = raw_df.iloc[:, 3] if len(raw_df.columns) > 3 else ''
-                df['State'] = raw_df.iloc[:, 4] if len(raw_df.columns) > 4 else ''
-                df['Zip'] = raw_df.iloc[:, 5] if len(raw_df.columns) > 5 else ''
-                df['PeopleID'] = raw_df.iloc[:, 6] if len(raw_df.columns) > 6 else ''
-                print("Using positional mapping (fallback)")
-        
-        print(f"Mapped DataFrame has {len(df)} rows")
-        print(f"Sample data - First row: {df.iloc[0].to_dict() if len(df) > 0 else 'No data'}")
-        
-        # Clean up the data
-        df = df.fillna('')  # Replace NaN with empty strings
-        df = df.astype(str)  # Convert all to strings
-        
-        # Remove rows with missing critical data
-        original_count = len(df)
-        df = df[df['Address'].str.strip() != '']
-        df = df[df['City'].str.strip() != '']
-        df = df[df['State'].str.strip() != '']
-        
-        print(f"After cleaning: {len(df)} valid addresses (removed {original_count - len(df)} invalid)")
-        
-        if len(df) == 0:
+            checkpoint.start(dataset_name, upload_file, progress_id)
+            if update:
+                checkpoint.save_job(update=True)
+        csv_file_path = checkpoint.upload_path
+        
+        previous = None
+        if update:
+            stored = dataset_store.get(dataset_name)
+            if stored is None:
+                raise ValueError(f"Dataset '{dataset_name}' to update was not found")
+            previous = PreviousVersion(stored)
+        
+        # Work out the file layout from its first rows only; the upload itself
+        # is streamed in chunks and never held in memory as a whole
+        logger.info("Reading CSV file: %s", csv_file_path, extra=log_fields)
+        layout = sniff_layout(csv_file_path)
+        logger.info("CSV layout: %s (header row: %s)", layout.description, 'yes' if layout.has_header else 'no',
+                    extra=log_fields)
+        
+        # Pass 1: map and clean each chunk, and group rows on a canonical
+        # address key. Rows at the same address (several people per household,
+        # or the same address written differently) are geocoded once.
+        row_groups, group_addresses, group_keys, total_rows = group_rows_by_address(csv_file_path, layout)
+        valid_rows = len(row_groups)
+        
+        logger.info("After cleaning: %d valid addresses (removed %d invalid)", valid_rows, total_rows - valid_rows,
+                    extra=log_fields)
+        
+        if valid_rows == 0:
             raise ValueError("No valid addresses found in the uploaded file. Please check that your CSV has Address, City, and State columns with data.")
         
-        # Clean up zip codes (remove extra digits)
-        df['Zip'] = df['Zip'].str.split('-').str[0]  # Take only first part of zip
-        
-        geocoding_progress[progress_id]['total'] = len(df)
+        group_count = len(group_addresses)
+        rows_per_group = np.bincount(row_groups, minlength=group_count)
+        dedup_ratio = 1 - group_count / valid_rows
+        geocoding_progress[progress_id]['total'] = valid_rows
         geocoding_progress[progress_id]['status'] = 'geocoding'
-        
-        # Setup geocoder with proper rate limiting for Nominatim
-        # Nominatim Usage Policy: max 1 request per second
-        geolocator = Nominatim(user_agent="family_mapper_v2", timeout=15)
-        rate_limiter = RateLimiter(geolocator.geocode, min_delay_seconds=1.0)
-        
-        # Geocode addresses
-        results = []
-        failed_addresses = []
-        successful_geocodes = 0
-        consecutive_failures = 0
-        max_consecutive_failures = 5
-        
-        for idx, row in df.iterrows():
-            # Check for cancellation request
-            if geocoding_cancel_flags.get(progress_id, False):
-                print(f"Geocoding canceled for progress_id: {progress_id}")
-                geocoding_progress[progress_id]['status'] = 'canceled'
-                geocoding_progress[progress_id]['completed'] = True
-                
-                # Clean up the dataset directory
-                try:
-                    import shutil
-                    if os.path.exists(dataset_path):
-                        shutil.rmtree(dataset_path)
-                        print(f"Deleted canceled dataset directory: {dataset_path}")
-                except Exception as cleanup_error:
-                    print(f"Error cleaning up canceled dataset: {str(cleanup_error)}")
-                
-                # Clean up cancellation flag
-                geocoding_cancel_flags.pop(progress_id, None)
-                return
-            
-            # Clean and format address
-            address_parts = []
-            if row['Address'].strip():
-                address_parts.append(row['Address'].strip())
-            if row['City'].strip():
-                address_parts.append(row['City'].strip())
-            if row['State'].strip():
-                address_parts.append(row['State'].strip())
-            if row['Zip'].strip():
-                address_parts.append(row['Zip'].strip())
+        geocoding_progress[progress_id]['unique_addresses'] = group_count
+        geocoding_progress[progress_id]['duplicate_rows'] = valid_rows - group_count
+        geocoding_progress[progress_id]['dedup_ratio'] = round(dedup_ratio, 4)
+        logger.info("Deduplicated %d rows to %d unique addresses (%.1f%% fewer lookups)",
+                    valid_rows, group_count, dedup_ratio * 100, extra=log_fields)
+        end_stage('read')
+        
+        def is_canceled():
+            return geocoding_progress.cancel_requested(progress_id)
+        
+        latitudes = np.full(group_count, np.nan)
+        longitudes = np.full(group_count, np.nan)
+        failure_reasons = {}  # group id -> reason, for groups that were not found
+        needs_lookup = np.zeros(group_count, dtype=bool)
+        
+        def resolve(group, lat, lon, failure_reason):
+            if lat is not None:
+                latitudes[group], longitudes[group] = lat, lon
+            else:
+                failure_reasons[group] = failure_reason
+        
+        # Addresses finished before a cancel/restart come back from the checkpoint
+        completed = checkpoint.load(group_count)
+        for group, (lat, lon, failure_reason) in completed.items():
+            resolve(group, lat, lon, failure_reason)
+        resumed_rows = int(rows_per_group[list(completed)].sum()) if completed else 0
+        if completed:
+            logger.info("Resuming %s: %d rows restored from checkpoint", dataset_name, resumed_rows, extra=log_fields)
+        
+        # Consult the stored version (updates) and the shared geocode cache
+        # before spending a geocoder request
+        cache_hit_rows = 0
+        reused_rows = reused_groups = 0
+        for group, address in enumerate(group_addresses):
+            if group in completed:
+                continue
+            stored = previous.coordinates(group_keys[group]) if previous is not None else None
+            if stored is not None:
+                reused_rows += int(rows_per_group[group])
+                reused_groups += 1
+                resolve(group, stored[0], stored[1], None)
+                continue
+            cached = geocode_cache.lookup(address)
+            if cached is None:
+                needs_lookup[group] = True
+                continue
+            cache_hit_rows += int(rows_per_group[group])
+            resolve(group, cached[0], cached[1], "No results found (cached)")
+        processed = valid_rows - int(rows_per_group[needs_lookup].sum())
+        geocoding_progress[progress_id]['cache_hits'] = cache_hit_rows
+        geocoding_progress[progress_id]['resumed_rows'] = resumed_rows
+        geocoding_progress[progress_id]['reused_rows'] = reused_rows
+        geocoding_progress[progress_id]['cache_misses'] = valid_rows - processed
+        geocoding_progress[progress_id]['progress'] = processed
+        checkpoint.save_job(total_rows=valid_rows, processed_rows=processed)
+        geocoding_progress[progress_id].reset_rate()  # Throughput counts real lookups only
+        lookups = int(needs_lookup.sum())
+        cache_hits = group_count - len(completed) - reused_groups - lookups
+        CACHE_LOOKUPS.inc(cache_hits, result='hit')
+        CACHE_LOOKUPS.inc(lookups, result='miss')
+        logger.info("Geocode cache: %d hits, %d to geocode", cache_hits, lookups, extra=log_fields)
+        end_stage('cache')
+        
+        # Geocode the rest concurrently across the configured backends. The
+        # backends (and their rate limits) are shared by every upload.
+        pending = ((int(group), group_addresses[group]) for group in np.flatnonzero(needs_lookup))
+        geocoder_state_at = 0.0
+        for outcome in geocoding_engine.geocode_many(pending, should_cancel=is_canceled):
+            group, address = outcome.key, outcome.address
+            failure_reason = None
+            if outcome.found:
+                geocode_cache.store_hit(address, outcome.latitude, outcome.longitude)
+                logger.debug("Geocoded (%s): %s -> %s, %s", outcome.backend, address,
+                             outcome.latitude, outcome.longitude, extra=log_fields)
+            elif outcome.error is None:
+                failure_reason = "No results found"
+                geocode_cache.store_miss(address)
+                logger.debug("No results for: %s", address, extra=log_fields)
+            else:
+                failure_reason = outcome.error
+                logger.debug("Error geocoding %s: %s", address, outcome.error, extra=log_fields)
             
-            address = ', '.join(address_parts)
+            resolve(group, outcome.latitude, outcome.longitude, failure_reason)
+            checkpoint.record(group, outcome.latitude, outcome.longitude, failure_reason,
+                              rows=int(rows_per_group[group]))
+            processed += int(rows_per_group[group])
             geocoding_progress[progress_id]['current_address'] = address
-            geocoding_progress[progress_id]['progress'] = idx + 1
-            
-            lat, lon = None, None
-            geocoding_failed = False
-            failure_reason = ""
-            
-            try:
-                location = rate_limiter(address)
-                if location:
-                    lat, lon = location.latitude, location.longitude
-                    successful_geocodes += 1
-                    consecutive_failures = 0  # Reset failure counter on success
-                    print(f"✓ Geocoded: {address} -> {lat}, {lon}")
-                else:
-                    geocoding_failed = True
-                    failure_reason = "No results found"
-                    print(f"✗ No results for: {address}")
-                    
-            except Exception as e:
-                geocoding_failed = True
-                consecutive_failures += 1
-                error_msg = str(e)
-                failure_reason = error_msg
-                print(f"✗ Error geocoding {address}: {error_msg}")
+            geocoding_progress[progress_id]['progress'] = processed
+            # Live rate, backoff level and retry counts of each backend
+            if time.monotonic() - geocoder_state_at >= GEOCODER_STATE_INTERVAL:
+                geocoding_progress[progress_id]['geocoder'] = geocoding_engine.state()
+                geocoder_state_at = time.monotonic()
+        geocoding_progress[progress_id]['geocoder'] = geocoding_engine.state()
+        end_stage('geocode')
+
+        # Check for cancellation request. The checkpoint is kept so the job
+        # can be resumed later (or discarded with delete_dataset).
+        if is_canceled() and dataset_deleted():
+            finish_deleted()
+            return
+        if is_canceled():
+            logger.info("Geocoding canceled for progress_id: %s", progress_id, extra=log_fields)
+            GEOCODE_JOBS.inc(status='canceled')
+            checkpoint.flush()
+            checkpoint.save_job(status='canceled')
+            geocoding_progress[progress_id].update(
+                status='canceled', completed=True, resumable=True, dataset_name=dataset_name)
+            return
+        
+        # Pass 2: stream the upload again and write the dataset chunk by chunk
+        if dataset_deleted():
+            finish_deleted()
+            return
+        checkpoint.flush()
+        writer = dataset_store.writer(dataset_name, COLUMNS, FAILED_COLUMNS)
+        successful_geocodes = 0
+        failed_count = 0
+        offset = 0
+        try:
+            for df, _ in iter_clean_chunks(csv_file_path, layout):
+                groups = row_groups[offset:offset + len(df)]
+                offset += len(df)
+                df = df.reset_index(drop=True)
+                failed = np.isnan(latitudes[groups])
+                if previous is not None:
+                    previous.compare(df['PeopleID'].tolist(), [group_keys[group] for group in groups])
                 
-                # Check for rate limiting or service unavailable errors
-                if "timeout" in error_msg.lower() or "unavailable" in error_msg.lower() or "max retries" in error_msg.lower():
-                    print(f"⚠️  Service issue detected. Waiting extra time before continuing...")
-                    time.sleep(2)  # Extra delay for service issues
-                    
-                # If too many consecutive failures, pause longer
-                if consecutive_failures >= max_consecutive_failures:
-                    print(f"⚠️  {consecutive_failures} consecutive failures. Pausing for 10 seconds...")
-                    time.sleep(10)
-                    consecutive_failures = 0
-            
-            # Track failed addresses
-            if geocoding_failed:
-                failed_addresses.append({
-                    **row.to_dict(),
-                    'Full_Address': address,
-                    'Failure_Reason': failure_reason
-                })
+                result_df = df[~failed].copy()
+                result_df['Latitude'] = latitudes[groups[~failed]]
+                result_df['Longitude'] = longitudes[groups[~failed]]
+                writer.append_geocoded(result_df)
+                
+                # Track failed addresses
+                successful_geocodes += len(result_df)
+                if not failed.any():
+                    continue
+                failed_df = df[failed].copy()
+                failed_df['Full_Address'] = full_addresses(failed_df)
+                failed_df['Failure_Reason'] = [failure_reasons.get(group) or "Not geocoded"
+                                               for group in groups[failed]]
+                writer.append_failed(failed_df)
+                failed_count += len(failed_df)
             
-            results.append({
-                **row.to_dict(),
-                'Latitude': lat,
-                'Longitude': lon
-            })
-        
-        # Save results
-        result_df = pd.DataFrame(results)
-        cache_file = os.path.join(dataset_path, 'geocoded_cache.csv')
-        result_df.to_csv(cache_file, index=False)
+            stats = {
+                'successful_count': successful_geocodes,
+                'failed_count': failed_count,
+                'unique_addresses': group_count,
+                'dedup_ratio': round(dedup_ratio, 4),
+                'cache_hits': cache_hit_rows,
+                'source_rows': total_rows,
+            }
+            if previous is not None:
+                stats['update'] = previous.summary(reused_rows)
+            if dataset_deleted():
+                writer.abort()
+                finish_deleted()
+                return
+            writer.commit(stats)
+        except Exception:
+            writer.abort()
+            raise
+        dataset_store.invalidate(dataset_name)
+        dataset_store.get(dataset_name)  # Load now so the spatial index is built and persisted
+        end_stage('write')
+        GEOCODE_ROWS.inc(successful_geocodes, result='geocoded')
+        GEOCODE_ROWS.inc(failed_count, result='failed')
+        GEOCODE_JOBS.inc(status='completed')
+        
+        # Keep the original file
+        os.replace(csv_file_path, os.path.join(dataset_path, 'original.csv'))
+        checkpoint.finish()
+        
+        geocoding_progress[progress_id].update(
+            status='completed',
+            completed=True,
+            progress=valid_rows,
+            successful_count=successful_geocodes,
+            failed_count=failed_count,
+            has_failed_addresses=failed_count > 0,
+            update=stats.get('update'),
+        )
         
-        # Save failed addresses if any
-        if failed_addresses:
-            failed_df = pd.DataFrame(failed_addresses)
-            
-            # Rename 'Family Name' column to 'Name' if it exists
-            if 'Family Name' in failed_df.columns:
-                failed_df = failed_df.rename(columns={'Family Name': 'Name'})
-                print(f"Renamed 'Family Name' column to 'Name' in failed addresses")
-            
-            # Add PeopleID Link column
-            if 'PeopleID' in failed_df.columns:
-                failed_df['PeopleID Link'] = failed_df['PeopleID'].apply(
-                    lambda x: f"https://my.hpumc.org/Person2/{x}" if pd.notna(x) and str(x).strip() != '' else ''
-                )
-                print(f"Added PeopleID Link column for {len(failed_df)} failed addresses")
-            
-            failed_file = os.path.join(dataset_path, 'failed_addresses.csv')
-            failed_df.to_csv(failed_file, index=False)
-            print(f"Saved {len(failed_addresses)} failed addresses to {failed_file}")
-        
-        # Copy original file
-        original_file = os.path.join(dataset_path, 'original.csv')
-        raw_df.to_csv(original_file, index=False)
-        
-        geocoding_progress[progress_id]['status'] = 'completed'
-        geocoding_progress[progress_id]['completed'] = True
-        geocoding_progress[progress_id]['progress'] = len(df)
-        geocoding_progress[progress_id]['successful_count'] = successful_geocodes
-        geocoding_progress[progress_id]['failed_count'] = len(failed_addresses)
-        geocoding_progress[progress_id]['has_failed_addresses'] = len(failed_addresses) > 0
-        
-        # Print summary
-        print(f"Geocoding completed: {successful_geocodes}/{len(df)} addresses successfully geocoded")
-        if failed_addresses:
-            print(f"Failed to geocode {len(failed_addresses)} addresses")
+        logger.info("Geocoding completed: %d/%d addresses successfully geocoded, %d failed",
+                    successful_geocodes, valid_rows, failed_count,
+                    extra=dict(log_fields, geocoded=successful_geocodes, failed=failed_count))
+        if previous is not None:
+            logger.info("Updated %s: %s", dataset_name, stats['update'], extra=dict(log_fields, **stats['update']))
         
     except Exception as e:
-        print(f"Geocoding error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        geocoding_progress[progress_id]['status'] = 'error'
-        geocoding_progress[progress_id]['error'] = str(e)
+        if dataset_deleted():
+            finish_deleted()
+            return
+        logger.exception("Geocoding error: %s", e, extra=log_fields)
+        GEOCODE_JOBS.inc(status='error')
+        resumable = False
+        if checkpoint is not None and checkpoint.job:
+            try:
+                checkpoint.flush()
+                checkpoint.save_job(status='error', error=str(e))
+                resumable = True
+            except OSError as checkpoint_error:
+                logger.error("Error saving checkpoint: %s", checkpoint_error, extra=log_fields)
+        geocoding_progress[progress_id].update(status='error', error=str(e), resumable=resumable,
+                                               dataset_name=dataset_name)
     finally:
-        # Clean up uploaded file
-        if os.path.exists(csv_file_path):
-            os.remove(csv_file_path)
+        # Clean up uploaded file if it never made it into the dataset directory
+        if upload_file and os.path.exists(upload_file):
+            os.remove(upload_file)
         
         # Clean up cancellation flag
-        geocoding_cancel_flags.pop(progress_id, None)
+        geocoding_progress.clear_cancel(progress_id)
+
+def run_geocoding_job(job):
+    """Job queue handler: geocode (or resume) one dataset, return its final status"""
+    upload_file = job['payload'].get('upload_file')
+    # A job that was running before a restart has already moved its upload
+    # into the dataset directory, so it continues from the checkpoint
+    resume = job['payload'].get('resume') or not (upload_file and os.path.exists(upload_file))
+    with profiled('geocode', job['dataset_name'], enabled=job['payload'].get('profile')) as profile_name:
+        geocode_dataset(job['dataset_name'], upload_file, job['id'], resume=resume,
+                        update=job['payload'].get('update', False), profile=profile_name)
+    # The entry is dropped from memory once its final status is published
+    return (geocoding_progress.snapshot(job['id']) or {}).get('status', 'error')
+
+# Uploads are queued and geocoded by a fixed pool of workers (see job_queue.py)
+job_queue = JobQueue(GEOCODE_JOBS_PATH, run_geocoding_job, workers=GEOCODE_WORKERS,
+                     on_start=recover_interrupted_jobs)
+
+def queue_geocoding(dataset_name, payload, priority=0):
+    """Queue a geocoding job; its id doubles as the progress_id"""
+    job = job_queue.submit(dataset_name, payload, priority=priority)
+    geocoding_progress.publish(job['id'], {
+        'status': 'queued',
+        'progress': 0,
+        'total': 0,
+        'current_address': '',
+        'completed': False,
+        'error': None,
+        'dataset_name': dataset_name,
+    })
+    return job['id']
+
+def cancel_dataset_jobs(dataset_name=None):
+    """Drop queued jobs and stop running ones for a dataset (None = all).
+
+    Used before a dataset is deleted. A running job notices the cancel (and
+    the missing directory) and writes nothing back. Returns the dropped
+    queued jobs.
+    """
+    for job in job_queue.list_jobs([STATUS_RUNNING], limit=-1):
+        if dataset_name is None or job['dataset_name'] == dataset_name:
+            geocoding_progress.request_cancel(job['id'])
+    return job_queue.cancel_dataset(dataset_name)
+
+def parse_priority(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
 
 @app.route('/')
 def index():
@@ -406,29 +499,48 @@ def index():
     current_dataset = session.get('current_dataset')
     
     if current_dataset and current_dataset in [d['name'] for d in datasets]:
-        df = load_valid_addresses(current_dataset)
+        dataset = load_dataset(current_dataset)
     elif datasets:
         # Use the most recent dataset
         current_dataset = datasets[0]['name']
         session['current_dataset'] = current_dataset
-        df = load_valid_addresses(current_dataset)
+        dataset = load_dataset(current_dataset)
     else:
         # Try legacy file
-        df = load_valid_addresses()
+        dataset = load_dataset()
         current_dataset = 'Default'
     
-    addresses_json = df.to_json(orient='records')
-    address_count = len(df)
+    address_count = dataset.address_count if dataset is not None else 0
+    data_url = markers_url = None
+    if dataset is not None:
+        # Markers and rows are fetched by the page, so the shell stays small
+        url_args = {'dataset_name': dataset.name} if dataset.name else {}
+        data_url = url_for('dataset_data', **url_args)
+        markers_url = url_for('dataset_markers', **url_args)
     
     response = app.make_response(render_template('map.html', 
-                                                addresses_json=addresses_json,
+                                                data_url=data_url,
+                                                markers_url=markers_url,
                                                 address_count=address_count,
                                                 datasets=datasets,
-                                                current_dataset=current_dataset))
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+                                                current_dataset=current_dataset,
+                                                incomplete_jobs=list_jobs(UPLOAD_FOLDER)))
+    # Revalidated on every view, but answered with 304 when nothing changed
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/data')
+@app.route('/data/<dataset_name>')
+def dataset_data(dataset_name=None):
+    """Paginated, projected dataset rows as JSON (see data_api.py)"""
+    return dataset_rows_response(load_dataset(dataset_name), request)
+
+@app.route('/markers')
+@app.route('/markers/<dataset_name>')
+def dataset_markers(dataset_name=None):
+    """Clustered or individual markers inside the map viewport (see data_api.py)"""
+    return markers_response(load_dataset(dataset_name), request)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -452,12 +564,19 @@ def upload_file():
         try:
             os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         except Exception as e:
-            print(f"Error creating datasets directory: {str(e)}")
+            logger.error(f"Error creating datasets directory: {str(e)}")
             return jsonify({'error': f'Cannot create datasets directory: {str(e)}'}), 500
         
-        # Check if dataset already exists
+        # Check if dataset already exists (or is waiting in the queue). With
+        # mode=update the upload replaces an existing dataset instead.
+        update = request.form.get('mode') == 'update'
         dataset_path = os.path.join(UPLOAD_FOLDER, dataset_name)
-        if os.path.exists(dataset_path):
+        if update:
+            if not dataset_store.exists(dataset_name):
+                return jsonify({'error': 'Dataset to update not found'}), 404
+            if job_queue.has_active_job(dataset_name):
+                return jsonify({'error': 'Geocoding is already queued or running for this dataset'}), 409
+        elif os.path.exists(dataset_path) or dataset_store.exists(dataset_name) or job_queue.has_active_job(dataset_name):
             return jsonify({'error': 'Dataset name already exists'}), 400
         
         # Save uploaded file temporarily
@@ -467,26 +586,115 @@ def upload_file():
         try:
             file.save(temp_path)
         except Exception as e:
-            print(f"Error saving uploaded file: {str(e)}")
+            logger.error(f"Error saving uploaded file: {str(e)}")
             return jsonify({'error': f'Cannot save uploaded file: {str(e)}'}), 500
         
-        # Start geocoding in background
-        progress_id = str(uuid.uuid4())
-        thread = threading.Thread(target=geocode_dataset, args=(dataset_name, temp_path, progress_id))
-        thread.daemon = True
-        thread.start()
+        # Queue geocoding for the background workers
+        progress_id = queue_geocoding(dataset_name, {'upload_file': temp_path, 'update': update,
+                                                     'profile': profile_requested(request)},
+                                      priority=parse_priority(request.form.get('priority')))
         
         return jsonify({'progress_id': progress_id})
         
     except Exception as e:
-        print(f"Upload error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Upload error: {str(e)}")
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
+def progress_snapshot(progress_id):
+    """Current progress of a job as a plain dict (status 'not_found' if unknown)"""
+    progress = geocoding_progress.snapshot(progress_id)
+    if progress is not None:
+        if progress['status'] == 'queued':
+            progress['queue_position'] = job_queue.queue_position(progress_id)
+        return progress
+    # Not started by this process (e.g. after a restart): report the saved job
+    queued_job = job_queue.get(progress_id)
+    if queued_job is not None and queued_job['status'] == 'queued':
+        return {'status': 'queued', 'progress': 0, 'total': 0, 'completed': False,
+                'dataset_name': queued_job['dataset_name'],
+                'queue_position': job_queue.queue_position(progress_id)}
+    job = find_job(UPLOAD_FOLDER, progress_id)
+    if job is None:
+        return {'status': 'not_found'}
+    return {
+        'status': job['status'],
+        # Rows, like the live progress (manifests from before they were kept count addresses)
+        'progress': job.get('processed_rows', job.get('processed', 0)),
+        'total': job.get('total_rows', job.get('total', 0)),
+        'dataset_name': job['dataset_name'],
+        'resumable': job['status'] in RESUMABLE_STATUSES,
+        'error': job.get('error'),
+    }
+
 @app.route('/progress/<progress_id>')
 def get_progress(progress_id):
-    return jsonify(geocoding_progress.get(progress_id, {'status': 'not_found'}))
+    return jsonify(progress_snapshot(progress_id))
+
+@app.route('/progress/<progress_id>/stream')
+def stream_progress(progress_id):
+    """Server-Sent Events: one event per progress change, until the job ends.
+
+    The job may run in another server process, so listeners wait on the
+    shared progress store, whose one watcher thread per process checks the
+    published versions of every watched job. Bursts of changes are
+    coalesced to one event per progress_store.POLL_INTERVAL.
+    """
+    def events():
+        version = geocoding_progress.version(progress_id)
+        last_event = None
+        while True:
+            snapshot = progress_snapshot(progress_id)
+            status = snapshot['status']
+            event = json.dumps(snapshot)
+            if event != last_event:
+                yield f"data: {event}\n\n"
+                last_event = event
+            else:
+                yield ": keep-alive\n\n"
+            if status in TERMINAL_STATUSES or (version is None and status != 'queued'):
+                return
+            # Queue positions change without the job's own progress changing
+            timeout = PROGRESS_QUEUE_REFRESH if status == 'queued' else PROGRESS_HEARTBEAT
+            version = geocoding_progress.wait_for_change(progress_id, version, timeout)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy buffer the stream
+    return response
+
+@app.route('/resume_geocoding/<dataset_name>', methods=['POST'])
+def resume_geocoding(dataset_name):
+    """Resume a canceled or interrupted geocoding job from its checkpoint"""
+    dataset_path = os.path.join(UPLOAD_FOLDER, dataset_name)
+    checkpoint = GeocodeCheckpoint(dataset_path)
+    job = checkpoint.job
+    if not job or not os.path.exists(checkpoint.upload_path):
+        return jsonify({'success': False, 'error': 'No resumable geocoding job for this dataset'}), 404
+    if job_queue.has_active_job(dataset_name):
+        return jsonify({'success': False, 'error': 'Geocoding is already queued or running for this dataset',
+                        'progress_id': job.get('progress_id')}), 409
+    
+    progress_id = queue_geocoding(dataset_name, {'resume': True, 'profile': profile_requested(request)},
+                                  priority=parse_priority(request.args.get('priority')))
+    
+    return jsonify({'success': True, 'progress_id': progress_id})
+
+@app.route('/jobs')
+def list_geocoding_jobs():
+    """Geocoding jobs: running and queued first, then recently finished"""
+    statuses = [s for s in request.args.get('status', '').split(',') if s]
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    jobs = job_queue.list_jobs(statuses or None, limit=limit)
+    for job in jobs:
+        progress = geocoding_progress.snapshot(job['id']) if job['status'] == 'running' else None
+        if progress:
+            job['progress'] = progress.get('progress', 0)
+            job['total'] = progress.get('total', 0)
+        job['payload'].pop('upload_file', None)  # Server-side path
+    return jsonify({'workers': job_queue.workers, 'jobs': jobs})
 
 @app.route('/cancel_geocoding/<progress_id>', methods=['POST'])
 def cancel_geocoding(progress_id):
@@ -498,63 +706,44 @@ def cancel_geocoding(progress_id):
         if not dataset_name:
             return jsonify({'success': False, 'error': 'Dataset name is required'}), 400
         
+        # A job still waiting in the queue is simply dropped
+        job = job_queue.cancel(progress_id)
+        if job is not None:
+            upload_file = job['payload'].get('upload_file')
+            if upload_file and os.path.exists(upload_file):
+                os.remove(upload_file)
+            geocoding_progress.publish(progress_id, {
+                'status': 'canceled', 'progress': 0, 'total': 0, 'completed': True, 'error': None,
+                'dataset_name': job['dataset_name'], 'resumable': bool(job['payload'].get('resume')),
+            })
+            logger.info(f"Removed queued job {progress_id} for dataset: {dataset_name}")
+            return jsonify({'success': True, 'message': 'Queued geocoding canceled'})
+        
         # Set cancellation flag
-        geocoding_cancel_flags[progress_id] = True
-        print(f"Cancellation requested for progress_id: {progress_id}, dataset: {dataset_name}")
+        geocoding_progress.request_cancel(progress_id)
+        logger.info(f"Cancellation requested for progress_id: {progress_id}, dataset: {dataset_name}")
         
         return jsonify({'success': True, 'message': 'Cancellation request sent'})
         
     except Exception as e:
-        print(f"Error canceling geocoding: {str(e)}")
+        logger.error(f"Error canceling geocoding: {str(e)}")
         return jsonify({'success': False, 'error': f'Failed to cancel geocoding: {str(e)}'}), 500
 
 @app.route('/download_failed_addresses/<dataset_name>')
 def download_failed_addresses(dataset_name):
     """Download failed addresses for a specific dataset"""
     try:
-        failed_file = os.path.join(UPLOAD_FOLDER, dataset_name, 'failed_addresses.csv')
+        dataset = load_dataset(dataset_name)
+        failed_df = dataset.failed_df() if dataset is not None else pd.DataFrame()
         
-        if not os.path.exists(failed_file):
+        if failed_df.empty:
             return jsonify({'error': 'No failed addresses file found for this dataset'}), 404
         
-        # Read the failed addresses CSV and rename the column
-        try:
-            failed_df = pd.read_csv(failed_file)
-            
-            # Rename 'Family Name' column to 'Name' if it exists
-            if 'Family Name' in failed_df.columns:
-                failed_df = failed_df.rename(columns={'Family Name': 'Name'})
-                print(f"Renamed 'Family Name' column to 'Name' for failed addresses download")
-            
-            # Add PeopleID Link column if it doesn't exist
-            if 'PeopleID' in failed_df.columns and 'PeopleID Link' not in failed_df.columns:
-                failed_df['PeopleID Link'] = failed_df['PeopleID'].apply(
-                    lambda x: f"https://my.hpumc.org/Person2/{x}" if pd.notna(x) and str(x).strip() != '' else ''
-                )
-                print(f"Added PeopleID Link column for {len(failed_df)} failed addresses download")
-            
-            # Create a temporary file with the renamed column
-            output = io.StringIO()
-            failed_df.to_csv(output, index=False)
-            output.seek(0)
-            
-            filename = f'failed_addresses_{dataset_name}.csv'
-            return send_file(io.BytesIO(output.getvalue().encode()), 
-                            mimetype='text/csv', 
-                            as_attachment=True, 
-                            download_name=filename)
-            
-        except Exception as e:
-            print(f"Error processing failed addresses file: {str(e)}")
-            # Fallback to original file if processing fails
-            filename = f'failed_addresses_{dataset_name}.csv'
-            return send_file(failed_file, 
-                            mimetype='text/csv', 
-                            as_attachment=True, 
-                            download_name=filename)
+        # Stream the CSV export of the stored failed rows
+        return dataframe_csv_response(failed_df, f'failed_addresses_{dataset_name}.csv', request)
         
     except Exception as e:
-        print(f"Error downloading failed addresses: {str(e)}")
+        logger.error(f"Error downloading failed addresses: {str(e)}")
         return jsonify({'error': f'Failed to download failed addresses: {str(e)}'}), 500
 
 @app.route('/switch_dataset/<dataset_name>')
@@ -568,29 +757,33 @@ def clear_all_datasets():
     try:
         import shutil
         
+        # Drop queued jobs and stop running ones; uploads go with the directory
+        cancel_dataset_jobs()
+        
         # Remove the entire datasets directory
         if os.path.exists(UPLOAD_FOLDER):
             shutil.rmtree(UPLOAD_FOLDER)
-            print(f"Removed datasets directory: {UPLOAD_FOLDER}")
+            logger.info(f"Removed datasets directory: {UPLOAD_FOLDER}")
+        dataset_store.clear()
         
         # Recreate the empty datasets directory
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        print(f"Recreated datasets directory: {UPLOAD_FOLDER}")
+        logger.info(f"Recreated datasets directory: {UPLOAD_FOLDER}")
         
         # Clear the current dataset from session
         session.pop('current_dataset', None)
         
-        print("All datasets cleared successfully")
+        logger.info("All datasets cleared successfully")
         return jsonify({'success': True, 'message': 'All datasets cleared successfully'})
         
     except Exception as e:
-        print(f"Error clearing datasets: {str(e)}")
+        logger.error(f"Error clearing datasets: {str(e)}")
         # Try to recreate the directory even if deletion failed
         try:
             os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            print(f"Recreated datasets directory after error: {UPLOAD_FOLDER}")
+            logger.info(f"Recreated datasets directory after error: {UPLOAD_FOLDER}")
         except Exception as create_error:
-            print(f"Error recreating datasets directory: {str(create_error)}")
+            logger.error(f"Error recreating datasets directory: {str(create_error)}")
         
         return jsonify({'success': False, 'error': f'Failed to clear datasets: {str(e)}'}), 500
 
@@ -603,24 +796,36 @@ def delete_dataset(dataset_name):
         # Construct the dataset path
         dataset_path = os.path.join(UPLOAD_FOLDER, dataset_name)
         
+        # Drop queued jobs for this dataset and stop a running one
+        canceled_jobs = cancel_dataset_jobs(dataset_name)
+        for job in canceled_jobs:
+            upload_file = job['payload'].get('upload_file')
+            if upload_file and os.path.exists(upload_file):
+                os.remove(upload_file)
+        
         # Check if dataset exists
-        if not os.path.exists(dataset_path):
+        if not os.path.exists(dataset_path) and not dataset_store.exists(dataset_name):
+            if canceled_jobs:
+                return jsonify({'success': True, 'message': f'Queued geocoding for "{dataset_name}" removed'})
             return jsonify({'success': False, 'error': 'Dataset not found'}), 404
         
-        # Remove the dataset directory
-        shutil.rmtree(dataset_path)
-        print(f"Removed dataset directory: {dataset_path}")
+        # Remove the dataset's rows, then its directory (job checkpoints and
+        # the original upload stay there with either storage backend)
+        if dataset_store.exists(dataset_name):
+            dataset_store.delete(dataset_name)
+        shutil.rmtree(dataset_path, ignore_errors=True)
+        logger.info(f"Removed dataset directory: {dataset_path}")
         
         # If this was the current dataset, clear it from session
         if session.get('current_dataset') == dataset_name:
             session.pop('current_dataset', None)
-            print(f"Cleared current dataset from session: {dataset_name}")
+            logger.info(f"Cleared current dataset from session: {dataset_name}")
         
-        print(f"Dataset '{dataset_name}' deleted successfully")
+        logger.info(f"Dataset '{dataset_name}' deleted successfully")
         return jsonify({'success': True, 'message': f'Dataset "{dataset_name}" deleted successfully'})
         
     except Exception as e:
-        print(f"Error deleting dataset '{dataset_name}': {str(e)}")
+        logger.error(f"Error deleting dataset '{dataset_name}': {str(e)}")
         return jsonify({'success': False, 'error': f'Failed to delete dataset: {str(e)}'}), 500
 
 @app.route('/export_csv', methods=['POST'])
@@ -630,43 +835,93 @@ def export_csv():
     radius = data['radius']  # in meters
     
     current_dataset = session.get('current_dataset')
-    df = load_valid_addresses(current_dataset)
+    dataset = load_dataset(current_dataset)
     
-    def haversine(lat1, lon1, lat2, lon2):
-        R = 6371000  # meters
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
-        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-        return 2*R*math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
-    selected = df[df.apply(lambda row: haversine(center[0], center[1], row['Latitude'], row['Longitude']) <= radius, axis=1)]
+    if dataset is not None:
+        # Spatial index lookup + vectorized haversine over the cached coordinates
+        positions = dataset.select_radius(center[0], center[1], radius)
+        df = dataset.df
+    else:
+        positions, df = [], None
     
-    # Make a copy to avoid SettingWithCopyWarning
-    selected = selected.copy()
+    # Rows are formatted and sent a chunk at a time (Name/PeopleID Link columns
+    # are added per chunk, see csv_export.py)
+    filename = f'selected_addresses_{current_dataset or "default"}.csv'
+    response = dataframe_csv_response(df, filename, request, positions=positions)
+    response.headers['X-Selected-Count'] = str(len(positions))
+    return response
+
+@app.route('/export_zones', methods=['POST'])
+def export_zones():
+    """Export many polygon/circle zones at once (see zones.py)"""
+    data = {} if request.json is None else request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    dataset_name = data.get('dataset') or session.get('current_dataset')
+    return zones_export_response(load_dataset(dataset_name), data, request, dataset_name or 'default')
+
+@app.route('/groups', methods=['POST'])
+def export_groups():
+    """Split a dataset into K balanced geographic groups (see grouping.py)"""
+    data = {} if request.json is None else request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    dataset_name = data.get('dataset') or session.get('current_dataset')
+    return groups_response(load_dataset(dataset_name), data, request, dataset_name or 'default')
+
+@app.route('/query/<dataset_name>')
+def query_dataset(dataset_name):
+    """Return the rows within a radius of a point as JSON (no CSV is built)"""
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius = float(request.args['radius'])  # in meters
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat, lon and radius query parameters are required numbers'}), 400
     
-    # Rename 'Family Name' column to 'Name' if it exists
-    if 'Family Name' in selected.columns:
-        selected = selected.rename(columns={'Family Name': 'Name'})
-        print(f"Renamed 'Family Name' column to 'Name' for export")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or radius < 0:
+        return jsonify({'error': 'lat/lon out of range or negative radius'}), 400
     
-    # Add PeopleID Link column
-    if 'PeopleID' in selected.columns:
-        selected['PeopleID Link'] = selected['PeopleID'].apply(
-            lambda x: f"https://my.hpumc.org/Person2/{x}" if pd.notna(x) and str(x).strip() != '' else ''
-        )
-        print(f"Added PeopleID Link column for {len(selected)} selected addresses")
+    dataset = load_dataset(dataset_name)
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found'}), 404
     
-    output = io.StringIO()
-    selected.to_csv(output, index=False)
-    output.seek(0)
+    positions = dataset.select_radius(lat, lon, radius)
+    selected = dataset.df.iloc[positions].copy()
+    selected['Distance_m'] = haversine_m(lat, lon, dataset.latitudes[positions], dataset.longitudes[positions])
     
-    filename = f'selected_addresses_{current_dataset or "default"}.csv'
-    return send_file(io.BytesIO(output.getvalue().encode()), 
-                     mimetype='text/csv', 
-                     as_attachment=True, 
-                     download_name=filename)
+    return jsonify({
+        'dataset': dataset_name,
+        'center': [lat, lon],
+        'radius': radius,
+        'count': len(selected),
+        'rows': json.loads(selected.to_json(orient='records'))
+    })
+
+@app.route('/nearest/<dataset_name>', methods=['GET', 'POST'])
+def nearest_rows(dataset_name):
+    """The k rows nearest a point (GET) or each of a list of points (POST); see nearest.py"""
+    return nearest_response(load_dataset(dataset_name), request, dataset_name)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of every server process; see metrics.py"""
+    return metrics_response()
+
+@app.route('/profiles')
+def list_profiles():
+    """Saved request and job profiles (needs the profiling token); see profiling.py"""
+    return profiles_response(request)
+
+@app.route('/profiles/<name>')
+def download_profile(name):
+    return profile_response(name, request)
+
+# Start draining the queue, including jobs left over from a previous run. With
+# the debug reloader only the serving child process runs the workers; with
+# GEOCODE_RUNNER=external (gunicorn) geocode_runner.py does.
+if GEOCODE_RUNNER == 'web' and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+    job_queue.start()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8765) 
\ No newline at end of file
@@ -8,13 +8,12 @@ Cross-platform support for Windows, macOS, and Linux
 import os
 import sys
 import json
+import logging
 import webbrowser
 import threading
 import time
 import platform
-import math
 import uuid
-from datetime import datetime
 from pathlib import Path
 
 # Add the current directory to Python path for imports
@@ -28,11 +27,17 @@ else:
 sys.path.insert(0, application_path)
 
 try:
-    from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session
+    from flask import Flask, render_template, request, jsonify, redirect, url_for, session
     from werkzeug.utils import secure_filename
     import pandas as pd
-    from geopy.geocoders import Nominatim
-    from geopy.extra.rate_limiter import RateLimiter
+    from geocoders import create_backend
+    from geocode_cache import GeocodeCache
+    from dataset_store import DatasetStore
+    from data_api import dataset_rows_response, markers_response
+    from csv_export import dataframe_csv_response
+    from zones import zones_export_response
+    from grouping import groups_response
+    from structured_log import configure_logging
 except ImportError as e:
     print(f"Error importing required modules: {e}")
     print("Please make sure all dependencies are installed.")
@@ -42,6 +47,9 @@ except ImportError as e:
         input("Press Enter to exit...")
     sys.exit(1)
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.secret_key = 'family-mapping-standalone-key'
 
@@ -49,10 +57,17 @@ app.secret_key = 'family-mapping-standalone-key'
 UPLOAD_FOLDER = os.path.join(application_path, 'datasets')
 ALLOWED_EXTENSIONS = {'csv'}
 COLUMNS = ['Family Name', 'Address', 'City', 'State', 'Zip', 'PeopleID']
+GEOCODE_CACHE_PATH = os.path.join(application_path, 'geocode_cache.sqlite')
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Geocode cache shared by every dataset (same format as app.py)
+geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH)
+
+# Parsed datasets kept in memory between requests
+dataset_store = DatasetStore(UPLOAD_FOLDER)
+
 # Global progress tracking
 geocoding_progress = {}
 geocoding_cancel_flags = {}  # Track cancellation requests
@@ -65,35 +80,7 @@ def get_datasets():
     datasets = []
     if os.path.exists(UPLOAD_FOLDER):
         try:
-            for item in os.listdir(UPLOAD_FOLDER):
-                dataset_path = os.path.join(UPLOAD_FOLDER, item)
-                if os.path.isdir(dataset_path):
-                    cache_file = os.path.join(dataset_path, 'geocoded_cache.csv')
-                    if os.path.exists(cache_file):
-                        # Check if file is not empty/corrupted
-                        if os.path.getsize(cache_file) < 10:
-                            print(f"Warning: Skipping corrupted dataset {item} (cache file too small)")
-                            continue
-                            
-                        # Get file modification time
-                        mod_time = datetime.fromtimestamp(os.path.getmtime(cache_file))
-                        # Count addresses
-                        try:
-                            df = pd.read_csv(cache_file)
-                            count = len(df)
-                        except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
-                            print(f"Warning: Skipping corrupted dataset {item}: {str(e)}")
-                            continue
-                        except Exception as e:
-                            print(f"Warning: Error reading dataset {item}: {str(e)}")
-                            count = 0
-                            
-                        datasets.append({
-                            'name': item,
-                            'path': dataset_path,
-                            'last_modified': mod_time.strftime('%Y-%m-%d %H:%M'),
-                            'address_count': count
-                        })
+            datasets = dataset_store.list_datasets()
         except (PermissionError, OSError) as e:
             print(f"Warning: Cannot access datasets directory: {str(e)}")
             # Recreate the directory if it doesn't exist or has permission issues
@@ -108,40 +95,18 @@ def get_datasets():
         except Exception as create_error:
             print(f"Error creating datasets directory: {str(create_error)}")
     
-    return sorted(datasets, key=lambda x: x['last_modified'], reverse=True)
+    return datasets
+
+def load_dataset(dataset_name=None):
+    """Get the in-memory Dataset for a dataset name (None = legacy file)"""
+    return dataset_store.get(dataset_name)
 
 def load_valid_addresses(dataset_name=None):
-    """Load addresses from a specific dataset or default"""
-    if dataset_name:
-        cache_file = os.path.join(UPLOAD_FOLDER, dataset_name, 'geocoded_cache.csv')
-    else:
-        cache_file = 'geocoded_cache.csv'  # Default legacy file
-    
-    if not os.path.exists(cache_file):
+    """Load addresses from a specific dataset or default (read-only DataFrame)"""
+    dataset = load_dataset(dataset_name)
+    if dataset is None:
         return pd.DataFrame()
-    
-    # Check if file is empty or too small
-    if os.path.getsize(cache_file) < 10:  # Less than 10 bytes is likely empty/corrupted
-        print(f"Warning: {cache_file} is empty or corrupted (size: {os.path.getsize(cache_file)} bytes)")
-        return pd.DataFrame()
-    
-    try:
-        df = pd.read_csv(cache_file)
-    except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
-        print(f"Error reading {cache_file}: {str(e)}")
-        return pd.DataFrame()
-    
-    # Check if DataFrame is empty or missing required columns
-    if df.empty or 'Latitude' not in df.columns or 'Longitude' not in df.columns:
-        return pd.DataFrame()
-    
-    # Filter out rows with missing or invalid lat/lon
-    df = df.dropna(subset=['Latitude', 'Longitude'])
-    df = df[(df['Latitude'].apply(lambda x: isinstance(x, (int, float)) or str(x).replace('.', '', 1).isdigit())) &
-            (df['Longitude'].apply(lambda x: isinstance(x, (int, float)) or str(x).replace('.', '', 1).isdigit()))]
-    df['Latitude'] = df['Latitude'].astype(float)
-    df['Longitude'] = df['Longitude'].astype(float)
-    return df
+    return dataset.df
 
 def geocode_dataset(dataset_name, csv_file_path, progress_id):
     """Geocode a dataset in the background"""
@@ -153,7 +118,9 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
             'total': 0,
             'current_address': '',
             'completed': False,
-            'error': None
+            'error': None,
+            'cache_hits': 0,
+            'cache_misses': 0
         }
         
         # Create dataset directory
@@ -237,9 +204,8 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
         geocoding_progress[progress_id]['total'] = len(df)
         geocoding_progress[progress_id]['status'] = 'geocoding'
         
-        # Initialize geocoder
-        geolocator = Nominatim(user_agent="FamilyMappingApp/1.0")
-        geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+        # Public Nominatim at 1 request/second, slowing down and retrying when throttled
+        geocoder = create_backend({'type': 'nominatim'}, user_agent="FamilyMappingApp/1.0")
         
         geocoded_data = []
         failed_addresses = []
@@ -247,7 +213,7 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
         for index, row in df.iterrows():
             # Check for cancellation
             if geocoding_cancel_flags.get(progress_id, False):
-                print(f"Geocoding cancelled for progress_id: {progress_id}")
+                logger.info("Geocoding cancelled for progress_id: %s", progress_id)
                 geocoding_progress[progress_id]['status'] = 'cancelled'
                 return
             
@@ -266,35 +232,43 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
             geocoding_progress[progress_id]['progress'] = index + 1
             geocoding_progress[progress_id]['current_address'] = full_address
             
-            print(f"Geocoding {index + 1}/{len(df)}: {full_address}")
+            logger.debug("Geocoding %d/%d: %s", index + 1, len(df), full_address)
             
-            try:
-                location = geocode(full_address)
-                if location:
-                    geocoded_data.append({
-                        'Family Name': row['Family Name'],
-                        'Address': row['Address'],
-                        'City': row['City'],
-                        'State': row['State'],
-                        'Zip': row['Zip'],
-                        'PeopleID': row['PeopleID'],
-                        'Latitude': location.latitude,
-                        'Longitude': location.longitude,
-                        'Full Address': full_address
-                    })
-                else:
-                    failed_addresses.append({
-                        'Family Name': row['Family Name'],
-                        'Address': row['Address'],
-                        'City': row['City'],
-                        'State': row['State'],
-                        'Zip': row['Zip'],
-                        'PeopleID': row['PeopleID'],
-                        'Full Address': full_address,
-                        'Error': 'No location found'
-                    })
-            except Exception as e:
-                print(f"Error geocoding {full_address}: {str(e)}")
+            # Reuse a cached location if this address was geocoded before
+            cached = geocode_cache.lookup(full_address)
+            if cached is not None:
+                geocoding_progress[progress_id]['cache_hits'] += 1
+                latitude, longitude = cached
+                error = None if latitude is not None else 'No location found (cached)'
+            else:
+                geocoding_progress[progress_id]['cache_misses'] += 1
+                latitude, longitude, error = None, None, None
+                try:
+                    location = geocoder.geocode(full_address)
+                    if location:
+                        latitude, longitude = location
+                        geocode_cache.store_hit(full_address, latitude, longitude)
+                    else:
+                        error = 'No location found'
+                        geocode_cache.store_miss(full_address)
+                except Exception as e:
+                    logger.debug("Error geocoding %s: %s", full_address, e)
+                    error = str(e)
+                geocoding_progress[progress_id]['geocoder'] = [geocoder.state()]
+            
+            if error is None:
+                geocoded_data.append({
+                    'Family Name': row['Family Name'],
+                    'Address': row['Address'],
+                    'City': row['City'],
+                    'State': row['State'],
+                    'Zip': row['Zip'],
+                    'PeopleID': row['PeopleID'],
+                    'Latitude': latitude,
+                    'Longitude': longitude,
+                    'Full Address': full_address
+                })
+            else:
                 failed_addresses.append({
                     'Family Name': row['Family Name'],
                     'Address': row['Address'],
@@ -303,7 +277,7 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
                     'Zip': row['Zip'],
                     'PeopleID': row['PeopleID'],
                     'Full Address': full_address,
-                    'Error': str(e)
+                    'Error': error
                 })
         
         # Save results
@@ -317,6 +291,11 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
             failed_file = os.path.join(dataset_path, 'failed_addresses.csv')
             failed_df.to_csv(failed_file, index=False)
         
+        if geocoded_data:
+            # Load now: converts the CSVs to columnar storage and builds the spatial index
+            dataset_store.invalidate(dataset_name)
+            dataset_store.get(dataset_name)
+        
         # Update final progress
         geocoding_progress[progress_id]['status'] = 'completed'
         geocoding_progress[progress_id]['completed'] = True
@@ -324,10 +303,10 @@ def geocode_dataset(dataset_name, csv_file_path, progress_id):
         geocoding_progress[progress_id]['failed_count'] = len(failed_addresses)
         geocoding_progress[progress_id]['has_failed_addresses'] = len(failed_addresses) > 0
         
-        print(f"Geocoding completed: {len(geocoded_data)} successful, {len(failed_addresses)} failed")
+        logger.info("Geocoding completed: %d successful, %d failed", len(geocoded_data), len(failed_addresses))
         
     except Exception as e:
-        print(f"Error in geocode_dataset: {str(e)}")
+        logger.exception("Error in geocode_dataset: %s", e)
         geocoding_progress[progress_id]['error'] = str(e)
         geocoding_progress[progress_id]['status'] = 'error'
 
@@ -337,29 +316,47 @@ def index():
     current_dataset = session.get('current_dataset')
     
     if current_dataset and current_dataset in [d['name'] for d in datasets]:
-        df = load_valid_addresses(current_dataset)
+        dataset = load_dataset(current_dataset)
     elif datasets:
         # Use the most recent dataset
         current_dataset = datasets[0]['name']
         session['current_dataset'] = current_dataset
-        df = load_valid_addresses(current_dataset)
+        dataset = load_dataset(current_dataset)
     else:
         # Try legacy file
-        df = load_valid_addresses()
+        dataset = load_dataset()
         current_dataset = 'Default'
     
-    addresses_json = df.to_json(orient='records')
-    address_count = len(df)
+    address_count = dataset.address_count if dataset is not None else 0
+    data_url = markers_url = None
+    if dataset is not None:
+        # Markers and rows are fetched by the page, so the shell stays small
+        url_args = {'dataset_name': dataset.name} if dataset.name else {}
+        data_url = url_for('dataset_data', **url_args)
+        markers_url = url_for('dataset_markers', **url_args)
     
     response = app.make_response(render_template('map.html', 
-                                                addresses_json=addresses_json,
+                                                data_url=data_url,
+                                                markers_url=markers_url,
                                                 address_count=address_count,
                                                 datasets=datasets,
                                                 current_dataset=current_dataset))
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+    # Revalidated on every view, but answered with 304 when nothing changed
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/data')
+@app.route('/data/<dataset_name>')
+def dataset_data(dataset_name=None):
+    """Paginated, projected dataset rows as JSON (see data_api.py)"""
+    return dataset_rows_response(load_dataset(dataset_name), request)
+
+@app.route('/markers')
+@app.route('/markers/<dataset_name>')
+def dataset_markers(dataset_name=None):
+    """Clustered or individual markers inside the map viewport (see data_api.py)"""
+    return markers_response(load_dataset(dataset_name), request)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -426,6 +423,7 @@ def cancel_geocoding(progress_id):
             import shutil
             try:
                 shutil.rmtree(dataset_path)
+                dataset_store.invalidate(dataset_name)
                 print(f"Deleted dataset directory: {dataset_path}")
             except Exception as e:
                 print(f"Error deleting dataset directory: {str(e)}")
@@ -445,47 +443,14 @@ def cancel_geocoding(progress_id):
 def download_failed_addresses(dataset_name):
     """Download failed addresses for a specific dataset"""
     try:
-        failed_file = os.path.join(UPLOAD_FOLDER, dataset_name, 'failed_addresses.csv')
+        dataset = load_dataset(dataset_name)
+        failed_df = dataset.failed_df() if dataset is not None else pd.DataFrame()
         
-        if not os.path.exists(failed_file):
+        if failed_df.empty:
             return jsonify({'error': 'No failed addresses file found for this dataset'}), 404
         
-        # Read the failed addresses CSV and rename the column
-        try:
-            failed_df = pd.read_csv(failed_file)
-            
-            # Rename 'Family Name' column to 'Name' if it exists
-            if 'Family Name' in failed_df.columns:
-                failed_df = failed_df.rename(columns={'Family Name': 'Name'})
-                print(f"Renamed 'Family Name' column to 'Name' for failed addresses download")
-            
-            # Add PeopleID Link column if it doesn't exist
-            if 'PeopleID' in failed_df.columns and 'PeopleID Link' not in failed_df.columns:
-                failed_df['PeopleID Link'] = failed_df['PeopleID'].apply(
-                    lambda x: f"https://my.hpumc.org/Person2/{x}" if pd.notna(x) and str(x).strip() != '' else ''
-                )
-                print(f"Added PeopleID Link column for {len(failed_df)} failed addresses download")
-            
-            # Create a temporary file with the renamed column
-            import io
-            output = io.StringIO()
-            failed_df.to_csv(output, index=False)
-            output.seek(0)
-            
-            filename = f'failed_addresses_{dataset_name}.csv'
-            return send_file(io.BytesIO(output.getvalue().encode()), 
-                            mimetype='text/csv', 
-                            as_attachment=True, 
-                            download_name=filename)
-            
-        except Exception as e:
-            print(f"Error processing failed addresses file: {str(e)}")
-            # Fallback to original file if processing fails
-            filename = f'failed_addresses_{dataset_name}.csv'
-            return send_file(failed_file, 
-                            mimetype='text/csv', 
-                            as_attachment=True, 
-                            download_name=filename)
+        # Stream the CSV export of the stored failed rows
+        return dataframe_csv_response(failed_df, f'failed_addresses_{dataset_name}.csv', request)
         
     except Exception as e:
         print(f"Error downloading failed addresses: {str(e)}")
@@ -504,6 +469,7 @@ def clear_all_datasets():
         import shutil
         if os.path.exists(UPLOAD_FOLDER):
             shutil.rmtree(UPLOAD_FOLDER)
+        dataset_store.invalidate()
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         session.pop('current_dataset', None)
         return jsonify({'success': True})
@@ -518,6 +484,7 @@ def delete_dataset(dataset_name):
         dataset_path = os.path.join(UPLOAD_FOLDER, dataset_name)
         if os.path.exists(dataset_path):
             shutil.rmtree(dataset_path)
+        dataset_store.invalidate(dataset_name)
         
         # Clear session if this was the current dataset
         if session.get('current_dataset') == dataset_name:
@@ -534,44 +501,35 @@ def export_csv():
     radius = data['radius']  # in meters
     
     current_dataset = session.get('current_dataset')
-    df = load_valid_addresses(current_dataset)
-    
-    def haversine(lat1, lon1, lat2, lon2):
-        R = 6371000  # meters
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
-        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-        return 2*R*math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
-    selected = df[df.apply(lambda row: haversine(center[0], center[1], row['Latitude'], row['Longitude']) <= radius, axis=1)]
+    dataset = load_dataset(current_dataset)
     
-    # Make a copy to avoid SettingWithCopyWarning
-    selected = selected.copy()
-    
-    # Rename 'Family Name' column to 'Name' if it exists
-    if 'Family Name' in selected.columns:
-        selected = selected.rename(columns={'Family Name': 'Name'})
-        print(f"Renamed 'Family Name' column to 'Name' for export")
-    
-    # Add PeopleID Link column
-    if 'PeopleID' in selected.columns:
-        selected['PeopleID Link'] = selected['PeopleID'].apply(
-            lambda x: f"https://my.hpumc.org/Person2/{x}" if pd.notna(x) and str(x).strip() != '' else ''
-        )
-        print(f"Added PeopleID Link column for {len(selected)} selected addresses")
-    
-    import io
-    output = io.StringIO()
-    selected.to_csv(output, index=False)
-    output.seek(0)
+    if dataset is not None:
+        # Spatial index lookup + vectorized haversine over the cached coordinates
+        positions = dataset.select_radius(center[0], center[1], radius)
+        df = dataset.df
+    else:
+        positions, df = [], None
     
+    # Rows are formatted and sent a chunk at a time (Name/PeopleID Link columns
+    # are added per chunk, see csv_export.py)
     filename = f'selected_addresses_{current_dataset or "default"}.csv'
-    return send_file(io.BytesIO(output.getvalue().encode()), 
-                     mimetype='text/csv', 
-                     as_attachment=True, 
-                     download_name=filename)
+    response = dataframe_csv_response(df, filename, request, positions=positions)
+    response.headers['X-Selected-Count'] = str(len(positions))
+    return response
+
+@app.route('/export_zones', methods=['POST'])
+def export_zones():
+    """Export many polygon/circle zones at once (see zones.py)"""
+    data = request.json or {}
+    dataset_name = data.get('dataset') or session.get('current_dataset')
+    return zones_export_response(load_dataset(dataset_name), data, request, dataset_name or 'default')
+
+@app.route('/groups', methods=['POST'])
+def export_groups():
+    """Split a dataset into K balanced geographic groups (see grouping.py)"""
+    data = request.json or {}
+    dataset_name = data.get('dataset') or session.get('current_dataset')
+    return groups_response(load_dataset(dataset_name), data, request, dataset_name or 'default')
 
 def open_browser():
     """Open the default web browser to the app"""
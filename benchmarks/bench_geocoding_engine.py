@@ -0,0 +1,61 @@
+"""
+Benchmark: geocoding engine throughput against the local stub geocoder
+
+Starts stub_geocoder.py in-process and pushes synthetic addresses through
+GeocodingEngine with different concurrency levels, reporting addresses/second.
+No real provider is contacted. --max-rate makes the stub answer 429 above that
+many requests/second and --error-rate fails a fraction of requests with 503,
+to see how the adaptive rate controller settles (rate, retries, failures).
+
+Usage:
+    python benchmarks/bench_geocoding_engine.py [--rows 2000] [--latency 0.02] [--concurrency 1 4 16]
+        [--max-rate 100] [--error-rate 0.02]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geocoders import GeocodingEngine, backends_from_config  # noqa: E402
+from stub_geocoder import serve_in_thread  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02, help='stub response latency in seconds')
+    parser.add_argument('--miss-rate', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--rate', type=float, default=None, help='per-backend rate limit (requests/second)')
+    parser.add_argument('--max-rate', type=float, default=None, help='stub answers 429 above this requests/second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of stub requests failing with 503')
+    args = parser.parse_args()
+
+    server, url = serve_in_thread(latency=args.latency, miss_rate=args.miss_rate,
+                                  max_rate=args.max_rate, error_rate=args.error_rate)
+    try:
+        print(f"{'concurrency':>11} {'rows':>8} {'found':>8} {'failed':>7} {'seconds':>9} {'rows/s':>9} "
+              f"{'retries':>8} {'latency ms':>11}")
+        for concurrency in args.concurrency:
+            engine = GeocodingEngine(backends_from_config([
+                {'type': 'stub', 'url': url, 'concurrency': concurrency, 'rate': args.rate}
+            ]))
+            items = ((i, f"{i} Benchmark Ave, Dallas, TX, 75201") for i in range(args.rows))
+            start = time.perf_counter()
+            found = failed = 0
+            for outcome in engine.geocode_many(items):
+                found += outcome.found
+                failed += outcome.error is not None
+            elapsed = time.perf_counter() - start
+            state = engine.state()[0]
+            print(f"{concurrency:>11} {args.rows:>8} {found:>8} {failed:>7} {elapsed:9.2f} {args.rows / elapsed:9.0f} "
+                  f"{state['retries']:>8} {state['latency_ms'] or 0:11.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
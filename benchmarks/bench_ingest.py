@@ -0,0 +1,111 @@
+"""
+Benchmark: whole-file vs streaming CSV ingestion
+
+Writes a synthetic roster CSV (default 1M rows, roughly half of them sharing an
+address) and compares:
+
+  legacy     read the whole file (twice, as the header fallback did), then
+             fillna/astype/filter copies and to_dict('records')
+  streaming  ingest.sniff_layout + ingest.group_rows_by_address (chunked
+             read, clean, full address and dedup key per row)
+
+Each method is timed once untraced, then run again under tracemalloc to
+measure peak memory (Python objects and NumPy/pandas buffers).
+
+Usage:
+    python benchmarks/bench_ingest.py [--rows 1000000] [--chunk-size 50000] [--keep FILE]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import group_rows_by_address, sniff_layout  # noqa: E402
+
+STREETS = ['Main St', 'Elm Street', 'N Oak Ave', 'Lovers Ln', 'Preston Rd', 'Mockingbird Lane']
+
+
+def write_synthetic_csv(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    households = max(1, rows * 2 // 3)
+    chunk = 200_000
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('Family Name,Address,Extra,City,State,Zip,PeopleID\n')
+        for start in range(0, rows, chunk):
+            n = min(chunk, rows - start)
+            household = rng.integers(0, households, n)
+            numbers = 100 + household // len(STREETS)
+            streets = np.array(STREETS)[household % len(STREETS)]
+            zips = 75201 + household % 50
+            lines = [f"Family {start + i},{number} {street},,Dallas,TX,{zip_code}-1234,{start + i}\n"
+                     for i, (number, street, zip_code) in enumerate(zip(numbers, streets, zips))]
+            f.writelines(lines)
+
+
+def legacy_ingest(path):
+    raw_df = pd.read_csv(path)
+    raw_df = pd.read_csv(path, header=None, low_memory=False)  # Header fallback re-read
+    df = pd.DataFrame({
+        'Family Name': raw_df.iloc[:, 0], 'Address': raw_df.iloc[:, 1], 'City': raw_df.iloc[:, 3],
+        'State': raw_df.iloc[:, 4], 'Zip': raw_df.iloc[:, 5], 'PeopleID': raw_df.iloc[:, 6],
+    })
+    df = df.fillna('')
+    df = df.astype(str)
+    df = df[df['Address'].str.strip() != '']
+    df = df[df['City'].str.strip() != '']
+    df = df[df['State'].str.strip() != '']
+    df['Zip'] = df['Zip'].str.split('-').str[0]
+    records = df.to_dict('records')
+    return len(records)
+
+
+def streaming_ingest(path, chunk_size):
+    layout = sniff_layout(path)
+    groups = group_rows_by_address(path, layout, chunk_size=chunk_size)
+    return len(groups.row_groups), len(groups.addresses)
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    parser.add_argument('--keep', help='write the synthetic CSV here and keep it')
+    args = parser.parse_args()
+
+    path = args.keep or os.path.join(tempfile.mkdtemp(), 'synthetic_roster.csv')
+    print(f"Writing {args.rows} synthetic rows to {path}...")
+    write_synthetic_csv(path, args.rows)
+    print(f"File size: {os.path.getsize(path) / 1e6:.1f} MB")
+
+    try:
+        print(f"{'method':>10} {'rows':>9} {'unique':>9} {'seconds':>9} {'peak MB':>9}")
+        rows, elapsed, peak = measure(legacy_ingest, path)
+        print(f"{'legacy':>10} {rows:>9} {'-':>9} {elapsed:9.2f} {peak:9.1f}")
+        (rows, unique), elapsed, peak = measure(streaming_ingest, path, args.chunk_size)
+        print(f"{'streaming':>10} {rows:>9} {unique:>9} {elapsed:9.2f} {peak:9.1f}")
+    finally:
+        if not args.keep:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: circle selection for /export_csv
+
+Compares the original per-row `df.apply` haversine against the vectorized
+bounding-box + NumPy haversine in spatial.py (full scan and GridIndex) on
+synthetic datasets of 1k, 10k, 100k and 1M addresses, and checks that all of
+them select exactly the same rows.
+
+Usage:
+    python benchmarks/bench_radius_selection.py [--sizes 1000 10000 ...] [--max-legacy-rows N]
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial import GridIndex, select_within_radius  # noqa: E402
+
+DALLAS = (32.7767, -96.7970)
+
+
+def legacy_haversine(lat1, lon1, lat2, lon2):
+    R = 6371000  # meters
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+    return 2*R*math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def legacy_select(df, center, radius):
+    return df[df.apply(lambda row: legacy_haversine(center[0], center[1], row['Latitude'], row['Longitude']) <= radius, axis=1)]
+
+
+def vectorized_select(df, latitudes, longitudes, center, radius):
+    return df.iloc[select_within_radius(latitudes, longitudes, center[0], center[1], radius)]
+
+
+def make_dataset(rows, seed=42):
+    """Synthetic metro-area dataset: points scattered ~50 km around Dallas"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Family Name': [f'Family {i}' for i in range(rows)],
+        'Latitude': DALLAS[0] + rng.normal(0, 0.25, rows),
+        'Longitude': DALLAS[1] + rng.normal(0, 0.3, rows),
+    })
+
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--radius', type=float, default=5000, help='selection radius in meters')
+    parser.add_argument('--max-legacy-rows', type=int, default=1_000_000,
+                        help='skip the slow df.apply baseline above this many rows')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    center = [DALLAS[0] + 0.02, DALLAS[1] - 0.03]
+    print(f"{'rows':>10} {'selected':>9} {'legacy (s)':>11} {'vectorized (s)':>15} {'indexed (s)':>12} {'speedup':>8}")
+    for rows in args.sizes:
+        df = make_dataset(rows)
+        latitudes = df['Latitude'].to_numpy(dtype=np.float64)
+        longitudes = df['Longitude'].to_numpy(dtype=np.float64)
+
+        vec_time, vec_selected = timed(
+            lambda: vectorized_select(df, latitudes, longitudes, center, args.radius), args.repeat)
+        index = GridIndex.build(latitudes, longitudes)
+        index_time, index_positions = timed(
+            lambda: index.query_radius(latitudes, longitudes, center[0], center[1], args.radius), args.repeat)
+        if not np.array_equal(df.index[index_positions], vec_selected.index):
+            raise SystemExit(f"Indexed selection differs at {rows} rows")
+
+        if rows <= args.max_legacy_rows:
+            legacy_time, legacy_selected = timed(lambda: legacy_select(df, center, args.radius), 1)
+            if not legacy_selected.index.equals(vec_selected.index):
+                raise SystemExit(f"Selections differ at {rows} rows")
+            legacy_text = f"{legacy_time:11.4f}"
+            speedup = f"{legacy_time / vec_time:7.0f}x"
+        else:
+            legacy_text = f"{'skipped':>11}"
+            speedup = f"{'-':>8}"
+
+        print(f"{rows:>10} {len(vec_selected):>9} {legacy_text} {vec_time:15.5f} {index_time:12.5f} {speedup}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark: columnar directories vs the SQLite/R*Tree dataset backend
+
+Writes the same synthetic dataset with both backends and reports write time,
+dataset listing time, load time (coordinates, then rows) and the time of
+circle and box selections (grid index vs R*Tree), checking that both
+backends select the same rows.
+
+Usage:
+    python benchmarks/bench_sqlite_store.py [--rows 100000] [--datasets 20] [--queries 200]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_store import DatasetStore  # noqa: E402
+from sqlite_store import SqliteDatasetStore  # noqa: E402
+
+DALLAS = (32.7767, -96.7970)
+COLUMNS = ['Family Name', 'Address', 'City', 'State', 'Zip', 'PeopleID']
+FAILED_COLUMNS = COLUMNS + ['Full_Address', 'Failure_Reason']
+CHUNK_ROWS = 50_000
+
+
+def make_rows(rows, seed=42):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Family Name': [f'Family {i}' for i in range(rows)],
+        'Address': [f'{i % 9999 + 1} Main St' for i in range(rows)],
+        'City': 'Dallas',
+        'State': 'TX',
+        'Zip': [f'75{i % 300:03d}' for i in range(rows)],
+        'PeopleID': [str(i) for i in range(rows)],
+        'Latitude': DALLAS[0] + rng.normal(0, 0.25, rows),
+        'Longitude': DALLAS[1] + rng.normal(0, 0.3, rows),
+    })
+
+
+def write(store, name, df):
+    writer = store.writer(name, COLUMNS, FAILED_COLUMNS)
+    for start in range(0, len(df), CHUNK_ROWS):
+        writer.append_geocoded(df.iloc[start:start + CHUNK_ROWS])
+    writer.commit()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--datasets', type=int, default=20, help='small datasets added for the listing')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    df = make_rows(args.rows)
+    rng = np.random.default_rng(7)
+    centers = np.column_stack([DALLAS[0] + rng.normal(0, 0.2, args.queries),
+                               DALLAS[1] + rng.normal(0, 0.25, args.queries)])
+    radii = rng.uniform(500, 5000, args.queries)
+    work = tempfile.mkdtemp()
+    try:
+        stores = {
+            'columnar': DatasetStore(os.path.join(work, 'datasets')),
+            'sqlite': SqliteDatasetStore(os.path.join(work, 'datasets.sqlite')),
+        }
+        os.makedirs(stores['columnar'].upload_folder)
+        selections = {}
+        print(f"{args.rows} rows, {args.datasets + 1} datasets, {args.queries} queries")
+        print(f"{'backend':>9} {'write s':>8} {'list ms':>8} {'load s':>7} {'rows s':>7} "
+              f"{'circle ms':>10} {'box ms':>7}")
+        for backend, store in stores.items():
+            write_time, _ = timed(lambda: write(store, 'big', df))
+            for number in range(args.datasets):
+                write(store, f'small-{number}', df.iloc[:100])
+            list_time, listing = timed(store.list_datasets)
+            assert len(listing) == args.datasets + 1
+            store.invalidate()
+            load_time, dataset = timed(lambda: store.get('big'))
+            rows_time, _ = timed(lambda: dataset.df)
+            circle_time, circles = timed(lambda: [dataset.select_radius(lat, lon, radius)
+                                                  for (lat, lon), radius in zip(centers, radii)])
+            box_time, boxes = timed(lambda: [dataset.select_bbox(lat - 0.02, lat + 0.02, lon - 0.03, lon + 0.03)
+                                             for lat, lon in centers])
+            selections[backend] = circles + boxes
+            print(f"{backend:>9} {write_time:8.2f} {list_time * 1000:8.2f} {load_time:7.3f} {rows_time:7.3f} "
+                  f"{circle_time / args.queries * 1000:10.3f} {box_time / args.queries * 1000:7.3f}")
+        if not all(np.array_equal(a, b) for a, b in zip(selections['columnar'], selections['sqlite'])):
+            raise SystemExit('Backends selected different rows')
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
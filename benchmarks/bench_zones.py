@@ -0,0 +1,143 @@
+"""
+Benchmark: batch zone selection for /export_zones
+
+Resolves a plan of polygon and circle zones (default 50 zones over 100k
+addresses) three ways and checks they agree:
+
+  per-point   a pure-Python ray cast per address per polygon (what a
+              row-by-row implementation would do; skipped above
+              --max-legacy-rows)
+  full scan   spatial.points_in_polygon over every address for each zone
+  indexed     Dataset.select_polygon / select_radius: grid index bounding-box
+              lookup, then vectorized tests on the candidates only
+
+and times zone_assignment (the Zone column of the CSV export) on top.
+
+Usage:
+    python benchmarks/bench_zones.py [--rows 100000] [--zones 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_store import Dataset  # noqa: E402
+from spatial import points_in_polygon, select_within_radius  # noqa: E402
+from zones import Zone, select_zones, zone_assignment  # noqa: E402
+
+DALLAS = (32.7767, -96.7970)
+
+
+def legacy_point_in_polygon(lat, lon, vertices):
+    inside = False
+    j = len(vertices) - 1
+    for i in range(len(vertices)):
+        (y1, x1), (y2, x2) = vertices[i], vertices[j]
+        if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        j = i
+    return inside
+
+
+def make_dataset(rows, seed=42):
+    """Synthetic metro-area dataset: points scattered ~50 km around Dallas"""
+    rng = np.random.default_rng(seed)
+    latitudes = DALLAS[0] + rng.normal(0, 0.25, rows)
+    longitudes = DALLAS[1] + rng.normal(0, 0.3, rows)
+    return Dataset('bench', None, (0.0, rows), rows, latitudes, longitudes)
+
+
+def make_zones(count, seed=7):
+    """Irregular polygons (8-24 corners, ~2-6 km across) and a few circles"""
+    rng = np.random.default_rng(seed)
+    zones = []
+    for number in range(count):
+        center = (DALLAS[0] + rng.normal(0, 0.15), DALLAS[1] + rng.normal(0, 0.18))
+        if number % 5 == 4:
+            zones.append(Zone(f'Circle {number}', 'circle', None, center, float(rng.uniform(1000, 3000))))
+            continue
+        corners = int(rng.integers(8, 25))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, corners))
+        radii = rng.uniform(0.01, 0.03, corners)
+        vertices = np.column_stack([center[0] + radii * np.sin(angles), center[1] + radii * np.cos(angles)])
+        zones.append(Zone(f'Polygon {number}', 'polygon', vertices, None, None))
+    return zones
+
+
+def full_scan(dataset, zones):
+    selections = []
+    for zone in zones:
+        if zone.kind == 'circle':
+            selections.append(select_within_radius(dataset.latitudes, dataset.longitudes,
+                                                   zone.center[0], zone.center[1], zone.radius))
+        else:
+            selections.append(np.flatnonzero(points_in_polygon(dataset.latitudes, dataset.longitudes,
+                                                               zone.vertices)))
+    return selections
+
+
+def per_point(dataset, zones):
+    points = list(zip(dataset.latitudes.tolist(), dataset.longitudes.tolist()))
+    selections = []
+    for zone in zones:
+        if zone.kind == 'circle':
+            selections.append(select_within_radius(dataset.latitudes, dataset.longitudes,
+                                                   zone.center[0], zone.center[1], zone.radius))
+        else:
+            vertices = zone.vertices.tolist()
+            selections.append(np.array([i for i, (lat, lon) in enumerate(points)
+                                        if legacy_point_in_polygon(lat, lon, vertices)], dtype=np.int64))
+    return selections
+
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def same(a, b):
+    return all(np.array_equal(x, y) for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--zones', type=int, default=50)
+    parser.add_argument('--max-legacy-rows', type=int, default=100_000,
+                        help='skip the per-point baseline above this many rows')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.rows)
+    zones = make_zones(args.zones)
+
+    indexed_time, indexed = timed(lambda: select_zones(dataset, zones), args.repeat)
+    scan_time, scanned = timed(lambda: full_scan(dataset, zones), args.repeat)
+    if not same(indexed, scanned):
+        raise SystemExit('Indexed and full-scan selections differ')
+    assign_time, (positions, _) = timed(lambda: zone_assignment(zones, indexed), args.repeat)
+
+    print(f"{args.rows} addresses, {len(zones)} zones, {sum(len(s) for s in indexed)} selections, "
+          f"{len(positions)} addresses in at least one zone")
+    if args.rows <= args.max_legacy_rows:
+        legacy_time, legacy = timed(lambda: per_point(dataset, zones), 1)
+        if not same(legacy, indexed):
+            raise SystemExit('Per-point and indexed selections differ')
+        print(f"  per-point  {legacy_time:9.4f} s")
+    print(f"  full scan  {scan_time:9.4f} s")
+    print(f"  indexed    {indexed_time:9.4f} s")
+    print(f"  assignment {assign_time:9.4f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+Benchmark suite: ingestion, page load and export, with JSON results
+
+Runs each case in a fresh subprocess (so its peak RSS is its own) against
+synthetic data, with geocoding served by the in-process stub geocoder so no
+provider rate limit is involved:
+
+  ingest      geocode_dataset over an uploaded CSV of N unique addresses:
+              cold (every address goes to the stub) and cached (the same
+              addresses again, answered by the geocode cache) rows/s
+  page_load   GET / plus the first /markers request with N datasets on disk:
+              cold (fresh process, dataset loaded from disk) and warm latency
+  export      POST /export_csv for circles selecting about N rows of a
+              large dataset, streaming the whole CSV
+
+Every case reports peak RSS. Results go to a JSON file (with the git commit,
+Python version and machine) that a later run can be compared against.
+
+Usage:
+    python benchmarks/run_suite.py [--quick] [--output results.json] [--compare previous.json]
+    python benchmarks/run_suite.py --ingest-rows 1000 10000 100000 --export-rows 1000000
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DALLAS = (32.7767, -96.7970)
+WARM_REPEATS = 5
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unavailable)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# ===== Synthetic data =====
+
+def make_upload_csv(path, rows, seed=0):
+    """An upload CSV of `rows` families at unique addresses"""
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(rows)
+    pd.DataFrame({
+        'Family Name': [f'Family {i}' for i in numbers],
+        'Address': [f'{i} Benchmark Ave' for i in numbers],
+        'City': 'Dallas',
+        'State': 'TX',
+        'Zip': rng.integers(75201, 75399, rows).astype(str),
+        'PeopleID': numbers.astype(str),
+    }).to_csv(path, index=False)
+
+
+def make_dataset(upload_folder, name, rows, seed=0):
+    """Write a geocoded dataset straight to columnar storage"""
+    from columnar_store import DatasetWriter
+    from ingest import COLUMNS
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(rows)
+    df = pd.DataFrame({
+        'Family Name': [f'Family {i}' for i in numbers],
+        'Address': [f'{i} Benchmark Ave' for i in numbers],
+        'City': 'Dallas',
+        'State': 'TX',
+        'Zip': '75201',
+        'PeopleID': numbers.astype(str),
+    })
+    df['Latitude'] = DALLAS[0] + rng.normal(0, 0.25, rows)
+    df['Longitude'] = DALLAS[1] + rng.normal(0, 0.3, rows)
+    dataset_path = os.path.join(upload_folder, name)
+    os.makedirs(dataset_path, exist_ok=True)
+    writer = DatasetWriter(dataset_path, COLUMNS, COLUMNS + ['Full_Address', 'Failure_Reason'])
+    writer.append_geocoded(df)
+    writer.commit({'benchmark': True})
+    return df
+
+
+def import_app(stub_url=None):
+    """Import app.py in the current (scratch) directory, quietly"""
+    if stub_url:
+        os.environ['GEOCODER_BACKENDS'] = json.dumps([{'type': 'stub', 'url': stub_url, 'concurrency': 16}])
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        import app
+    return app
+
+
+# ===== Cases (run inside the worker subprocess) =====
+
+def case_ingest(rows):
+    from stub_geocoder import serve_in_thread
+    server, url = serve_in_thread()
+    app = import_app(url)
+    timings = {}
+    for run in ('cold', 'cached'):
+        make_upload_csv(f'{run}.csv', rows)  # Same addresses both times; the upload is moved into the dataset
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            app.geocode_dataset(f'ingest_{run}', f'{run}.csv', f'ingest_{run}')
+        timings[run] = time.perf_counter() - start
+        status = app.geocoding_progress[f'ingest_{run}']['status']
+        if status != 'completed':
+            raise RuntimeError(f'{run} ingest ended with status {status}')
+    server.shutdown()
+    return {
+        'rows': rows,
+        'cold_seconds': round(timings['cold'], 3),
+        'cold_rows_per_second': round(rows / timings['cold'], 1),
+        'cached_seconds': round(timings['cached'], 3),
+        'cached_rows_per_second': round(rows / timings['cached'], 1),
+    }
+
+
+def case_page_load(datasets, rows_per_dataset):
+    for number in range(datasets):
+        make_dataset('datasets', f'dataset_{number:03d}', rows_per_dataset, seed=number)
+    app = import_app()
+    client = app.app.test_client()
+    viewport = '?bbox=-97.3,32.5,-96.3,33.05&zoom=11'
+
+    def load_page():
+        start = time.perf_counter()
+        page = client.get('/')
+        # Like the browser: fetch the markers URL the page was rendered with
+        markers_url = json.loads(re.search(rb'var markersUrl = (.*?);', page.data).group(1))
+        data = client.get(markers_url + viewport)
+        if page.status_code != 200 or data.status_code != 200:
+            raise RuntimeError(f'page load failed: {page.status_code}/{data.status_code}')
+        return time.perf_counter() - start
+
+    cold = load_page()
+    # Without conditional headers, so every repeat renders the page and markers
+    warm = statistics.median(load_page() for _ in range(WARM_REPEATS))
+    return {
+        'datasets': datasets,
+        'rows_per_dataset': rows_per_dataset,
+        'cold_ms': round(cold * 1000, 1),
+        'warm_ms': round(warm * 1000, 1),
+    }
+
+
+def case_export(rows, selections):
+    from spatial import haversine_m
+    df = make_dataset('datasets', 'export', rows)
+    app = import_app()
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['current_dataset'] = 'export'
+    distances = np.sort(haversine_m(DALLAS[0], DALLAS[1], df['Latitude'].to_numpy(), df['Longitude'].to_numpy()))
+    del df
+    # Loading the dataset and decoding its columns happens once, on first use
+    start = time.perf_counter()
+    client.get('/data/export?limit=1')
+    load_seconds = time.perf_counter() - start
+    results = []
+    for target in selections:
+        radius = float(distances[min(target, rows) - 1])
+        start = time.perf_counter()
+        response = client.post('/export_csv', json={'center': list(DALLAS), 'radius': radius}, buffered=False)
+        size = sum(len(chunk) for chunk in response.response)
+        elapsed = time.perf_counter() - start
+        results.append({
+            'selected': int(response.headers['X-Selected-Count']),
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(int(response.headers['X-Selected-Count']) / elapsed, 1),
+            'bytes': size,
+        })
+    return {'rows': rows, 'load_seconds': round(load_seconds, 3), 'exports': results}
+
+
+CASES = {'ingest': case_ingest, 'page_load': case_page_load, 'export': case_export}
+
+
+def run_worker(spec):
+    """Run one case in a scratch directory and print its result as JSON"""
+    case = json.loads(spec)
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        baseline = peak_rss_mb()
+        result = CASES[case['case']](**case['args'])
+        result['peak_rss_mb'] = peak_rss_mb()
+        result['baseline_rss_mb'] = baseline
+        os.chdir(ROOT)
+    print(json.dumps(result))
+    sys.stdout.flush()
+    os._exit(0)  # Skip waiting on the app's background threads
+
+
+# ===== Driver =====
+
+def run_case(case, **args):
+    spec = json.dumps({'case': case, 'args': args})
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', spec],
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise SystemExit(f'{case} {args} failed:\n{completed.stderr}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return dict(case=case, **result)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def summary_metrics(results):
+    """Flat {metric name: value} view of a run, for comparisons"""
+    metrics = {}
+    for result in results:
+        if result['case'] == 'ingest':
+            prefix = f"ingest[{result['rows']}]"
+            metrics[f'{prefix}.cold_rows_per_second'] = result['cold_rows_per_second']
+            metrics[f'{prefix}.cached_rows_per_second'] = result['cached_rows_per_second']
+        elif result['case'] == 'page_load':
+            prefix = f"page_load[{result['datasets']}]"
+            metrics[f'{prefix}.cold_ms'] = result['cold_ms']
+            metrics[f'{prefix}.warm_ms'] = result['warm_ms']
+        else:
+            prefix = f"export[{result['rows']}]"
+            metrics[f'{prefix}.load_seconds'] = result.get('load_seconds')
+            for export in result['exports']:
+                metrics[f"{prefix}[{export['selected']}].seconds"] = export['seconds']
+        metrics[f'{prefix}.peak_rss_mb'] = result['peak_rss_mb']
+    return metrics
+
+
+def compare(previous_path, results):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = summary_metrics(json.load(f)['results'])
+    current = summary_metrics(results)
+    print(f"\nCompared with {previous_path}:")
+    print(f"{'metric':<48} {'before':>12} {'after':>12} {'change':>8}")
+    for metric, value in current.items():
+        before = previous.get(metric)
+        if before is None or value is None:
+            continue
+        change = f'{(value - before) / before * 100:+.0f}%' if before else '-'
+        print(f'{metric:<48} {before:>12} {value:>12} {change:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--quick', action='store_true', help='small sizes only (a smoke run)')
+    parser.add_argument('--ingest-rows', type=int, nargs='+', default=[1_000, 10_000])
+    parser.add_argument('--dataset-counts', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--rows-per-dataset', type=int, default=10_000)
+    parser.add_argument('--export-rows', type=int, default=1_000_000, help='size of the export dataset')
+    parser.add_argument('--export-selections', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/suite-<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+        return
+    if args.quick:
+        args.ingest_rows = [1_000]
+        args.dataset_counts = [1, 10]
+        args.rows_per_dataset = 1_000
+        args.export_rows = 10_000
+        args.export_selections = [100, 1_000, 10_000]
+
+    results = []
+    for rows in args.ingest_rows:
+        result = run_case('ingest', rows=rows)
+        print(f"ingest {rows:>9} rows: {result['cold_rows_per_second']:>9} rows/s cold, "
+              f"{result['cached_rows_per_second']:>9} rows/s cached, peak {result['peak_rss_mb']} MB")
+        results.append(result)
+    for count in args.dataset_counts:
+        result = run_case('page_load', datasets=count, rows_per_dataset=args.rows_per_dataset)
+        print(f"page load {count:>4} datasets: {result['cold_ms']:>8} ms cold, {result['warm_ms']:>8} ms warm, "
+              f"peak {result['peak_rss_mb']} MB")
+        results.append(result)
+    selections = [n for n in args.export_selections if n <= args.export_rows]
+    result = run_case('export', rows=args.export_rows, selections=selections)
+    for export in result['exports']:
+        print(f"export {export['selected']:>9} of {args.export_rows} rows: {export['seconds']:>7} s "
+              f"({export['rows_per_second']} rows/s, {export['bytes']} bytes)")
+    print(f"export dataset load {result['load_seconds']} s, peak {result['peak_rss_mb']} MB")
+    results.append(result)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         f"suite-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
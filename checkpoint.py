@@ -0,0 +1,180 @@
+"""
+Incremental checkpointing for geocoding jobs
+
+While a dataset is being geocoded its directory holds:
+
+  pending_upload.csv  the uploaded file, kept until the job completes
+  job.json            job manifest: status, progress counters, progress_id
+  checkpoint.jsonl    append-only log, one line per geocoded address
+
+The manifest counts progress twice: total/processed in unique addresses
+(what the checkpoint is checked against) and total_rows/processed_rows in
+upload rows, the unit of the live progress bar (/progress), so a job
+reported from its manifest after a restart keeps the same scale.
+
+Entries are keyed on the job's unique-address index, which is stable for a
+given upload. The log is flushed (and fsynced) every CHECKPOINT_EVERY
+entries, so a crash, restart or cancel loses at most that many lookups.
+Resuming a job re-reads the upload, replays the checkpoint and only geocodes
+the addresses that are not in it yet.
+"""
+
+import json
+import logging
+import os
+import time
+
+JOB_FILENAME = 'job.json'
+CHECKPOINT_FILENAME = 'checkpoint.jsonl'
+PENDING_UPLOAD_FILENAME = 'pending_upload.csv'
+CHECKPOINT_EVERY = 25  # addresses
+CHECKPOINT_MAX_AGE = 5  # seconds between flushes while rows trickle in
+
+# Job states that can be picked up again with resume
+RESUMABLE_STATUSES = ('canceled', 'interrupted', 'error')
+
+logger = logging.getLogger(__name__)
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_job(dataset_path):
+    """Return a dataset directory's job manifest, or None"""
+    try:
+        with open(os.path.join(dataset_path, JOB_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class GeocodeCheckpoint:
+    """Checkpoint files for one dataset's geocoding job"""
+
+    def __init__(self, dataset_path, checkpoint_every=CHECKPOINT_EVERY):
+        self.dataset_path = dataset_path
+        self.job_file = os.path.join(dataset_path, JOB_FILENAME)
+        self.checkpoint_file = os.path.join(dataset_path, CHECKPOINT_FILENAME)
+        self.upload_path = os.path.join(dataset_path, PENDING_UPLOAD_FILENAME)
+        self.checkpoint_every = checkpoint_every
+        self.job = read_job(dataset_path) or {}
+        self._buffer = []
+        self._last_flush = time.time()
+
+    def start(self, dataset_name, upload_file, progress_id):
+        """Begin a new job, moving the uploaded file into the dataset directory"""
+        os.makedirs(self.dataset_path, exist_ok=True)
+        os.replace(upload_file, self.upload_path)
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        now = time.time()
+        self.job = {
+            'dataset_name': dataset_name,
+            'progress_id': progress_id,
+            'status': 'running',
+            'total': 0,
+            'processed': 0,
+            'total_rows': 0,
+            'processed_rows': 0,
+            'created_at': now,
+            'updated_at': now,
+            'error': None,
+        }
+        self.save_job()
+
+    def resume(self, progress_id):
+        """Mark an existing job as running again under a new progress_id"""
+        self.job.update({'progress_id': progress_id, 'status': 'running', 'error': None})
+        self.save_job()
+
+    def save_job(self, **fields):
+        self.job.update(fields)
+        self.job['updated_at'] = time.time()
+        _write_json_atomic(self.job_file, self.job)
+
+    def load(self, total):
+        """Replay the checkpoint log: {index: (lat, lon, failure_reason)}.
+
+        If the job was started for a different number of addresses (the
+        upload was mapped differently), the old checkpoint is discarded.
+        """
+        if self.job.get('total') not in (0, None, total):
+            logger.warning("Checkpoint for %s does not match upload (%s != %d addresses); starting over",
+                           self.dataset_path, self.job.get('total'), total)
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+        completed = {}
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn final line from a crash mid-write
+                    completed[entry['i']] = (entry['lat'], entry['lon'], entry['reason'])
+        self.save_job(total=total, processed=len(completed))
+        return completed
+
+    def record(self, position, latitude, longitude, failure_reason=None, rows=1):
+        """Append one finished address (shared by `rows` upload rows); flushes every checkpoint_every entries"""
+        self._buffer.append(json.dumps({'i': position, 'lat': latitude, 'lon': longitude,
+                                        'reason': failure_reason}))
+        self.job['processed'] = self.job.get('processed', 0) + 1
+        self.job['processed_rows'] = self.job.get('processed_rows', 0) + rows
+        if len(self._buffer) >= self.checkpoint_every or time.time() - self._last_flush >= CHECKPOINT_MAX_AGE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with open(self.checkpoint_file, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(self._buffer) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._buffer = []
+        self._last_flush = time.time()
+        self.save_job()
+
+    def finish(self):
+        """Job completed: drop the checkpoint log and the pending upload"""
+        self._buffer = []
+        for path in (self.checkpoint_file, self.upload_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.save_job(status='completed')
+
+
+def list_jobs(upload_folder):
+    """Job manifests of every dataset directory that has not completed"""
+    jobs = []
+    if not os.path.isdir(upload_folder):
+        return jobs
+    for item in os.listdir(upload_folder):
+        dataset_path = os.path.join(upload_folder, item)
+        job = read_job(dataset_path) if os.path.isdir(dataset_path) else None
+        if job and job.get('status') != 'completed':
+            jobs.append({**job, 'dataset_name': item})
+    return sorted(jobs, key=lambda job: job.get('updated_at', 0), reverse=True)
+
+
+def find_job(upload_folder, progress_id):
+    """Find a job manifest by the progress_id it was last run under"""
+    for job in list_jobs(upload_folder):
+        if job.get('progress_id') == progress_id:
+            return job
+    return None
+
+
+def mark_interrupted_jobs(upload_folder):
+    """Jobs still marked running at startup died with the previous process"""
+    interrupted = []
+    for job in list_jobs(upload_folder):
+        if job.get('status') == 'running':
+            dataset_path = os.path.join(upload_folder, job['dataset_name'])
+            checkpoint = GeocodeCheckpoint(dataset_path)
+            checkpoint.save_job(status='interrupted')
+            interrupted.append(job['dataset_name'])
+    return interrupted
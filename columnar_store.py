@@ -0,0 +1,276 @@
+"""
+Columnar on-disk format for geocoded datasets
+
+A dataset directory holds:
+
+  dataset.json          metadata sidecar: row counts, bounds, geocode stats,
+                        column names and the current table directory
+  columns-<version>/    one table directory per write:
+    geocoded/           rows with coordinates
+      latitude.f8       raw little-endian float64
+      longitude.f8
+      <n>.txt           column n as UTF-8 values separated by NUL
+    failed/             rows that could not be geocoded (same layout, no
+                        coordinate files)
+
+Loading a table is a couple of file reads plus one str.split per column, with
+no CSV parsing or lat/lon re-validation. Coordinates are read with
+np.fromfile rather than memory-mapped so that deleting a dataset never trips
+over an open mapping (Windows refuses to remove mapped files).
+
+dataset.json is written last and atomically, so it is the commit point: a
+reader either sees the previous table directory or the complete new one.
+CSV is only produced on export; datasets still stored as geocoded_cache.csv
+are converted by migrate_csv() the first time they are loaded (the CSV files
+are kept, renamed to *.migrated).
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from ingest import full_addresses
+
+FORMAT_VERSION = 1
+METADATA_FILENAME = 'dataset.json'
+LEGACY_CSV_FILENAME = 'geocoded_cache.csv'
+LEGACY_FAILED_FILENAME = 'failed_addresses.csv'
+MIGRATED_SUFFIX = '.migrated'
+GEOCODED_TABLE = 'geocoded'
+FAILED_TABLE = 'failed'
+COORDINATE_COLUMNS = ('Latitude', 'Longitude')
+_SEPARATOR = '\x00'
+
+logger = logging.getLogger(__name__)
+
+
+def metadata_path(dataset_path):
+    return os.path.join(dataset_path, METADATA_FILENAME)
+
+
+def read_metadata(dataset_path):
+    """Return a dataset's metadata sidecar, or None if it has none"""
+    try:
+        with open(metadata_path(dataset_path), encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if metadata.get('format_version') != FORMAT_VERSION:
+        return None
+    return metadata
+
+
+class _TableWriter:
+    """Appends DataFrame chunks to one table directory"""
+
+    def __init__(self, directory, columns, coordinates):
+        os.makedirs(directory)
+        self.directory = directory
+        self.columns = list(columns)
+        self.row_count = 0
+        self._text_files = [open(os.path.join(directory, f'{n}.txt'), 'w', encoding='utf-8', newline='')
+                            for n in range(len(self.columns))]
+        self._coordinate_files = None
+        if coordinates:
+            self._coordinate_files = [open(os.path.join(directory, 'latitude.f8'), 'wb'),
+                                      open(os.path.join(directory, 'longitude.f8'), 'wb')]
+
+    def append(self, df):
+        if len(df) == 0:
+            return
+        prefix = _SEPARATOR if self.row_count else ''
+        for column, text_file in zip(self.columns, self._text_files):
+            values = df[column].fillna('').astype(str).str.replace(_SEPARATOR, '', regex=False)
+            text_file.write(prefix + _SEPARATOR.join(values.tolist()))
+        if self._coordinate_files:
+            for column, coordinate_file in zip(COORDINATE_COLUMNS, self._coordinate_files):
+                coordinate_file.write(df[column].to_numpy(dtype='<f8').tobytes())
+        self.row_count += len(df)
+
+    def close(self):
+        for f in self._text_files + (self._coordinate_files or []):
+            f.close()
+
+
+class DatasetWriter:
+    """Streams geocoded and failed rows into a new columnar table set.
+
+    Call commit(stats) once every chunk has been appended; nothing is visible
+    to readers until then.
+    """
+
+    def __init__(self, dataset_path, columns, failed_columns):
+        self.dataset_path = dataset_path
+        self.version = uuid.uuid4().hex[:12]
+        self.tables_dir = f'columns-{self.version}'
+        base = os.path.join(dataset_path, self.tables_dir)
+        self._geocoded = _TableWriter(os.path.join(base, GEOCODED_TABLE), columns, coordinates=True)
+        self._failed = _TableWriter(os.path.join(base, FAILED_TABLE), failed_columns, coordinates=False)
+        self._bounds = None
+
+    def append_geocoded(self, df):
+        """Append rows with valid Latitude/Longitude"""
+        self._geocoded.append(df)
+        if len(df):
+            bounds = (df['Latitude'].min(), df['Latitude'].max(), df['Longitude'].min(), df['Longitude'].max())
+            if self._bounds is not None:
+                bounds = (min(bounds[0], self._bounds[0]), max(bounds[1], self._bounds[1]),
+                          min(bounds[2], self._bounds[2]), max(bounds[3], self._bounds[3]))
+            self._bounds = bounds
+
+    def append_failed(self, df):
+        self._failed.append(df)
+
+    def commit(self, stats=None, row_count=None):
+        """Publish the new tables and metadata; returns the metadata.
+
+        row_count defaults to geocoded + failed rows.
+        """
+        self._geocoded.close()
+        self._failed.close()
+        bounds = None
+        if self._bounds is not None:
+            bounds = dict(zip(('min_lat', 'max_lat', 'min_lon', 'max_lon'), map(float, self._bounds)))
+        metadata = {
+            'format_version': FORMAT_VERSION,
+            'version': self.version,
+            'tables_dir': self.tables_dir,
+            'updated_at': time.time(),
+            'row_count': row_count if row_count is not None else self._geocoded.row_count + self._failed.row_count,
+            'geocoded_count': self._geocoded.row_count,
+            'failed_count': self._failed.row_count,
+            'columns': self._geocoded.columns,
+            'failed_columns': self._failed.columns,
+            'bounds': bounds,
+            'stats': stats or {},
+        }
+        tmp_path = metadata_path(self.dataset_path) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, metadata_path(self.dataset_path))
+        _remove_stale_tables(self.dataset_path, keep=self.tables_dir)
+        return metadata
+
+    def abort(self):
+        self._geocoded.close()
+        self._failed.close()
+        shutil.rmtree(os.path.join(self.dataset_path, self.tables_dir), ignore_errors=True)
+
+
+def _remove_stale_tables(dataset_path, keep):
+    for item in os.listdir(dataset_path):
+        if item.startswith('columns-') and item != keep:
+            shutil.rmtree(os.path.join(dataset_path, item), ignore_errors=True)
+
+
+def _read_strings(path, row_count):
+    if row_count == 0:
+        return []
+    with open(path, encoding='utf-8', newline='') as f:
+        values = f.read().split(_SEPARATOR)
+    if len(values) != row_count:
+        raise ValueError(f"Corrupted column file {path}: {len(values)} values, expected {row_count}")
+    return values
+
+
+def read_coordinates(dataset_path, metadata):
+    """(latitudes, longitudes) float64 arrays of the geocoded table"""
+    directory = os.path.join(dataset_path, metadata['tables_dir'], GEOCODED_TABLE)
+    row_count = metadata['geocoded_count']
+    coordinates = []
+    for name in ('latitude.f8', 'longitude.f8'):
+        values = np.fromfile(os.path.join(directory, name), dtype='<f8')
+        if len(values) != row_count:
+            raise ValueError(f"Corrupted coordinate file in {directory}")
+        coordinates.append(values)
+    return tuple(coordinates)
+
+
+def read_table(dataset_path, metadata, table=GEOCODED_TABLE, coordinates=None):
+    """Load one table as a DataFrame of strings (plus Latitude/Longitude for geocoded rows)"""
+    directory = os.path.join(dataset_path, metadata['tables_dir'], table)
+    if table == GEOCODED_TABLE:
+        columns, row_count = metadata['columns'], metadata['geocoded_count']
+    else:
+        columns, row_count = metadata['failed_columns'], metadata['failed_count']
+    df = pd.DataFrame({column: np.array(_read_strings(os.path.join(directory, f'{n}.txt'), row_count), dtype=object)
+                       for n, column in enumerate(columns)}, columns=columns, copy=False)
+    if table == GEOCODED_TABLE:
+        latitudes, longitudes = coordinates or read_coordinates(dataset_path, metadata)
+        df['Latitude'] = latitudes
+        df['Longitude'] = longitudes
+    return df
+
+
+def migrate_csv(dataset_path):
+    """Convert a CSV-stored dataset to the columnar format; returns metadata or None.
+
+    Every CSV row ends up in one of the two tables. Once the columnar copy is
+    committed the CSV files are renamed to *.migrated rather than deleted.
+    """
+    csv_file = os.path.join(dataset_path, LEGACY_CSV_FILENAME)
+    failed_file = os.path.join(dataset_path, LEGACY_FAILED_FILENAME)
+    try:
+        raw_df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+        logger.warning("Cannot migrate corrupted dataset %s: %s", dataset_path, e)
+        return None
+    if not all(column in raw_df.columns for column in COORDINATE_COLUMNS):
+        logger.warning("Cannot migrate dataset %s: no Latitude/Longitude columns", dataset_path)
+        return None
+    failed_df = pd.DataFrame()
+    if os.path.exists(failed_file):
+        try:
+            failed_df = pd.read_csv(failed_file, dtype=str, keep_default_na=False)
+        except (pd.errors.EmptyDataError, pd.errors.ParserError):
+            pass
+
+    latitudes = pd.to_numeric(raw_df['Latitude'], errors='coerce')
+    longitudes = pd.to_numeric(raw_df['Longitude'], errors='coerce')
+    valid = (latitudes.notna() & longitudes.notna()).to_numpy()
+    columns = [column for column in raw_df.columns if column not in COORDINATE_COLUMNS]
+    geocoded = raw_df.loc[valid, columns].copy()
+    geocoded['Latitude'] = latitudes[valid].astype(np.float64)
+    geocoded['Longitude'] = longitudes[valid].astype(np.float64)
+
+    # The old code left the coordinates of failed rows blank and listed those
+    # rows in failed_addresses.csv. Any other row without usable coordinates
+    # (a corrupted value, or blank ones with no failed file) would be lost, so
+    # it goes into the failed table here.
+    blank = ((raw_df['Latitude'].str.strip() == '') & (raw_df['Longitude'].str.strip() == '')).to_numpy()
+    unlisted = ~valid & ~(blank & (len(failed_df) > 0))
+    if unlisted.any():
+        unlocated = raw_df.loc[unlisted, columns].copy()
+        if 'Name' in failed_df.columns and 'Family Name' not in failed_df.columns:
+            unlocated = unlocated.rename(columns={'Family Name': 'Name'})  # As the old code saved them
+        if all(column in unlocated.columns for column in ('Address', 'City', 'State', 'Zip')):
+            unlocated['Full_Address'] = full_addresses(unlocated)
+        unlocated['Failure_Reason'] = np.where(blank[unlisted], 'Not geocoded',
+                                               f'Invalid coordinates in {LEGACY_CSV_FILENAME}')
+        failed_df = pd.concat([failed_df, unlocated], ignore_index=True).fillna('')
+        logger.warning("Migrating %s: %d row(s) without usable coordinates kept as failed rows",
+                       dataset_path, int(unlisted.sum()))
+
+    writer = DatasetWriter(dataset_path, columns, list(failed_df.columns))
+    try:
+        writer.append_geocoded(geocoded)
+        writer.append_failed(failed_df)
+        # Rows with blank coordinates are in both CSVs, so the row count is
+        # taken from the geocoded CSV
+        metadata = writer.commit({'migrated_from': LEGACY_CSV_FILENAME}, row_count=len(raw_df))
+    except Exception:
+        writer.abort()
+        raise
+
+    for path in (csv_file, failed_file):
+        if os.path.exists(path):
+            os.replace(path, path + MIGRATED_SUFFIX)
+    logger.info("Migrated %s to columnar storage (%d geocoded rows)", dataset_path, len(geocoded),
+                extra={'dataset_path': dataset_path, 'rows': len(geocoded)})
+    return metadata
@@ -0,0 +1,112 @@
+"""
+Streamed CSV downloads
+
+Exports used to be written whole into a StringIO, encoded and copied again
+into a BytesIO, so a large selection was held in memory three times over.
+Here the rows are formatted a chunk at a time by a generator and sent as they
+are produced, gzip-compressed on the fly when the client accepts it, so
+memory use depends on CHUNK_ROWS rather than on the size of the export.
+"""
+
+import io
+import tempfile
+import zipfile
+import zlib
+from urllib.parse import quote
+
+import pandas as pd
+from flask import Response, stream_with_context
+from werkzeug.utils import secure_filename
+
+PEOPLE_LINK_PREFIX = 'https://my.hpumc.org/Person2/'
+CHUNK_ROWS = 10_000
+GZIP_LEVEL = 5
+SPOOL_MAX_SIZE = 32 * 1024 * 1024  # bytes of zip kept in memory before spilling to disk
+
+
+def export_columns(df):
+    """Rename 'Family Name' to 'Name' and add 'PeopleID Link' (vectorized)"""
+    if 'Family Name' in df.columns:
+        df = df.rename(columns={'Family Name': 'Name'})
+    if 'PeopleID' in df.columns and 'PeopleID Link' not in df.columns:
+        ids = df['PeopleID'].astype(object).where(df['PeopleID'].notna(), '').astype(str)
+        df = df.assign(**{'PeopleID Link': (PEOPLE_LINK_PREFIX + ids).where(ids.str.strip() != '', '')})
+    return df
+
+
+def iter_csv(df, positions=None, chunk_rows=CHUNK_ROWS, extra_columns=None):
+    """Yield the CSV (header first) of df's rows at `positions` (default all) as bytes.
+
+    extra_columns maps column names to arrays aligned with `positions`,
+    appended after the export columns.
+    """
+    if positions is None:
+        positions = range(len(df))
+    extra_columns = extra_columns or {}
+    header = export_columns(df.iloc[:0]).assign(**{name: [] for name in extra_columns})
+    yield header.to_csv(index=False).encode()
+    for start in range(0, len(positions), chunk_rows):
+        chunk = export_columns(df.iloc[positions[start:start + chunk_rows]])
+        if extra_columns:
+            chunk = chunk.assign(**{name: values[start:start + chunk_rows]
+                                    for name, values in extra_columns.items()})
+        yield chunk.to_csv(index=False, header=False).encode()
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """Compress a stream of byte chunks into one gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _content_disposition(filename):
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+    return 'attachment; filename="{}"'.format(filename.replace('"', '').replace('\\', ''))
+
+
+def csv_response(chunks, filename, request):
+    """Stream CSV chunks as a file download, gzipped if the client accepts it"""
+    headers = {'Content-Disposition': _content_disposition(filename), 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype='text/csv', headers=headers)
+
+
+def dataframe_csv_response(df, filename, request, positions=None):
+    """csv_response for a DataFrame (or the rows of it at `positions`)"""
+    if df is None:
+        df = pd.DataFrame()
+    return csv_response(iter_csv(df, positions), filename, request)
+
+
+def zip_bundle(df, parts, summary_name, summary):
+    """Zip of one CSV per (name, positions) part plus a summary DataFrame.
+
+    Returns a rewound SpooledTemporaryFile, so large bundles spill to disk
+    instead of being held in memory. Part files are numbered in order
+    (01_<name>.csv, ...).
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    used_names = set()
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        summary_csv = io.StringIO()
+        summary.to_csv(summary_csv, index=False)
+        bundle.writestr(summary_name, summary_csv.getvalue())
+        for number, (name, positions) in enumerate(parts, start=1):
+            filename = f'{number:02d}_{secure_filename(name) or "part"}.csv'
+            while filename in used_names:
+                filename = f'{number:02d}_{filename}'
+            used_names.add(filename)
+            with bundle.open(filename, 'w') as entry:
+                for chunk in iter_csv(df, positions):
+                    entry.write(chunk)
+    spool.seek(0)
+    return spool
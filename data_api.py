@@ -0,0 +1,202 @@
+"""
+JSON row API for the map page
+
+The map no longer gets every row inlined into its HTML. It pages through
+GET /data/<dataset> instead, asking only for the fields it draws with:
+
+  ?fields=id,Latitude,Longitude   comma-separated projection (default: all)
+  ?offset=0&limit=20000           page of the geocoded rows
+
+`id` is a row's position in the dataset, so popup details can be fetched on
+demand with ?offset=<id>&limit=1. Responses carry a weak ETag built from the
+dataset version, so a browser revalidating an unchanged dataset gets a 304
+with no body, and they are gzipped when the client accepts it.
+
+GET /markers/<dataset>?bbox=west,south,east,north&zoom=z returns only what
+the map can see: below MAX_CLUSTER_ZOOM nearby points are merged into
+clusters with counts (spatial.ClusterGrid, built once per zoom level), above
+it the individual points in the box.
+"""
+
+import gzip
+
+import numpy as np
+
+from flask import Response, jsonify
+
+ROW_ID_FIELD = 'id'
+DEFAULT_PAGE_SIZE = 20_000
+MAX_PAGE_SIZE = 100_000
+GZIP_MIN_SIZE = 1024  # bytes; smaller bodies are sent as-is
+GZIP_LEVEL = 5
+MAX_CLUSTER_ZOOM = 17  # Deeper zooms get individual points
+MAX_ZOOM = 22
+MAX_MARKERS = 5_000  # Per response; only reached with a viewport far larger than the screen
+
+
+def dataset_fields(dataset):
+    """Fields a client can ask for, in default order"""
+    columns = dataset.metadata.get('columns')
+    if columns is None:
+        columns = [c for c in dataset.df.columns if c not in ('Latitude', 'Longitude')]
+    return [ROW_ID_FIELD] + list(columns) + ['Latitude', 'Longitude']
+
+
+def parse_page_args(args, dataset):
+    """(fields, offset, limit) from query args; raises ValueError with a message"""
+    available = dataset_fields(dataset)
+    fields = available
+    if args.get('fields'):
+        fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in available]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}")
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('offset and limit must be integers')
+    if offset < 0 or limit < 1:
+        raise ValueError('offset must be >= 0 and limit >= 1')
+    return fields, offset, min(limit, MAX_PAGE_SIZE)
+
+
+def _column(dataset, field, start, stop):
+    if field == ROW_ID_FIELD:
+        return range(start, stop)
+    if field == 'Latitude':
+        return dataset.latitudes[start:stop].tolist()
+    if field == 'Longitude':
+        return dataset.longitudes[start:stop].tolist()
+    values = dataset.df[field].iloc[start:stop].astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def rows_payload(dataset, fields, offset, limit):
+    """One page of rows as lists of values in `fields` order.
+
+    Coordinates and ids come straight from the in-memory arrays; the string
+    columns are only decoded when one of them is requested.
+    """
+    total = dataset.address_count
+    start = min(offset, total)
+    stop = min(offset + limit, total)
+    columns = [_column(dataset, field, start, stop) for field in fields]
+    return {
+        'dataset': dataset.name,
+        'version': dataset.version,
+        'total': total,
+        'offset': start,
+        'limit': limit,
+        'next_offset': stop if stop < total else None,
+        'fields': fields,
+        'rows': [list(row) for row in zip(*columns)],
+    }
+
+
+def not_modified(request, version):
+    """True if the client already holds this version"""
+    return request.if_none_match.contains_weak(version)
+
+
+def gzip_response(response, request):
+    """Compress a buffered response in place when the client accepts gzip"""
+    response.vary.add('Accept-Encoding')
+    if ('gzip' not in request.accept_encodings or response.direct_passthrough
+            or response.content_length is None or response.content_length < GZIP_MIN_SIZE):
+        return response
+    response.set_data(gzip.compress(response.get_data(), GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def parse_viewport_args(args):
+    """(min_lat, max_lat, min_lon, max_lon, zoom) from ?bbox=&zoom=; raises ValueError.
+
+    min_lon is None when the box spans every longitude, and greater than
+    max_lon when it crosses the antimeridian.
+    """
+    try:
+        west, south, east, north = (float(value) for value in args['bbox'].split(','))
+        zoom = int(args['zoom'])
+    except (KeyError, ValueError):
+        raise ValueError('bbox=west,south,east,north and zoom query parameters are required numbers')
+    if south > north or west > east or not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f'bbox must be west,south,east,north and zoom between 0 and {MAX_ZOOM}')
+    min_lat, max_lat = max(south, -90.0), min(north, 90.0)
+    if east - west >= 360.0:
+        return min_lat, max_lat, None, None, zoom
+    # Leaflet reports longitudes past +-180 after panning around the world
+    min_lon = (west + 180.0) % 360.0 - 180.0
+    max_lon = (east + 180.0) % 360.0 - 180.0
+    return min_lat, max_lat, min_lon, max_lon, zoom
+
+
+def markers_payload(dataset, min_lat, max_lat, min_lon, max_lon, zoom):
+    """Markers in view as [lat, lon, count, id] (id is null for clusters)"""
+    truncated = False
+    if zoom > MAX_CLUSTER_ZOOM:
+        positions = dataset.select_bbox(min_lat, max_lat, min_lon, max_lon)
+        total = len(positions)
+        truncated = total > MAX_MARKERS
+        positions = positions[:MAX_MARKERS]
+        markers = [[lat, lon, 1, position] for lat, lon, position in
+                   zip(dataset.latitudes[positions].tolist(), dataset.longitudes[positions].tolist(),
+                       positions.tolist())]
+    else:
+        grid = dataset.cluster_grid(zoom)
+        clusters = grid.query_bbox(min_lat, max_lat, min_lon, max_lon)
+        counts = grid.counts[clusters]
+        total = int(counts.sum())
+        if len(clusters) > MAX_MARKERS:
+            # Keep the biggest clusters
+            keep = np.sort(np.argsort(-counts, kind='stable')[:MAX_MARKERS])
+            clusters, counts = clusters[keep], counts[keep]
+            truncated = True
+        markers = [[lat, lon, count, position if position >= 0 else None] for lat, lon, count, position in
+                   zip(grid.latitudes[clusters].tolist(), grid.longitudes[clusters].tolist(),
+                       counts.tolist(), grid.ids[clusters].tolist())]
+    return {
+        'dataset': dataset.name,
+        'version': dataset.version,
+        'zoom': zoom,
+        'clustered': zoom <= MAX_CLUSTER_ZOOM,
+        'total': total,
+        'truncated': truncated,
+        'markers': markers,
+    }
+
+
+def _versioned_response(dataset, request, build_payload):
+    if not_modified(request, dataset.version):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_payload())
+        gzip_response(response, request)
+    # Cacheable, but revalidated on every use since the dataset can change
+    response.set_etag(dataset.version, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def markers_response(dataset, request):
+    """Full /markers response for a loaded dataset (None = 404)"""
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    try:
+        viewport = parse_viewport_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _versioned_response(dataset, request, lambda: markers_payload(dataset, *viewport))
+
+
+def dataset_rows_response(dataset, request):
+    """Full /data response for a loaded dataset (None = 404)"""
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    try:
+        fields, offset, limit = parse_page_args(request.args, dataset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _versioned_response(dataset, request, lambda: rows_payload(dataset, fields, offset, limit))
@@ -0,0 +1,279 @@
+"""
+Process-wide dataset registry
+
+Keeps every geocoded dataset loaded in memory so that page loads and exports
+do not re-read it on every request. Datasets are stored in the columnar
+format from columnar_store.py; each entry is keyed on the dataset name and
+revalidated against the `dataset.json` sidecar's mtime and size, so a dataset
+that is rewritten on disk is reloaded on next access. The upload, delete and
+clear routes also invalidate entries explicitly. Datasets still stored as
+`geocoded_cache.csv` are migrated the first time they are loaded.
+
+Each loaded dataset also gets a spatial GridIndex, persisted as
+`spatial_index.npz` in the dataset directory so it survives restarts.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+from metrics import DATASET_LOAD_SECONDS, DATASET_ROWS_LOADED
+from spatial import ClusterGrid, GridIndex, points_in_polygon
+
+CACHE_FILENAME = columnar_store.METADATA_FILENAME
+INDEX_FILENAME = 'spatial_index.npz'
+LEGACY_CACHE_FILE = 'geocoded_cache.csv'  # Default legacy file (no dataset selected)
+
+logger = logging.getLogger(__name__)
+
+
+class Dataset:
+    """A loaded dataset: float64 coordinate arrays plus lazily decoded rows"""
+
+    def __init__(self, name, cache_file, stat_key, row_count, latitudes, longitudes,
+                 df=None, index=None, metadata=None, load_df=None):
+        self.name = name
+        self.cache_file = cache_file
+        self.stat_key = stat_key
+        self.mtime = stat_key[0]
+        self.last_modified = datetime.fromtimestamp(self.mtime).strftime('%Y-%m-%d %H:%M')
+        self.row_count = row_count  # All rows, including failed geocodes
+        self.metadata = metadata or {}
+        self.version = self.metadata.get('version') or f'{stat_key[0]:.0f}-{stat_key[1]}'
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.index = index if index is not None else GridIndex.build(self.latitudes, self.longitudes)
+        self._df = df
+        self._load_df = load_df
+        self._cluster_grids = {}  # zoom -> ClusterGrid
+
+    @property
+    def df(self):
+        """Rows with valid coordinates (string columns + Latitude/Longitude); read-only"""
+        if self._df is None:
+            with DATASET_LOAD_SECONDS.time(part='rows'):
+                self._df = self._load_df()
+        return self._df
+
+    @property
+    def address_count(self):
+        return len(self.latitudes)
+
+    def failed_df(self):
+        """Rows that could not be geocoded, or an empty DataFrame"""
+        if not self.metadata.get('failed_count'):
+            return pd.DataFrame()
+        return columnar_store.read_table(os.path.dirname(self.cache_file), self.metadata,
+                                         columnar_store.FAILED_TABLE)
+
+    def select_radius(self, center_lat, center_lon, radius_m):
+        """Positions (ascending) of rows within radius_m of the center"""
+        return self.index.query_radius(self.latitudes, self.longitudes, center_lat, center_lon, radius_m)
+
+    def select_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        """Positions (ascending) of rows inside a lat/lon box (see GridIndex.query_bbox)"""
+        positions = self.index.query_bbox(min_lat, max_lat, min_lon, max_lon)
+        latitudes = self.latitudes[positions]
+        inside = (latitudes >= min_lat) & (latitudes <= max_lat)
+        if min_lon is not None:
+            longitudes = self.longitudes[positions]
+            if min_lon <= max_lon:
+                inside &= (longitudes >= min_lon) & (longitudes <= max_lon)
+            else:
+                inside &= (longitudes >= min_lon) | (longitudes <= max_lon)
+        return np.sort(positions[inside])
+
+    def select_polygon(self, vertices):
+        """Positions (ascending) of rows inside a polygon of (lat, lon) vertices"""
+        vertices = np.asarray(vertices, dtype=np.float64)
+        candidates = self.select_bbox(vertices[:, 0].min(), vertices[:, 0].max(),
+                                      vertices[:, 1].min(), vertices[:, 1].max())
+        inside = points_in_polygon(self.latitudes[candidates], self.longitudes[candidates], vertices)
+        return candidates[inside]
+
+    def select_nearest(self, lat, lon, k, max_radius_m=None):
+        """(positions, distances in meters) of the k rows nearest a point, nearest first"""
+        return self.index.query_nearest(self.latitudes, self.longitudes, lat, lon, k, max_radius_m)
+
+    def cluster_grid(self, zoom):
+        """ClusterGrid for a zoom level, built on first use and kept with the dataset"""
+        grid = self._cluster_grids.get(zoom)
+        if grid is None:
+            grid = self._cluster_grids[zoom] = ClusterGrid.build(self.latitudes, self.longitudes, zoom)
+        return grid
+
+
+def validate_coordinates(df):
+    """Drop rows without numeric lat/lon and convert both columns to float64"""
+    if df.empty or 'Latitude' not in df.columns or 'Longitude' not in df.columns:
+        return pd.DataFrame()
+    latitudes = pd.to_numeric(df['Latitude'], errors='coerce')
+    longitudes = pd.to_numeric(df['Longitude'], errors='coerce')
+    valid = latitudes.notna() & longitudes.notna()
+    df = df[valid].copy()
+    df['Latitude'] = latitudes[valid].astype(np.float64)
+    df['Longitude'] = longitudes[valid].astype(np.float64)
+    return df.reset_index(drop=True)
+
+
+class DatasetStore:
+    """Registry of loaded datasets under an upload folder"""
+
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def cache_file(self, name):
+        if name is None:
+            return LEGACY_CACHE_FILE
+        return os.path.join(self.upload_folder, name, CACHE_FILENAME)
+
+    def _migrate(self, name):
+        """Convert a CSV-stored dataset the first time it is seen"""
+        dataset_path = os.path.join(self.upload_folder, name)
+        if not os.path.exists(os.path.join(dataset_path, columnar_store.LEGACY_CSV_FILENAME)):
+            return
+        try:
+            columnar_store.migrate_csv(dataset_path)
+        except Exception as e:
+            logger.warning(f"Could not migrate dataset {name}: {str(e)}")
+
+    def get(self, name):
+        """Return the loaded Dataset for `name` (None = legacy file), or None"""
+        cache_file = self.cache_file(name)
+        if name is not None and not os.path.exists(cache_file):
+            self._migrate(name)
+        try:
+            stat = os.stat(cache_file)
+        except OSError:
+            with self._lock:
+                self._datasets.pop(name, None)
+            return None
+        stat_key = (stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            dataset = self._datasets.get(name)
+        if dataset is not None and dataset.stat_key == stat_key:
+            return dataset
+
+        start = time.perf_counter()
+        dataset = self._load(name, cache_file, stat_key)
+        with self._lock:
+            if dataset is None:
+                self._datasets.pop(name, None)
+            else:
+                self._datasets[name] = dataset
+        if dataset is not None:
+            elapsed = time.perf_counter() - start
+            DATASET_LOAD_SECONDS.observe(elapsed, part='coordinates')
+            DATASET_ROWS_LOADED.inc(dataset.address_count)
+            logger.info("Loaded dataset %s (%d rows) in %.3fs", name, dataset.address_count, elapsed,
+                        extra={'dataset': name, 'rows': dataset.address_count, 'seconds': round(elapsed, 4)})
+        return dataset
+
+    def _load(self, name, cache_file, stat_key):
+        if name is None:
+            return self._load_legacy_csv(name, cache_file, stat_key)
+        dataset_path = os.path.dirname(cache_file)
+        metadata = columnar_store.read_metadata(dataset_path)
+        if metadata is None:
+            logger.warning(f"Skipping dataset {name} (unreadable {CACHE_FILENAME})")
+            return None
+        try:
+            latitudes, longitudes = columnar_store.read_coordinates(dataset_path, metadata)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping corrupted dataset {name}: {str(e)}")
+            return None
+        return Dataset(name, cache_file, stat_key, metadata['row_count'], latitudes, longitudes,
+                       index=self._load_index(name, stat_key, latitudes, longitudes),
+                       metadata=metadata,
+                       load_df=lambda: columnar_store.read_table(dataset_path, metadata,
+                                                                 coordinates=(latitudes, longitudes)))
+
+    def _load_legacy_csv(self, name, cache_file, stat_key):
+        """The pre-datasets geocoded_cache.csv in the working directory"""
+        # Check if file is empty or too small
+        if stat_key[1] < 10:  # Less than 10 bytes is likely empty/corrupted
+            logger.warning(f"Skipping corrupted dataset {name} (cache file too small)")
+            return None
+        try:
+            raw_df = pd.read_csv(cache_file)
+        except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+            logger.warning(f"Skipping corrupted dataset {name}: {str(e)}")
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading dataset {name}: {str(e)}")
+            return None
+        df = validate_coordinates(raw_df)
+        latitudes = df['Latitude'].to_numpy(dtype=np.float64) if len(df) else np.empty(0)
+        longitudes = df['Longitude'].to_numpy(dtype=np.float64) if len(df) else np.empty(0)
+        return Dataset(name, cache_file, stat_key, len(raw_df), latitudes, longitudes, df=df)
+
+    def _load_index(self, name, stat_key, latitudes, longitudes):
+        """Load the persisted spatial index, rebuilding it when stale"""
+        if len(latitudes) == 0:
+            return None
+        index_file = os.path.join(self.upload_folder, name, INDEX_FILENAME)
+        source_key = (stat_key[0], stat_key[1], len(latitudes))
+        index = GridIndex.load(index_file, source_key)
+        if index is None:
+            index = GridIndex.build(latitudes, longitudes)
+            try:
+                index.save(index_file, source_key)
+            except OSError as e:
+                logger.warning(f"Could not save spatial index for {name}: {str(e)}")
+        return index
+
+    def list_datasets(self):
+        """List datasets as dicts, newest first (same shape get_datasets returned)"""
+        datasets = []
+        for item in os.listdir(self.upload_folder):
+            dataset_path = os.path.join(self.upload_folder, item)
+            if not os.path.isdir(dataset_path):
+                continue
+            # Only the metadata sidecar is read here, not the rows
+            metadata_file = self.cache_file(item)
+            if not os.path.exists(metadata_file):
+                self._migrate(item)
+            metadata = columnar_store.read_metadata(dataset_path)
+            if metadata is None:
+                continue
+            datasets.append({
+                'name': item,
+                'path': dataset_path,
+                'last_modified': datetime.fromtimestamp(os.path.getmtime(metadata_file)).strftime('%Y-%m-%d %H:%M'),
+                'address_count': metadata['row_count']
+            })
+        return sorted(datasets, key=lambda x: x['last_modified'], reverse=True)
+
+    def exists(self, name):
+        return os.path.exists(self.cache_file(name))
+
+    def writer(self, name, columns, failed_columns):
+        """A columnar_store.DatasetWriter for the dataset's directory"""
+        return columnar_store.DatasetWriter(os.path.join(self.upload_folder, name), columns, failed_columns)
+
+    def delete(self, name):
+        """Remove a dataset's directory"""
+        shutil.rmtree(os.path.join(self.upload_folder, name))
+        self.invalidate(name)
+
+    def clear(self):
+        """Forget every dataset (the caller removes the upload folder)"""
+        self.invalidate()
+
+    def invalidate(self, name=None):
+        """Forget one dataset, or every dataset when no name is given"""
+        with self._lock:
+            if name is None:
+                self._datasets.clear()
+            else:
+                self._datasets.pop(name, None)
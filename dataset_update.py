@@ -0,0 +1,79 @@
+"""
+Incremental dataset updates: re-upload a roster, geocode only what changed
+
+An upload with mode=update replaces an existing dataset. The stored version
+is read once into a PreviousVersion:
+
+  - addresses (by canonical address key, see address_normalize.address_key)
+    that were geocoded before keep their coordinates without a cache lookup
+    or geocoder request; only new and changed addresses are geocoded
+  - rows are matched on PeopleID to count what changed; rows without a
+    PeopleID are matched on their address key
+
+The new version is written with the dataset store's writer like any other
+job, so it replaces the old one atomically when it commits; a canceled or
+failed update leaves the stored version untouched. The counts end up in the
+job's progress and in the dataset metadata stats under 'update':
+
+  added      rows whose PeopleID (or address, without one) is new
+  changed    rows whose PeopleID moved to a different address
+  unchanged  rows with the same PeopleID at the same address
+  removed    stored rows missing from the new upload
+  reused     rows whose coordinates came from the stored version
+"""
+
+from ingest import address_keys
+
+
+class PreviousVersion:
+    """What an update needs from the stored version of a dataset"""
+
+    def __init__(self, dataset):
+        geocoded = dataset.df
+        failed = dataset.failed_df()
+        geocoded_keys = address_keys(geocoded) if len(geocoded) else []
+        self._coordinates = dict(zip(geocoded_keys, zip(geocoded['Latitude'].tolist(),
+                                                        geocoded['Longitude'].tolist())))
+        self._people = {}  # PeopleID -> address key
+        self._unnamed = set()  # address keys of rows without a PeopleID
+        for df, keys in ((geocoded, geocoded_keys), (failed, address_keys(failed) if len(failed) else [])):
+            if not len(df):
+                continue
+            people_ids = df['PeopleID'].fillna('').astype(str).str.strip().tolist()
+            for people_id, key in zip(people_ids, keys):
+                if people_id:
+                    self._people[people_id] = key
+                else:
+                    self._unnamed.add(key)
+        self._seen_people = set()
+        self._seen_unnamed = set()
+        self.counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0, 'reused': 0}
+
+    def coordinates(self, key):
+        """(lat, lon) the stored version has for an address key, or None"""
+        return self._coordinates.get(key)
+
+    def compare(self, people_ids, keys):
+        """Count one chunk of new rows (PeopleID and address key per row)"""
+        counts = self.counts
+        for people_id, key in zip(people_ids, keys):
+            people_id = people_id.strip()
+            if not people_id:
+                self._seen_unnamed.add(key)
+                counts['unchanged' if key in self._unnamed else 'added'] += 1
+                continue
+            self._seen_people.add(people_id)
+            previous_key = self._people.get(people_id)
+            if previous_key is None:
+                counts['added'] += 1
+            elif previous_key != key:
+                counts['changed'] += 1
+            else:
+                counts['unchanged'] += 1
+
+    def summary(self, reused_rows):
+        """Final counts once every new row has been compared"""
+        self.counts['removed'] = (len(self._people.keys() - self._seen_people)
+                                  + len(self._unnamed - self._seen_unnamed))
+        self.counts['reused'] = int(reused_rows)
+        return dict(self.counts)
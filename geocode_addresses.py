@@ -3,9 +3,11 @@ import time
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
 import os
+from geocode_cache import GeocodeCache
 
 INPUT_CSV = 'addresses.csv'
 CACHE_CSV = 'geocoded_cache.csv'
+GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH', 'geocode_cache.sqlite')
 
 # Columns to use
 COLUMNS = ['Family Name', 'Address', 'City', 'State', 'Zip']
@@ -13,17 +15,24 @@ COLUMNS = ['Family Name', 'Address', 'City', 'State', 'Zip']
 # Read the input CSV
 raw_df = pd.read_csv(INPUT_CSV, header=None)
 raw_df.columns = ['Family Name', 'Address', 'Unused', 'City', 'State', 'Zip', 'ID']
-df = raw_df[COLUMNS]
+df = raw_df[COLUMNS].copy()
+df['Latitude'] = None
+df['Longitude'] = None
 
-# Load cache if exists
-if os.path.exists(CACHE_CSV):
-    cache_df = pd.read_csv(CACHE_CSV)
-else:
-    cache_df = pd.DataFrame(columns=COLUMNS + ['Latitude', 'Longitude'])
+# Shared geocode cache (same database app.py and app_standalone.py use)
+geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH)
+
+def full_address(row):
+    return f"{row['Address']}, {row['City']}, {row['State']} {row['Zip']}"
 
-# Merge to find which addresses need geocoding
-merged = pd.merge(df, cache_df, on=COLUMNS, how='left', indicator=True)
-to_geocode = merged[merged['_merge'] == 'left_only'][COLUMNS]
+# Fill in everything the shared cache already knows about
+to_geocode = []
+for idx, row in df.iterrows():
+    cached = geocode_cache.lookup(full_address(row))
+    if cached is None:
+        to_geocode.append(idx)
+    else:
+        df.at[idx, 'Latitude'], df.at[idx, 'Longitude'] = cached
 
 print(f"{len(to_geocode)} addresses to geocode (out of {len(df)})")
 
@@ -32,24 +41,27 @@ geolocator = Nominatim(user_agent="family_mapper")
 rate_limiter = RateLimiter(geolocator.geocode, min_delay_seconds=1)
 
 def geocode_address(row):
-    address = f"{row['Address']}, {row['City']}, {row['State']} {row['Zip']}"
+    address = full_address(row)
     print(f"Geocoding: {address}")
     location = None
     try:
         location = rate_limiter(address)
     except Exception as e:
         print(f"Error geocoding {address}: {e}")
+        return pd.Series({'Latitude': None, 'Longitude': None})
     if location:
+        geocode_cache.store_hit(address, location.latitude, location.longitude)
         return pd.Series({'Latitude': location.latitude, 'Longitude': location.longitude})
     else:
+        geocode_cache.store_miss(address)
         return pd.Series({'Latitude': None, 'Longitude': None})
 
-if not to_geocode.empty:
-    for idx, row in to_geocode.iterrows():
+if to_geocode:
+    for idx in to_geocode:
         start = time.time()
-        latlon = geocode_address(row)
+        latlon = geocode_address(df.loc[idx])
         for col in ['Latitude', 'Longitude']:
-            to_geocode.at[idx, col] = latlon[col]
+            df.at[idx, col] = latlon[col]
         elapsed = time.time() - start
         if elapsed < 1:
             pause = 1 - elapsed
@@ -58,8 +70,7 @@ if not to_geocode.empty:
 else:
     print("No new addresses to geocode.")
 
-# Combine and save cache
-new_cache = pd.concat([cache_df, to_geocode[COLUMNS + ['Latitude', 'Longitude']]], ignore_index=True)
-new_cache = new_cache.drop_duplicates(subset=COLUMNS)
-new_cache.to_csv(CACHE_CSV, index=False)
-print(f"Geocoding complete. Cached results in {CACHE_CSV}") 
\ No newline at end of file
+# Save results
+df = df.drop_duplicates(subset=COLUMNS)
+df.to_csv(CACHE_CSV, index=False)
+print(f"Geocoding complete. Results in {CACHE_CSV}, lookups cached in {GEOCODE_CACHE_PATH}")
@@ -0,0 +1,124 @@
+"""
+Shared on-disk geocode cache
+
+Stores geocoding results in a small SQLite database keyed on the normalized
+full address, so any dataset (and both app.py and app_standalone.py) can reuse
+a location that was already looked up instead of spending another Nominatim
+request on it.
+
+Both successful lookups ("hits") and definite "No results found" answers
+("misses") are stored. Misses expire after a TTL so that addresses which
+OpenStreetMap learns about later get retried eventually. Transient errors
+(timeouts, service unavailable) are never cached.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_MISS_TTL = 30 * 24 * 60 * 60  # 30 days, in seconds
+
+STATUS_HIT = 'hit'
+STATUS_MISS = 'miss'
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_address(address):
+    """Normalize a full address string into a cache key"""
+    text = _PUNCTUATION_RE.sub(' ', str(address).lower())
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class GeocodeCache:
+    """Thread-safe SQLite geocode cache shared across datasets"""
+
+    def __init__(self, path, miss_ttl=DEFAULT_MISS_TTL):
+        self.path = path
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS geocode_cache ('
+                ' address_key TEXT PRIMARY KEY,'
+                ' latitude REAL,'
+                ' longitude REAL,'
+                ' status TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, address):
+        """Look up an address.
+
+        Returns None when the address is unknown (or its cached miss has
+        expired), (lat, lon) for a cached hit, and (None, None) for a cached
+        definite miss.
+        """
+        key = normalize_address(address)
+        if not key:
+            return None
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT latitude, longitude, status, updated_at FROM geocode_cache WHERE address_key = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        latitude, longitude, status, updated_at = row
+        if status == STATUS_HIT:
+            return latitude, longitude
+        if self.miss_ttl is not None and time.time() - updated_at > self.miss_ttl:
+            return None
+        return None, None
+
+    def store_hit(self, address, latitude, longitude):
+        """Remember a successful geocode"""
+        self._store(address, latitude, longitude, STATUS_HIT)
+
+    def store_miss(self, address):
+        """Remember that the geocoder had no result for an address"""
+        self._store(address, None, None, STATUS_MISS)
+
+    def _store(self, address, latitude, longitude, status):
+        key = normalize_address(address)
+        if not key:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO geocode_cache (address_key, latitude, longitude, status, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, latitude, longitude, status, time.time())
+            )
+            conn.commit()
+
+    def stats(self):
+        """Return the number of cached hits and misses"""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT status, COUNT(*) FROM geocode_cache GROUP BY status'
+            ).fetchall()
+        counts = {STATUS_HIT: 0, STATUS_MISS: 0}
+        counts.update(dict(rows))
+        return {'hits': counts[STATUS_HIT], 'misses': counts[STATUS_MISS]}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,38 @@
+"""
+Geocoding job runner process
+
+Runs the job queue's worker pool (see job_queue.py) in a process of its own,
+so the web server processes only queue jobs and read their progress:
+
+    GEOCODE_RUNNER=external gunicorn ...   # web processes never geocode
+    python geocode_runner.py               # drains the queue until SIGTERM
+
+gunicorn.conf.py starts (and restarts) this process itself. Geocoding is CPU
+bound in places (grouping a large upload, writing the dataset) and would
+stall every request and progress stream of a gevent web worker while it ran;
+here it has plain threads and a process to itself. Jobs still running at
+shutdown are put back in the queue and resume from their checkpoint.
+"""
+
+import logging
+import signal
+import threading
+
+import app
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    app.job_queue.start()
+    logger.info("Geocoding runner started")
+    stop.wait()
+    logger.info("Geocoding runner stopping")
+    app.job_queue.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,512 @@
+"""
+Pluggable geocoder backends and a concurrent geocoding engine
+
+A backend wraps one geocoding provider (public Nominatim, a self-hosted
+Nominatim, the local stub server, ...) together with its own rate limit and
+concurrency limit. Backends are created once per process, so every job that
+uses a backend shares that backend's rate budget.
+
+GeocodingEngine fans batches of addresses out across the primary backends
+concurrently. Addresses a primary backend cannot resolve are passed on to the
+fallback backends (typically the public Nominatim) in order.
+
+Backends are configured with the GEOCODER_BACKENDS environment variable, a
+JSON list such as:
+
+    [{"type": "nominatim", "url": "http://nominatim.internal:8080", "rate": 20, "concurrency": 4},
+     {"type": "nominatim", "rate": 1, "concurrency": 1, "fallback": true}]
+
+Supported types are "nominatim" (public instance when no url is given),
+"stub" (the offline load-testing server in stub_geocoder.py) and "offline"
+(a local address-point index built with `python address_points.py import`).
+When an offline index is available it is tried first and every other backend
+becomes a fallback.
+
+Each backend paces its requests with an AdaptiveRateController: it starts at
+the configured rate, backs off exponentially (with jitter) when the provider
+answers 429/5xx or times out, retries those requests, and climbs back to the
+configured rate once requests succeed again. HTTP backends keep one pooled
+keep-alive session per backend instead of reconnecting for every request.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from functools import partial
+from urllib.parse import urlparse
+
+from geopy.adapters import RequestsAdapter
+from geopy.exc import GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable
+from geopy.geocoders import Nominatim
+
+from metrics import GEOCODER_LATENCY, GEOCODER_REQUESTS
+
+DEFAULT_USER_AGENT = 'family_mapper_v2'
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_STUB_URL = 'http://127.0.0.1:8088'
+
+# Backoff when a provider throttles or fails (AdaptiveRateController)
+BASE_BACKOFF = 1.0  # seconds, doubled per backoff level
+MAX_BACKOFF = 60.0  # seconds
+MAX_BACKOFF_LEVEL = 8
+RATE_DECREASE = 0.5  # rate multiplier per transient failure
+RATE_RECOVERY = 0.05  # fraction of the configured rate regained per success
+RECOVERY_SUCCESSES = 10  # successes in a row that lower the backoff level by one
+FAILURES_TO_BACK_OFF = 2  # transient failures in a row (a 429 counts at once) before slowing down
+MIN_RATE = 0.1  # requests/second floor while backing off
+LATENCY_SMOOTHING = 0.2  # weight of the newest sample in the latency average
+MAX_RETRIES = 3  # extra attempts for a request that failed transiently
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKENDS_CONFIG = [
+    # Nominatim Usage Policy: max 1 request per second
+    {'type': 'nominatim', 'name': 'nominatim', 'rate': 1.0, 'concurrency': 1},
+]
+
+
+def is_transient(error):
+    """True for provider errors worth retrying later (throttling, 5xx, timeouts, network)"""
+    if isinstance(error, (GeocoderRateLimited, GeocoderUnavailable, GeocoderTimedOut, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error.__cause__, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def failure_reason(error):
+    """Short label for a provider error (the outcome label of geocoder_requests_total)"""
+    status = getattr(error.__cause__, 'status_code', None)
+    if isinstance(error, GeocoderRateLimited) or status == 429:
+        return 'rate_limited'
+    if isinstance(error, (GeocoderTimedOut, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (GeocoderUnavailable, ConnectionError)) or (status is not None and status >= 500):
+        return 'unavailable'
+    return 'error'
+
+
+class AdaptiveRateController:
+    """Thread-safe request pacing with exponential backoff (rates in requests/second).
+
+    The allowed rate (None = unlimited) is an upper bound. A 429, or
+    FAILURES_TO_BACK_OFF transient failures in a row, raise the backoff level:
+    every request pauses for a jittered BASE_BACKOFF * 2**(level - 1) seconds
+    (or the provider's Retry-After) and the current rate is cut by
+    RATE_DECREASE. Each success adds RATE_RECOVERY of the allowed rate back,
+    and RECOVERY_SUCCESSES in a row lower the level again. An isolated
+    failure only delays the retry of its own request.
+    """
+
+    def __init__(self, rate=None, rng=None):
+        self.max_rate = rate
+        self.rate = rate  # Current pace; None = unlimited
+        self.level = 0
+        self.latency = None  # Smoothed seconds per request
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+        self.retries = 0
+        self._successes_in_row = 0
+        self._failures_in_row = 0
+        self._paused_until = 0.0
+        self._next_slot = 0.0
+        self._completions = []  # Recent completion times, to measure an unlimited backend's pace
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's request slot comes up"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + (1.0 / self.rate if self.rate else 0.0)
+            self.requests += 1
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _observe(self, latency):
+        now = time.monotonic()
+        self.latency = latency if self.latency is None else (
+            LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency)
+        self._completions.append(now)
+        if len(self._completions) > 100:
+            del self._completions[:50]
+        return now
+
+    def record_success(self, latency):
+        with self._lock:
+            self._observe(latency)
+            self.successes += 1
+            self._successes_in_row += 1
+            self._failures_in_row = 0
+            if self.rate is not None and self.rate != self.max_rate:
+                step = RATE_RECOVERY * (self.max_rate or self.rate)
+                self.rate = self.rate + step if self.max_rate is None else min(self.max_rate, self.rate + step)
+            if self.level and self._successes_in_row >= RECOVERY_SUCCESSES:
+                self.level -= 1
+                self._successes_in_row = 0
+                if self.level == 0 and self.max_rate is None:
+                    self.rate = None  # Fully recovered: unlimited again
+
+    def record_failure(self, latency, error, attempt=0):
+        """Count a failed request; transient failures slow the backend down.
+
+        Returns the seconds to wait before retrying the request, or None if
+        it is not worth retrying.
+        """
+        transient = is_transient(error)
+        with self._lock:
+            now = self._observe(latency)
+            self.errors += 1
+            self._successes_in_row = 0
+            if not transient:
+                return None
+            self.throttled += 1
+            self._failures_in_row += 1
+            retry_after = getattr(error, 'retry_after', None)
+            delay = retry_after or BASE_BACKOFF * 2 ** attempt * self._rng.uniform(0.5, 1.0)
+            if now < self._paused_until:
+                # Concurrent requests failing during one backoff count once
+                return max(delay, self._paused_until - now)
+            if not isinstance(error, GeocoderRateLimited) and self._failures_in_row < FAILURES_TO_BACK_OFF:
+                return delay
+            self.level = min(self.level + 1, MAX_BACKOFF_LEVEL)
+            current = self.rate or self._measured_rate(now) or 1.0
+            self.rate = max(MIN_RATE, current * RATE_DECREASE)
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (self.level - 1))
+            pause = retry_after or backoff * self._rng.uniform(0.5, 1.0)
+            self._paused_until = now + pause
+            return pause
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def _measured_rate(self, now):
+        recent = [t for t in self._completions if now - t <= 10.0]
+        if len(recent) < 2 or recent[-1] <= recent[0]:
+            return None
+        return (len(recent) - 1) / (recent[-1] - recent[0])
+
+    def state(self):
+        """Live pacing state for progress reports"""
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3) if self.rate is not None else None,
+                'max_rate': self.max_rate,
+                'backoff_level': self.level,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 1),
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'retries': self.retries,
+            }
+
+
+class GeocoderBackend:
+    """Base class for geocoding providers.
+
+    Subclasses implement `_geocode(address)` returning (lat, lon) or None.
+    `geocode()` adds the backend's rate limit and concurrency limit.
+    """
+
+    def __init__(self, name, rate=None, concurrency=1, fallback=False):
+        self.name = name
+        self.rate = rate
+        self.concurrency = max(1, int(concurrency))
+        self.fallback = fallback
+        self.controller = AdaptiveRateController(rate)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def _geocode(self, address):
+        raise NotImplementedError
+
+    def geocode(self, address):
+        """Geocode one address; raises on provider errors.
+
+        Transient errors are retried up to MAX_RETRIES times, each after a
+        jittered exponential delay from the controller.
+        """
+        with self._slots:
+            for attempt in range(MAX_RETRIES + 1):
+                if attempt:
+                    self.controller.record_retry()
+                self.controller.wait()
+                start = time.monotonic()
+                try:
+                    location = self._geocode(address)
+                except Exception as e:
+                    latency = time.monotonic() - start
+                    GEOCODER_LATENCY.observe(latency, backend=self.name)
+                    GEOCODER_REQUESTS.inc(backend=self.name, outcome=failure_reason(e))
+                    level = self.controller.level
+                    delay = self.controller.record_failure(latency, e, attempt)
+                    if self.controller.level > level:
+                        logger.warning("%s: %s. Backing off (level %d)", self.name, e, self.controller.level,
+                                       extra={'backend': self.name, 'backoff_level': self.controller.level})
+                    if delay is None or attempt == MAX_RETRIES:
+                        raise
+                    time.sleep(delay)
+                    continue
+                latency = time.monotonic() - start
+                GEOCODER_LATENCY.observe(latency, backend=self.name)
+                GEOCODER_REQUESTS.inc(backend=self.name, outcome='no_result' if location is None else 'found')
+                self.controller.record_success(latency)
+                return location
+
+    def describe(self):
+        return {'name': self.name, 'rate': self.rate, 'concurrency': self.concurrency,
+                'fallback': self.fallback}
+
+    def state(self):
+        return dict(self.describe(), **self.controller.state())
+
+
+class NominatimBackend(GeocoderBackend):
+    """Nominatim API backend (public instance or a self-hosted URL)"""
+
+    def __init__(self, name, url=None, user_agent=DEFAULT_USER_AGENT, timeout=15, **kwargs):
+        super().__init__(name, **kwargs)
+        # One keep-alive session per backend, with a connection per worker
+        # thread; retries are left to the controller
+        options = {'user_agent': user_agent, 'timeout': timeout,
+                   'adapter_factory': partial(RequestsAdapter, pool_connections=1,
+                                              pool_maxsize=self.concurrency, max_retries=0)}
+        if url:
+            parsed = urlparse(url)
+            options['domain'] = parsed.netloc + parsed.path.rstrip('/')
+            options['scheme'] = parsed.scheme or 'https'
+        self.url = url
+        self._geolocator = Nominatim(**options)
+
+    def _geocode(self, address):
+        location = self._geolocator.geocode(address)
+        if location:
+            return location.latitude, location.longitude
+        return None
+
+
+class OfflineBackend(GeocoderBackend):
+    """Local address-point index lookups (no network calls)"""
+
+    def __init__(self, name, path, **kwargs):
+        super().__init__(name, **kwargs)
+        from address_points import AddressPointsIndex
+        self.path = path
+        self._index = AddressPointsIndex(path)
+
+    def _geocode(self, address):
+        return self._index.lookup(address)
+
+
+def create_backend(config, user_agent=DEFAULT_USER_AGENT):
+    """Create a backend from one GEOCODER_BACKENDS entry"""
+    config = dict(config)
+    backend_type = config.pop('type', 'nominatim')
+    concurrency = config.pop('concurrency', None)
+    options = {
+        'rate': config.pop('rate', None),
+        'concurrency': concurrency or 1,
+        'fallback': bool(config.pop('fallback', False)),
+    }
+    if backend_type == 'nominatim':
+        url = config.pop('url', None)
+        name = config.pop('name', url or 'nominatim')
+        if url is None and options['rate'] is None:
+            options['rate'] = 1.0  # Never exceed the public usage policy
+        return NominatimBackend(name, url=url, user_agent=user_agent,
+                                timeout=config.pop('timeout', 15), **options)
+    if backend_type == 'stub':
+        url = config.pop('url', DEFAULT_STUB_URL)
+        return NominatimBackend(config.pop('name', 'stub'), url=url, user_agent=user_agent,
+                                timeout=config.pop('timeout', 15), **options)
+    if backend_type == 'offline':
+        options['concurrency'] = concurrency or 4  # Local lookups are cheap
+        return OfflineBackend(config.pop('name', 'offline'), config.pop('path'), **options)
+    raise ValueError(f"Unknown geocoder backend type: {backend_type}")
+
+
+def backends_from_config(config=None, user_agent=DEFAULT_USER_AGENT, offline_index=None):
+    """Create backends from a JSON string or list (None = public Nominatim).
+
+    If `offline_index` names an existing address-point index and the config
+    has no offline backend of its own, an offline backend is put in front and
+    all configured backends become fallbacks behind it.
+    """
+    if not config:
+        config = DEFAULT_BACKENDS_CONFIG
+    elif isinstance(config, str):
+        config = json.loads(config)
+    config = [dict(entry) for entry in config]
+    has_offline = any(entry.get('type') == 'offline' for entry in config)
+    if offline_index and os.path.exists(offline_index) and not has_offline:
+        for entry in config:
+            entry['fallback'] = True
+        config.insert(0, {'type': 'offline', 'path': offline_index})
+    return [create_backend(entry, user_agent=user_agent) for entry in config]
+
+
+class GeocodeOutcome:
+    """Result of geocoding one item through the engine"""
+
+    __slots__ = ('key', 'address', 'latitude', 'longitude', 'backend', 'error', 'attempts')
+
+    def __init__(self, key, address):
+        self.key = key
+        self.address = address
+        self.latitude = None
+        self.longitude = None
+        self.backend = None
+        self.error = None  # None for a hit or a definite "no results" answer
+        self.attempts = 0
+
+    @property
+    def found(self):
+        return self.latitude is not None
+
+
+class GeocodingEngine:
+    """Runs addresses through the configured backends concurrently.
+
+    Primary backends pull batches from a shared work queue, so faster backends
+    naturally take more of the load. An address that a primary backend cannot
+    geocode (no result or error) is retried on each fallback backend in turn.
+    """
+
+    def __init__(self, backends, batch_size=DEFAULT_BATCH_SIZE):
+        if not backends:
+            raise ValueError("At least one geocoder backend is required")
+        self.backends = list(backends)
+        self.primaries = [b for b in self.backends if not b.fallback] or self.backends[:1]
+        self.fallbacks = [b for b in self.backends if b not in self.primaries]
+        self.batch_size = batch_size
+
+    def geocode_many(self, items, should_cancel=None):
+        """Geocode (key, address) pairs, yielding GeocodeOutcome as they finish.
+
+        `items` may be any iterable (including a generator); it is consumed
+        lazily with a bounded number of batches in flight. Results arrive in
+        completion order, not input order.
+        """
+        stop = threading.Event()
+        results = queue.Queue()
+        max_in_flight = 4 * sum(b.concurrency for b in self.primaries)
+        work = queue.Queue(maxsize=max_in_flight)
+        fallback_queues = [queue.Queue() for _ in self.fallbacks]
+        submitted = [0]
+        feeding_done = threading.Event()
+
+        def cancelled():
+            return stop.is_set() or (should_cancel is not None and should_cancel())
+
+        def finish(outcome, stage):
+            # Hand unresolved items to the next fallback backend, if any
+            if not outcome.found and stage < len(self.fallbacks):
+                fallback_queues[stage].put(outcome)
+            else:
+                results.put(outcome)
+
+        def attempt(backend, outcome):
+            outcome.attempts += 1
+            try:
+                location = backend.geocode(outcome.address)
+                outcome.error = None
+                if location:
+                    outcome.latitude, outcome.longitude = location
+                    outcome.backend = backend.name
+            except Exception as e:
+                outcome.error = str(e)
+                outcome.backend = backend.name
+
+        def feed():
+            try:
+                batch = []
+                for key, address in items:
+                    if cancelled():
+                        break
+                    batch.append(GeocodeOutcome(key, address))
+                    if len(batch) >= self.batch_size:
+                        self._put(work, batch, cancelled)
+                        submitted[0] += len(batch)
+                        batch = []
+                if batch and not cancelled():
+                    self._put(work, batch, cancelled)
+                    submitted[0] += len(batch)
+            except Exception as e:
+                results.put(e)
+            finally:
+                feeding_done.set()
+
+        def primary_worker(backend):
+            while not cancelled():
+                try:
+                    batch = work.get(timeout=0.1)
+                except queue.Empty:
+                    if feeding_done.is_set() and work.empty():
+                        return
+                    continue
+                for outcome in batch:
+                    if cancelled():
+                        return
+                    attempt(backend, outcome)
+                    finish(outcome, 0)
+
+        def fallback_worker(backend, stage):
+            while not cancelled():
+                try:
+                    outcome = fallback_queues[stage].get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                attempt(backend, outcome)
+                finish(outcome, stage + 1)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for backend in self.primaries:
+            threads += [threading.Thread(target=primary_worker, args=(backend,), daemon=True)
+                        for _ in range(backend.concurrency)]
+        for stage, backend in enumerate(self.fallbacks):
+            threads += [threading.Thread(target=fallback_worker, args=(backend, stage), daemon=True)
+                        for _ in range(backend.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        resolved = 0
+        try:
+            while not cancelled():
+                if feeding_done.is_set() and resolved >= submitted[0]:
+                    break
+                try:
+                    outcome = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if isinstance(outcome, Exception):
+                    raise outcome
+                resolved += 1
+                yield outcome
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _put(work, batch, cancelled):
+        while not cancelled():
+            try:
+                work.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def describe(self):
+        return [backend.describe() for backend in self.backends]
+
+    def state(self):
+        """Live pacing state of every backend"""
+        return [backend.state() for backend in self.backends]
@@ -0,0 +1,326 @@
+"""
+Geographic grouping: split a dataset into K balanced groups
+
+POST /groups divides the geocoded families of a dataset (the `dataset` field,
+or the current one) into K groups of nearly equal size (small groups,
+delivery routes, caller lists):
+
+  {"dataset": "name", "k": 12, "balanced": true, "format": "json" | "csv" | "zip", "seed": 0}
+
+  json  group sizes and centroids, plus the group of every row (in row order,
+        so labels[id] is the group of row id in /data)
+  csv   every row with a Group column
+  zip   one CSV per group plus groups_summary.csv
+
+Points are projected to kilometres on a local equirectangular plane, which is
+accurate at the scale of a metro area (datasets spanning the antimeridian are
+not supported). Plain k-means (k-means++ seeding, vectorized Lloyd
+iterations on a sample of SAMPLE_ROWS rows) places the centroids; with balanced=true the rows are then
+re-assigned under a capacity of ceil(n / K) per group and the centroids
+refined a few times. The capacitated assignment is greedy: every unassigned
+row asks for its nearest open group, rows that would lose the most by going
+elsewhere (largest regret) are served first, and a group that fills up is
+closed for the next round, so it takes at most K vectorized rounds. A row
+only weighs the CANDIDATE_GROUPS groups around its nearest centroid, so a
+round costs rows x CANDIDATE_GROUPS rather than rows x K; rows whose
+candidates have all filled up get fresh ones from the groups still open.
+After the first full pass, the Lloyd and balancing iterations find each
+row's nearest centroid by walking the centroid neighbourhoods from the
+previous one (_nearest_among). 100k rows take about 4 s at K = 500 (see
+benchmarks/bench_grouping.py).
+
+Groups are numbered north to south by centroid.
+"""
+
+import numpy as np
+import pandas as pd
+from flask import jsonify, send_file
+
+from csv_export import csv_response, iter_csv, zip_bundle
+from spatial import EARTH_RADIUS_M
+
+MAX_GROUPS = 500
+MAX_ITERATIONS = 50  # Lloyd iterations
+BALANCE_ITERATIONS = 5  # capacitated re-assignments
+SETTLED_FRACTION = 0.001  # balancing stops once fewer rows than this change group
+SAMPLE_ROWS = 20_000  # rows k-means++ seeding and the Lloyd iterations look at
+TOLERANCE_KM = 1e-3  # centroid movement that counts as converged
+CHUNK_ROWS = 65_536  # rows per distance block (bounds memory at rows x K)
+CANDIDATE_GROUPS = 16  # groups a row weighs during balanced assignment
+FORMATS = ('json', 'csv', 'zip')
+
+
+def _project(latitudes, longitudes):
+    """(n, 2) array of x/y kilometres on a plane tangent at the mean latitude"""
+    scale = EARTH_RADIUS_M / 1000.0
+    cos_lat = np.cos(np.radians(np.mean(latitudes))) if len(latitudes) else 1.0
+    return np.column_stack([np.radians(longitudes) * cos_lat * scale, np.radians(latitudes) * scale])
+
+
+def _unproject(points, latitudes):
+    scale = EARTH_RADIUS_M / 1000.0
+    cos_lat = np.cos(np.radians(np.mean(latitudes)))
+    return np.degrees(points[:, 1] / scale), np.degrees(points[:, 0] / (cos_lat * scale))
+
+
+def _squared_distances(points, centroids):
+    """(n, k) squared distances between points and centroids"""
+    d = np.subtract.outer(points[:, 0], centroids[:, 0])
+    d *= d
+    dy = np.subtract.outer(points[:, 1], centroids[:, 1])
+    dy *= dy
+    d += dy
+    return d
+
+
+def _nearest(points, centroids, open_groups=None):
+    """(nearest group, squared distance, squared distance to the second nearest) per point"""
+    best = np.empty(len(points), dtype=np.int64)
+    best_d = np.empty(len(points))
+    second_d = np.full(len(points), np.inf)
+    for start in range(0, len(points), CHUNK_ROWS):
+        block = points[start:start + CHUNK_ROWS]
+        d = _squared_distances(block, centroids)
+        if open_groups is not None:
+            d[:, ~open_groups] = np.inf
+        rows = np.arange(len(block))
+        nearest = d.argmin(axis=1)
+        stop = start + len(block)
+        best[start:stop] = nearest
+        best_d[start:stop] = d[rows, nearest]
+        if d.shape[1] > 1:
+            d[rows, nearest] = np.inf
+            second_d[start:stop] = d.min(axis=1)
+    return best, best_d, second_d
+
+
+def _neighbours(centroids, m):
+    """(k, m) indices of the m centroids nearest to each centroid, itself first"""
+    d = _squared_distances(centroids, centroids)
+    np.fill_diagonal(d, -1.0)
+    if m < len(centroids):
+        nearest = np.argpartition(d, m - 1, axis=1)[:, :m]
+    else:
+        nearest = np.broadcast_to(np.arange(len(centroids)), d.shape)
+    rows = np.arange(len(centroids))[:, None]
+    return nearest[rows, d[rows, nearest].argsort(axis=1)]
+
+
+def _candidate_distances(points, centroids, candidates):
+    """Squared distance of every point to each of its candidate centroids"""
+    d = points[:, 0, None] - centroids[candidates, 0]
+    d *= d
+    dy = points[:, 1, None] - centroids[candidates, 1]
+    dy *= dy
+    d += dy
+    return d
+
+
+def _nearest_among(points, centroids, previous):
+    """Nearest centroid of each point, walking from its previous one
+
+    Each step moves a point to the nearest of the CANDIDATE_GROUPS centroids
+    around its current one, until none moves; after the centroid moves of a
+    Lloyd or balancing iteration that takes a step or two and costs
+    rows x CANDIDATE_GROUPS instead of rows x K. The result is exact.
+    """
+    if len(centroids) <= CANDIDATE_GROUPS:
+        return _nearest(points, centroids)[0]
+    neighbours = _neighbours(centroids, CANDIDATE_GROUPS)
+    nearest = previous.copy()
+    moving = np.arange(len(points))
+    while moving.size:
+        candidates = neighbours[nearest[moving]]
+        pick = _candidate_distances(points[moving], centroids, candidates).argmin(axis=1)
+        updated = candidates[np.arange(len(moving)), pick]
+        changed = updated != nearest[moving]
+        nearest[moving] = updated
+        moving = moving[changed]
+    # The walk stops at a centroid nearer than all its neighbours; that is the
+    # nearest of all unless the point is beyond half the distance to the
+    # farthest neighbour, so those few points are checked against every centroid
+    reach = _candidate_distances(centroids, centroids, neighbours[:, -1:])[:, 0]
+    d = _candidate_distances(points, centroids, nearest[:, None])[:, 0]
+    unsure = np.flatnonzero(4 * d > reach[nearest])
+    if unsure.size:
+        nearest[unsure] = _nearest(points[unsure], centroids)[0]
+    return nearest
+
+
+def _open_candidates(points, centroids, open_groups, m):
+    """(n, m) indices of the m nearest open centroids of each point
+
+    Only the open centroids are measured; with fewer than m of them the rest
+    of each row is a closed group, which the caller skips.
+    """
+    groups = np.flatnonzero(open_groups)
+    closed = np.flatnonzero(~open_groups)[:1]
+    candidates = np.empty((len(points), m), dtype=np.int64)
+    for start in range(0, len(points), CHUNK_ROWS):
+        d = _squared_distances(points[start:start + CHUNK_ROWS], centroids[groups])
+        if m < len(groups):
+            nearest = np.argpartition(d, m - 1, axis=1)[:, :m]
+        else:
+            nearest = np.broadcast_to(np.arange(len(groups)), d.shape)
+        candidates[start:start + len(d), :nearest.shape[1]] = groups[nearest]
+        candidates[start:start + len(d), nearest.shape[1]:] = closed
+    return candidates
+
+
+def _seed(sample, k, rng):
+    """k-means++ initial centroids"""
+    centroids = [sample[rng.integers(len(sample))]]
+    closest = ((sample - centroids[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = closest.sum()
+        if total == 0:  # Fewer distinct points than groups
+            choice = rng.integers(len(sample))
+        else:
+            choice = rng.choice(len(sample), p=closest / total)
+        centroids.append(sample[choice])
+        closest = np.minimum(closest, ((sample - sample[choice]) ** 2).sum(axis=1))
+    return np.array(centroids)
+
+
+def _centroids(points, labels, k, previous):
+    counts = np.bincount(labels, minlength=k)
+    sums = np.column_stack([np.bincount(labels, weights=points[:, axis], minlength=k) for axis in range(2)])
+    centroids = previous.copy()
+    filled = counts > 0  # An empty group keeps its old centroid
+    centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def capacities(n, k):
+    """Group sizes differing by at most one row"""
+    sizes = np.full(k, n // k, dtype=np.int64)
+    sizes[:n % k] += 1
+    return sizes
+
+
+def balanced_assign(points, centroids, sizes, nearest):
+    """Labels giving group j exactly sizes[j] points, preferring near centroids
+
+    nearest[i] is the centroid nearest to point i; the groups around it are
+    the ones point i weighs.
+    """
+    k = len(centroids)
+    m = min(CANDIDATE_GROUPS, k)
+    candidates = _neighbours(centroids, m)[nearest]
+    distances = _candidate_distances(points, centroids, candidates)
+    labels = np.full(len(points), -1, dtype=np.int64)
+    remaining = sizes.copy()
+    unassigned = np.arange(len(points))
+    while unassigned.size:
+        d = np.where(remaining[candidates[unassigned]] > 0, distances[unassigned], np.inf)
+        exhausted = np.isinf(d).all(axis=1)
+        if exhausted.any():
+            rows = unassigned[exhausted]
+            candidates[rows] = _open_candidates(points[rows], centroids, remaining > 0, m)
+            distances[rows] = _candidate_distances(points[rows], centroids, candidates[rows])
+            d = np.where(remaining[candidates[unassigned]] > 0, distances[unassigned], np.inf)
+        rows = np.arange(len(unassigned))
+        pick = d.argmin(axis=1)
+        group = candidates[unassigned, pick]
+        best = d[rows, pick]
+        d[rows, pick] = np.inf
+        second = d.min(axis=1)
+        d = best
+        # Within each group: largest regret first, then nearest first
+        order = np.lexsort((d, d - second, group))
+        group = group[order]
+        rank = np.arange(len(order)) - np.searchsorted(group, group, side='left')
+        take = rank < remaining[group]
+        labels[unassigned[order[take]]] = group[take]
+        remaining -= np.bincount(group[take], minlength=k)
+        unassigned = unassigned[order[~take]]
+    return labels
+
+
+def kmeans_groups(latitudes, longitudes, k, balanced=True, seed=0):
+    """(labels, centroid latitudes, centroid longitudes) for k geographic groups.
+
+    labels[i] is the group (0 = northernmost centroid) of point i.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    points = _project(latitudes, longitudes)
+    rng = np.random.default_rng(seed)
+    # Centroids are placed on a sample; a few thousand rows per group pin
+    # them down as well as every row would
+    sample = points if len(points) <= SAMPLE_ROWS else points[rng.choice(len(points), SAMPLE_ROWS, replace=False)]
+    centroids = _seed(sample, k, rng)
+    labels = _nearest(sample, centroids)[0]
+    for _ in range(MAX_ITERATIONS):
+        updated = _centroids(sample, labels, k, centroids)
+        moved = np.sqrt(((updated - centroids) ** 2).sum(axis=1)).max()
+        centroids = updated
+        if moved < TOLERANCE_KM:
+            break
+        labels = _nearest_among(sample, centroids, labels)
+    labels = _nearest(points, centroids)[0]
+
+    if balanced:
+        sizes = capacities(len(points), k)
+        nearest, labels = labels, None
+        for _ in range(BALANCE_ITERATIONS):
+            updated = balanced_assign(points, centroids, sizes, nearest)
+            settled = labels is not None and np.count_nonzero(updated != labels) <= SETTLED_FRACTION * len(points)
+            labels = updated
+            if settled:
+                break
+            centroids = _centroids(points, labels, k, centroids)
+            nearest = _nearest_among(points, centroids, nearest)
+
+    centroid_lats, centroid_lons = _unproject(centroids, latitudes)
+    order = np.lexsort((centroid_lons, -centroid_lats))
+    renumber = np.empty(k, dtype=np.int64)
+    renumber[order] = np.arange(k)
+    return renumber[labels], centroid_lats[order], centroid_lons[order]
+
+
+def groups_response(dataset, payload, request, dataset_label):
+    """Full /groups response (dataset None = 404)"""
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    payload = payload or {}
+    export_format = payload.get('format', 'json')
+    if export_format not in FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(FORMATS)}"}), 400
+    try:
+        k = int(payload.get('k'))
+        seed = int(payload.get('seed', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k (number of groups) and seed must be integers'}), 400
+    balanced = payload.get('balanced', True)
+    if not isinstance(balanced, bool):
+        return jsonify({'error': 'balanced must be true or false'}), 400
+    if not 1 <= k <= min(MAX_GROUPS, dataset.address_count):
+        return jsonify({'error': f'k must be between 1 and {min(MAX_GROUPS, dataset.address_count)}'}), 400
+
+    labels, centroid_lats, centroid_lons = kmeans_groups(
+        dataset.latitudes, dataset.longitudes, k, balanced=balanced, seed=seed)
+    sizes = np.bincount(labels, minlength=k)
+    names = [f'Group {number}' for number in range(1, k + 1)]
+
+    if export_format == 'json':
+        return jsonify({
+            'dataset': dataset_label,
+            'k': k,
+            'groups': [{'group': number, 'name': name, 'size': int(size), 'centroid': [lat, lon]}
+                       for number, (name, size, lat, lon) in
+                       enumerate(zip(names, sizes, centroid_lats.tolist(), centroid_lons.tolist()), start=1)],
+            'labels': (labels + 1).tolist(),
+        })
+    if export_format == 'csv':
+        positions = np.argsort(labels, kind='stable')
+        return csv_response(iter_csv(dataset.df, positions, extra_columns={'Group': labels[positions] + 1}),
+                            f'groups_{dataset_label}.csv', request)
+    summary = pd.DataFrame({'Group': names, 'Addresses': sizes,
+                            'Centroid Latitude': centroid_lats, 'Centroid Longitude': centroid_lons})
+    positions = np.argsort(labels, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    parts = [(name, positions[bounds[number]:bounds[number + 1]]) for number, name in enumerate(names)]
+    bundle = zip_bundle(dataset.df, parts, 'groups_summary.csv', summary)
+    return send_file(bundle, mimetype='application/zip',
+                     as_attachment=True, download_name=f'groups_{dataset_label}.zip')
@@ -0,0 +1,78 @@
+"""
+Gunicorn settings for production serving
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Runs several web worker processes plus one geocoding runner process
+(geocode_runner.py), which gunicorn starts once it is ready, restarts if it
+exits and stops on shutdown. The web workers only queue jobs, report their
+progress and pass on cancel requests (GEOCODE_RUNNER=external): the job queue
+lives in GEOCODE_JOBS_PATH and job progress and cancel requests in
+GEOCODE_PROGRESS_PATH, so any process can answer any request. Geocoding a
+large upload is CPU bound in places and never runs on a web worker's event
+loop. Each process writes its metrics to METRICS_DIR so /metrics reports the
+totals of all of them.
+
+Progress streams (/progress/<id>/stream) stay open for as long as the job
+runs, so the workers are gevent workers: an open stream is a greenlet waiting
+on the progress store's watcher, and each process serves up to
+WORKER_CONNECTIONS connections at once, streams included. Without gevent
+installed (e.g. on Windows) the workers fall back to gthread, where every
+open stream holds one of the WEB_THREADS threads of its process.
+"""
+
+import glob
+import importlib.util
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+
+bind = os.environ.get('BIND', '0.0.0.0:8765')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gevent' if importlib.util.find_spec('gevent') else 'gthread'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '1000'))
+threads = int(os.environ.get('WEB_THREADS', '16'))  # gthread only
+timeout = 120  # Large uploads and exports
+graceful_timeout = 30
+accesslog = '-'
+
+# Workers inherit the environment; snapshots of a previous run are dropped
+metrics_dir = os.environ.setdefault('METRICS_DIR', 'metrics')
+os.environ['GEOCODE_RUNNER'] = 'external'
+
+RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geocode_runner.py')
+RUNNER_RESTART_DELAY = 5  # seconds before restarting a runner that exited
+_runner = None
+_stopping = threading.Event()
+
+
+def _supervise_runner(server):
+    global _runner
+    while not _stopping.is_set():
+        _runner = subprocess.Popen([sys.executable, RUNNER_SCRIPT])
+        server.log.info("Started geocoding runner (pid: %s)", _runner.pid)
+        code = _runner.wait()
+        if not _stopping.is_set():
+            server.log.warning("Geocoding runner exited with code %s; restarting", code)
+            _stopping.wait(RUNNER_RESTART_DELAY)
+
+
+def on_starting(server):
+    for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json*')):
+        os.remove(path)
+
+
+def when_ready(server):
+    threading.Thread(target=_supervise_runner, args=(server,), name='runner-supervisor', daemon=True).start()
+
+
+def on_exit(server):
+    _stopping.set()
+    if _runner is not None and _runner.poll() is None:
+        _runner.terminate()
+        try:
+            _runner.wait(graceful_timeout)
+        except subprocess.TimeoutExpired:
+            _runner.kill()
@@ -0,0 +1,176 @@
+"""
+Streaming CSV ingestion for uploads
+
+Uploads are read in fixed-size chunks instead of all at once. The layout
+(whether the first row is a header, and which column holds each field) is
+sniffed from the first few rows only, and every chunk is then mapped to
+COLUMNS and cleaned on its own, so memory use does not grow with file size.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from address_normalize import address_key
+
+COLUMNS = ['Family Name', 'Address', 'City', 'State', 'Zip', 'PeopleID']
+CHUNK_SIZE = 50_000  # rows
+SNIFF_ROWS = 5
+
+# Typical roster layout when there are no usable headers:
+# Name, Address, Extra, City, State, Zip, PeopleID
+POSITIONAL_COLUMNS = {'Family Name': 0, 'Address': 1, 'City': 3, 'State': 4, 'Zip': 5, 'PeopleID': 6}
+
+# Words that only show up in a header row
+HEADER_WORDS = ('family', 'name', 'address', 'city', 'state', 'zip', 'postal', 'people', 'id')
+
+CsvLayout = namedtuple('CsvLayout', ['has_header', 'columns', 'description'])
+CsvLayout.__doc__ = """How to read an upload: columns maps each of COLUMNS to a column index (or None)"""
+
+AddressGroups = namedtuple('AddressGroups', ['row_groups', 'addresses', 'keys', 'total_rows'])
+
+
+def _looks_like_data(values):
+    """The original heuristic: numbers, several words or a state in the first row"""
+    return any(
+        str(val).strip() and (
+            any(char.isdigit() for char in str(val)) or  # Contains numbers
+            len(str(val).split()) > 1 or  # Multiple words
+            str(val).lower() in ['tx', 'ca', 'ny', 'fl']  # State abbreviations
+        ) for val in values[:5]  # Check first 5 columns
+    )
+
+
+def _is_header(values):
+    names = [str(val).strip().lower() for val in values if pd.notna(val)]
+    known = sum(1 for name in names if any(word in name for word in HEADER_WORDS))
+    if known >= 2 and not any(char.isdigit() for name in names for char in name):
+        return True
+    return not _looks_like_data(values)
+
+
+def _map_header(header):
+    """Map header names to column indexes; None if too few columns match"""
+    if all(col in header for col in COLUMNS):
+        return {col: header.index(col) for col in COLUMNS}, "exact column match"
+
+    column_mapping = {}
+    for i, col in enumerate(header):
+        col_lower = str(col).lower()
+        if i == 0 or 'family' in col_lower or ('name' in col_lower and 'file' not in col_lower):
+            column_mapping['Family Name'] = i
+        elif i == 1 or ('address' in col_lower and 'email' not in col_lower):
+            column_mapping['Address'] = i
+        elif i == 3 or 'city' in col_lower:
+            column_mapping['City'] = i
+        elif i == 4 or 'state' in col_lower:
+            column_mapping['State'] = i
+        elif i == 5 or 'zip' in col_lower or 'postal' in col_lower:
+            column_mapping['Zip'] = i
+        elif i == 6 or 'people' in col_lower or 'id' in col_lower:
+            column_mapping['PeopleID'] = i
+    if len(column_mapping) >= 4:  # At least name, address, city, state
+        return {col: column_mapping.get(col) for col in COLUMNS}, "column mapping"
+    return None, None
+
+
+def sniff_layout(csv_path, sample_rows=SNIFF_ROWS):
+    """Work out the layout of an upload from its first few rows"""
+    sample = pd.read_csv(csv_path, header=None, nrows=sample_rows, dtype=str)
+    if sample.empty:
+        raise ValueError("The uploaded file is empty.")
+    n_columns = len(sample.columns)
+    first_row = sample.iloc[0].tolist()
+
+    has_header = _is_header(first_row)
+    columns, description = None, None
+    if has_header:
+        header = [str(val).strip() if pd.notna(val) else '' for val in first_row]
+        columns, description = _map_header(header)
+    else:
+        description = "positional mapping (no headers)"
+    if columns is None:
+        columns = {col: (i if i < n_columns else None) for col, i in POSITIONAL_COLUMNS.items()}
+        description = description or "positional mapping (fallback)"
+    return CsvLayout(has_header, columns, description)
+
+
+def clean_chunk(chunk, layout):
+    """Map one raw chunk to COLUMNS and drop rows without address/city/state"""
+    df = pd.DataFrame({
+        col: chunk.iloc[:, index] if index is not None and index < len(chunk.columns) else ''
+        for col, index in layout.columns.items()
+    }, index=chunk.index)
+    df = df.fillna('').astype(str)
+
+    # Remove rows with missing critical data
+    valid = (
+        (df['Address'].str.strip() != '') &
+        (df['City'].str.strip() != '') &
+        (df['State'].str.strip() != '')
+    )
+    df = df[valid]
+
+    # Clean up zip codes (remove extra digits)
+    df['Zip'] = df['Zip'].str.split('-').str[0]  # Take only first part of zip
+    return df
+
+
+def iter_clean_chunks(csv_path, layout, chunk_size=CHUNK_SIZE):
+    """Yield (cleaned DataFrame, rows read) per chunk of the upload"""
+    reader = pd.read_csv(csv_path, header=None, skiprows=1 if layout.has_header else 0,
+                         dtype=str, chunksize=chunk_size)
+    for chunk in reader:
+        yield clean_chunk(chunk, layout), len(chunk)
+
+
+def full_addresses(df):
+    """'Address, City, State, Zip' strings for a cleaned chunk"""
+    parts = [df[col].str.strip().tolist() for col in ('Address', 'City', 'State', 'Zip')]
+    return [', '.join(part for part in row if part) for row in zip(*parts)]
+
+
+def group_rows_by_address(csv_path, layout, chunk_size=CHUNK_SIZE):
+    """Stream an upload and group its valid rows on a canonical address key.
+
+    Returns AddressGroups: the group index of every valid row (in file
+    order), the full address to geocode and the address key of each group,
+    and the number of rows read. Only the unique addresses are kept in memory.
+    """
+    group_ids = {}  # address key -> group index
+    addresses = []
+    keys = []
+    row_groups = []
+    total_rows = 0
+    for df, rows_read in iter_clean_chunks(csv_path, layout, chunk_size):
+        total_rows += rows_read
+        chunk_groups = np.empty(len(df), dtype=np.int64)
+        written_as = {}  # Rows typed identically within the chunk skip normalization
+        rows = zip(full_addresses(df), *(df[col].tolist() for col in ('Address', 'City', 'State', 'Zip')))
+        for i, (address, *parts) in enumerate(rows):
+            group = written_as.get(address)
+            if group is None:
+                key = address_key(*parts)
+                group = group_ids.get(key)
+                if group is None:
+                    group = group_ids[key] = len(addresses)
+                    addresses.append(address)
+                    keys.append(key)
+                written_as[address] = group
+            chunk_groups[i] = group
+        row_groups.append(chunk_groups)
+    row_groups = np.concatenate(row_groups) if row_groups else np.empty(0, dtype=np.int64)
+    return AddressGroups(row_groups, addresses, keys, total_rows)
+
+
+def address_keys(df):
+    """Canonical address key of every row of a DataFrame with the address columns"""
+    keys = []
+    written_as = {}
+    for parts in zip(*(df[col].fillna('').astype(str).tolist() for col in ('Address', 'City', 'State', 'Zip'))):
+        key = written_as.get(parts)
+        if key is None:
+            key = written_as[parts] = address_key(*parts)
+        keys.append(key)
+    return keys
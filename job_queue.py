@@ -0,0 +1,285 @@
+"""
+Durable geocoding job queue
+
+Uploads are no longer geocoded on a thread of their own. Each one becomes a
+row in a small SQLite database and a fixed pool of worker threads drains the
+queue, highest priority first (then oldest first). This bounds how many jobs
+run at once; all jobs also go through the same process-wide geocoder backends,
+so they share one rate budget instead of each bringing its own.
+
+Job state is persisted, so queued jobs survive a restart. Jobs that were
+running when the previous process stopped are put back in the queue and
+picked up again by the workers (geocoding resumes from its checkpoint).
+
+When several server processes share the queue (e.g. under gunicorn), only
+the one holding an exclusive lock on `<path>.lock` runs the worker pool, so
+the worker count and rate budget stay the same however many processes serve
+requests. The others stand by and take over if that process exits. Any
+process can submit, list and cancel jobs.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: no runner lock, single-process serving only
+    fcntl = None
+
+DEFAULT_WORKERS = 2
+POLL_INTERVAL = 1.0  # seconds; also picks up jobs queued by another process
+RUNNER_RETRY_INTERVAL = 5.0  # seconds between standby attempts to take over the workers
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class JobQueue:
+    """Persistent priority queue of jobs drained by a bounded worker pool.
+
+    `handler(job)` runs one job and returns its final status string
+    ('completed', 'canceled', 'error', ...); an exception counts as 'error'.
+    `on_start()`, if given, runs once in the process that takes over the
+    workers, before interrupted jobs are re-queued.
+    """
+
+    def __init__(self, path, handler, workers=DEFAULT_WORKERS, on_start=None):
+        self.path = path
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.on_start = on_start
+        self._runner_lock = None
+        self._standby = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id TEXT PRIMARY KEY,'
+                ' dataset_name TEXT NOT NULL,'
+                ' priority INTEGER NOT NULL DEFAULT 0,'
+                ' status TEXT NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' error TEXT,'
+                ' created_at REAL NOT NULL,'
+                ' started_at REAL,'
+                ' finished_at REAL'
+                ')'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_queue ON jobs (status, priority, created_at)')
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def _acquire_runner_lock(self):
+        """Try to become the process that runs the workers"""
+        if fcntl is None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._runner_lock = lock_file  # Held until this process exits
+        return True
+
+    def start(self):
+        """Start the worker pool, or stand by if another process runs it"""
+        if self._threads or self._standby:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if self._acquire_runner_lock():
+            self._start_workers()
+            return
+        logger.info("Job queue: workers run in another process (pid %d standing by)", os.getpid())
+        self._standby = threading.Thread(target=self._wait_for_runner_lock, name='geocode-standby')
+        self._standby.daemon = True
+        self._standby.start()
+
+    def _wait_for_runner_lock(self):
+        while not self._stop.wait(RUNNER_RETRY_INTERVAL):
+            if self._acquire_runner_lock():
+                logger.info("Job queue: taking over the workers (pid %d)", os.getpid())
+                self._start_workers()
+                return
+
+    def _start_workers(self):
+        """Re-queue jobs interrupted by a restart and start the worker pool"""
+        if self.on_start is not None:
+            self.on_start()
+        with self._lock:
+            requeued = self._connect().execute(
+                'UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?',
+                (STATUS_QUEUED, STATUS_RUNNING)).rowcount
+            queued = self._connect().execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ?', (STATUS_QUEUED,)).fetchone()[0]
+        if requeued:
+            logger.info("Job queue: %d interrupted job(s) put back in the queue", requeued)
+        logger.info("Job queue: %d worker(s), %d job(s) waiting", self.workers, queued)
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'geocode-worker-{number + 1}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """Stop taking new jobs; running jobs are re-queued on next start"""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        # Let a standby process take over, unless a job is still running here
+        if self._runner_lock is not None and not any(thread.is_alive() for thread in self._threads):
+            self._runner_lock.close()
+            self._runner_lock = None
+
+    def submit(self, dataset_name, payload=None, priority=0, job_id=None):
+        """Queue a job and return it"""
+        job_id = job_id or str(uuid.uuid4())
+        with self._wakeup:
+            self._connect().execute(
+                'INSERT INTO jobs (id, dataset_name, priority, status, payload, created_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, dataset_name, int(priority), STATUS_QUEUED, json.dumps(payload or {}), time.time()))
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job(row)
+
+    def list_jobs(self, statuses=None, limit=100):
+        """Jobs, queued and running first, each queued job with its queue_position"""
+        sql = 'SELECT * FROM jobs'
+        params = []
+        if statuses:
+            sql += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params += list(statuses)
+        sql += (" ORDER BY CASE status WHEN 'running' THEN 0 WHEN 'queued' THEN 1 ELSE 2 END,"
+                " CASE WHEN status = 'queued' THEN -priority ELSE 0 END,"
+                " CASE WHEN status IN ('queued', 'running') THEN created_at ELSE -finished_at END"
+                " LIMIT ?")
+        params.append(int(limit))
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        jobs = [self._job(row) for row in rows]
+        position = 0
+        for job in jobs:
+            if job['status'] == STATUS_QUEUED:
+                position += 1
+                job['queue_position'] = position
+        return jobs
+
+    def queue_position(self, job_id):
+        """1-based position of a queued job, or None if it is not queued"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT priority, created_at FROM jobs WHERE id = ? AND status = ?',
+                (job_id, STATUS_QUEUED)).fetchone()
+            if row is None:
+                return None
+            ahead = self._connect().execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ? AND'
+                ' (priority > ? OR (priority = ? AND created_at < ?))',
+                (STATUS_QUEUED, row['priority'], row['priority'], row['created_at'])).fetchone()[0]
+        return ahead + 1
+
+    def has_active_job(self, dataset_name):
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT 1 FROM jobs WHERE dataset_name = ? AND status IN (?, ?) LIMIT 1',
+                (dataset_name, *ACTIVE_STATUSES)).fetchone()
+        return row is not None
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet; returns the job or None"""
+        with self._lock:
+            updated = self._connect().execute(
+                'UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+                ('canceled', time.time(), job_id, STATUS_QUEUED)).rowcount
+        return self.get(job_id) if updated else None
+
+    def cancel_dataset(self, dataset_name=None):
+        """Cancel queued jobs for one dataset (None = all); returns those jobs"""
+        jobs = [job for job in self.list_jobs([STATUS_QUEUED], limit=-1)
+                if dataset_name is None or job['dataset_name'] == dataset_name]
+        return [canceled for canceled in (self.cancel(job['id']) for job in jobs) if canceled]
+
+    def _claim(self):
+        """Atomically move the next queued job to running (safe across processes)"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1',
+                    (STATUS_QUEUED,)).fetchone()
+                if row is not None:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?',
+                        (STATUS_RUNNING, time.time(), row['id']))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return self._job(row)
+
+    def _finish(self, job_id, status, error=None):
+        with self._lock:
+            self._connect().execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, error, time.time(), job_id))
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error("Job queue error: %s", e)
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_INTERVAL)
+                continue
+
+            logger.info("Starting job %s for dataset '%s' (priority %s)", job['id'], job['dataset_name'], job['priority'],
+                        extra={'job_id': job['id'], 'dataset': job['dataset_name']})
+            try:
+                status = self.handler(job) or 'completed'
+                self._finish(job['id'], status)
+            except Exception as e:
+                logger.exception("Job %s failed: %s", job['id'], e, extra={'job_id': job['id']})
+                self._finish(job['id'], 'error', str(e))
@@ -0,0 +1,280 @@
+"""
+Prometheus-style metrics (GET /metrics)
+
+Counters and histograms kept in memory and rendered in the Prometheus text
+exposition format (0.0.4), so no client library is needed:
+
+  geocoder_requests_total{backend,outcome}    one per provider request (retries count):
+                                              found, no_result, rate_limited, timeout,
+                                              unavailable or error
+  geocoder_request_seconds{backend}           provider request latency
+  geocode_cache_lookups_total{result}         hit / miss, per unique address
+  geocode_stage_seconds{stage}                read, cache, geocode and write time per job
+  geocode_rows_total{result}                  geocoded / failed rows of finished jobs
+  geocode_jobs_total{status}                  completed, canceled or error
+  http_request_seconds{route,method,status}   until the last byte of the body was sent
+  dataset_load_seconds{part}                  coordinates + index on a store miss, and
+                                              the lazy row decode
+  dataset_rows_loaded_total
+
+Under gunicorn every worker process counts on its own. With METRICS_DIR set
+(gunicorn.conf.py sets it and empties it at startup), each process writes a
+snapshot there every FLUSH_INTERVAL seconds and /metrics adds up the
+snapshots of all processes, so whichever worker answers reports the totals.
+Snapshots of exited workers are kept so counters never go backwards.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 14400.0)
+FLUSH_INTERVAL = 5  # seconds between snapshot writes to METRICS_DIR
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def render(self, samples):
+        for key, value in sorted(samples.items()):
+            yield f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+
+
+class Histogram:
+    """Bucketed observations (plus sum and count) per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[slot] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(counts)] for key, counts in self._values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def render(self, samples):
+        for key, counts in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {_number(counts[-1])}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}'
+
+
+class Registry:
+    """The metrics of this process, optionally shared through a directory"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self._flusher = None
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def _snapshot_file(self):
+        return os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+
+    def share(self, directory, interval=FLUSH_INTERVAL):
+        """Write this process's snapshot to `directory` every `interval` seconds"""
+        if not directory or self._flusher is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+        def flush_forever():
+            while True:
+                time.sleep(interval)
+                self.flush()
+
+        self._flusher = threading.Thread(target=flush_forever, name='metrics-flush')
+        self._flusher.daemon = True
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def flush(self):
+        if self.directory is None:
+            return
+        path = self._snapshot_file()
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass  # Metrics never break the app; the next flush tries again
+
+    def _snapshots(self):
+        """Own live snapshot plus the last snapshot of every other process"""
+        snapshots = [self.snapshot()]
+        if self.directory is None:
+            return snapshots
+        own = self._snapshot_file()
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        snapshots = self._snapshots()
+        lines = []
+        for metric in metrics:
+            samples = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, ()):
+                    key = tuple(key)
+                    samples[key] = metric.merge(samples.get(key), value)
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render(samples))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+GEOCODER_REQUESTS = REGISTRY.counter(
+    'geocoder_requests_total', 'Geocoder provider requests by outcome', ('backend', 'outcome'))
+GEOCODER_LATENCY = REGISTRY.histogram(
+    'geocoder_request_seconds', 'Geocoder provider request latency', ('backend',))
+CACHE_LOOKUPS = REGISTRY.counter(
+    'geocode_cache_lookups_total', 'Geocode cache lookups of unique addresses', ('result',))
+GEOCODE_STAGE_SECONDS = REGISTRY.histogram(
+    'geocode_stage_seconds', 'Time spent in each stage of a geocoding job', ('stage',), STAGE_BUCKETS)
+GEOCODE_ROWS = REGISTRY.counter(
+    'geocode_rows_total', 'Rows written by finished geocoding jobs', ('result',))
+GEOCODE_JOBS = REGISTRY.counter(
+    'geocode_jobs_total', 'Geocoding jobs by final status', ('status',))
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_seconds', 'HTTP request latency including the streamed body', ('route', 'method', 'status'))
+DATASET_LOAD_SECONDS = REGISTRY.histogram(
+    'dataset_load_seconds', 'Dataset load time (coordinates and index, or the rows)', ('part',))
+DATASET_ROWS_LOADED = REGISTRY.counter(
+    'dataset_rows_loaded_total', 'Rows loaded into the dataset store')
+
+
+def instrument_app(app):
+    """Time every request (by route pattern) into http_request_seconds"""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method, status = request.method, response.status_code
+        # Streamed bodies (CSV exports, progress streams) finish after this
+        # hook, so the observation is made when the response is closed
+        response.call_on_close(lambda: HTTP_LATENCY.observe(
+            time.perf_counter() - start, route=route, method=method, status=status))
+        return response
+
+
+def metrics_response():
+    return Response(REGISTRY.render(), mimetype=None, content_type=CONTENT_TYPE)
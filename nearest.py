@@ -0,0 +1,135 @@
+"""
+k-nearest-family queries
+
+GET /nearest/<dataset>?lat=&lon=&k=10[&max_radius=meters] returns the k rows
+closest to a point, nearest first, with Rank and Distance_m added; no more
+drawing ever bigger circles until enough families are inside.
+
+POST /nearest/<dataset> answers a whole list of points in one request, e.g.
+the nearest 10 families for every small-group host:
+
+  {"points": [{"name": "Host A", "lat": 32.8, "lon": -96.8}, [32.7, -96.9], ...],
+   "k": 10, "max_radius": 5000, "format": "json" | "csv"}
+
+csv returns one row per (point, neighbour) pair with Query, Rank and
+Distance_m columns. Each point is answered from the dataset's grid index
+(GridIndex.query_nearest), which only reads the cells around the point.
+"""
+
+import json
+
+import numpy as np
+from flask import jsonify
+
+from csv_export import csv_response, iter_csv
+
+DEFAULT_K = 10
+MAX_K = 1_000
+MAX_QUERY_POINTS = 1_000
+FORMATS = ('json', 'csv')
+
+
+def _coordinates(lat, lon, what):
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError(f'{what}: lat and lon must be numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f'{what}: lat/lon out of range')
+    return lat, lon
+
+
+def parse_options(values):
+    """(k, max_radius) from query args or a JSON body; raises ValueError"""
+    try:
+        k = int(values.get('k', DEFAULT_K))
+        max_radius = values.get('max_radius')
+        max_radius = float(max_radius) if max_radius not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('k must be an integer and max_radius a number (meters)')
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f'k must be between 1 and {MAX_K}')
+    if max_radius is not None and max_radius < 0:
+        raise ValueError('max_radius must not be negative')
+    return k, max_radius
+
+
+def parse_points(points):
+    """[(name, lat, lon)] from a batch body's points; raises ValueError"""
+    if not isinstance(points, list) or not points:
+        raise ValueError('points must be a non-empty list')
+    if len(points) > MAX_QUERY_POINTS:
+        raise ValueError(f'At most {MAX_QUERY_POINTS} points per request')
+    parsed = []
+    for number, point in enumerate(points, start=1):
+        if isinstance(point, dict):
+            name = str(point.get('name') or f'Point {number}')
+            lat, lon = _coordinates(point.get('lat'), point.get('lon'), name)
+        elif isinstance(point, list) and len(point) == 2:
+            name = f'Point {number}'
+            lat, lon = _coordinates(point[0], point[1], name)
+        else:
+            raise ValueError(f'Point {number} must be {{"name", "lat", "lon"}} or [lat, lon]')
+        parsed.append((name, lat, lon))
+    return parsed
+
+
+def _ranked_rows(dataset, positions, distances, ranks):
+    """Row dicts for the given positions with Rank and Distance_m added"""
+    selected = dataset.df.iloc[positions].assign(Rank=ranks, Distance_m=distances)
+    return json.loads(selected.to_json(orient='records'))
+
+
+def nearest_response(dataset, request, dataset_label):
+    """Single-point (GET) or batch (POST) /nearest response (dataset None = 404)"""
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+
+    if request.method == 'GET':
+        try:
+            lat, lon = _coordinates(request.args.get('lat'), request.args.get('lon'), 'center')
+            k, max_radius = parse_options(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        positions, distances = dataset.select_nearest(lat, lon, k, max_radius)
+        return jsonify({
+            'dataset': dataset_label,
+            'center': [lat, lon],
+            'k': k,
+            'count': len(positions),
+            'rows': _ranked_rows(dataset, positions, distances, np.arange(1, len(positions) + 1)),
+        })
+
+    payload = {} if request.json is None else request.json
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    export_format = payload.get('format', 'json')
+    if export_format not in FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(FORMATS)}"}), 400
+    try:
+        points = parse_points(payload.get('points'))
+        k, max_radius = parse_options(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    answers = [dataset.select_nearest(lat, lon, k, max_radius) for _, lat, lon in points]
+    positions = np.concatenate([p for p, _ in answers])
+    distances = np.concatenate([d for _, d in answers])
+    ranks = np.concatenate([np.arange(1, len(p) + 1) for p, _ in answers])
+    counts = [len(p) for p, _ in answers]
+
+    if export_format == 'csv':
+        queries = np.repeat(np.array([name for name, _, _ in points], dtype=object), counts)
+        response = csv_response(
+            iter_csv(dataset.df, positions, extra_columns={'Query': queries, 'Rank': ranks, 'Distance_m': distances}),
+            f'nearest_{dataset_label}.csv', request)
+        response.headers['X-Selected-Count'] = str(len(positions))
+        return response
+
+    rows = _ranked_rows(dataset, positions, distances, ranks)
+    results = []
+    start = 0
+    for (name, lat, lon), count in zip(points, counts):
+        results.append({'name': name, 'center': [lat, lon], 'count': count, 'rows': rows[start:start + count]})
+        start += count
+    return jsonify({'dataset': dataset_label, 'k': k, 'results': results})
@@ -0,0 +1,140 @@
+"""
+Opt-in cProfile profiling of requests and geocoding jobs
+
+Profiling is off unless PROFILING_TOKEN is set, and then only the requests
+that carry the token pay for it (hooks are not even installed without it):
+
+  request   send `X-Profile: <token>` (or `?profile=<token>`) with any request.
+            The handler, and a streamed body until it is closed, runs under
+            cProfile; the response names the saved profile in X-Profile-Id.
+  job       upload or resume with the same header; the whole geocode_dataset
+            run is profiled and its name appears as `profile` in /progress.
+            Only the job's own thread is profiled: the geocoder worker
+            threads show up as time spent waiting for results (the per-stage
+            timings in /metrics cover them).
+
+Profiles are pstats files in PROFILES_DIR (the newest MAX_PROFILES are kept),
+listed by GET /profiles and downloaded from GET /profiles/<name>, for
+`python -m pstats` or snakeviz; `?format=text` gives the top functions by
+cumulative time instead. Both endpoints need the token too.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import Response, g, jsonify, send_file
+
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILES_DIR = os.environ.get('PROFILES_DIR', 'profiles')
+MAX_PROFILES = 100
+TEXT_LINES = 60  # functions in the ?format=text report
+PROFILE_NAME = re.compile(r'^[\w.-]+\.prof$')
+
+
+def profile_requested(request):
+    """True if the request carries the profiling token"""
+    if not PROFILING_TOKEN:
+        return False
+    supplied = request.headers.get('X-Profile') or request.args.get('profile') or ''
+    return hmac.compare_digest(supplied.encode(), PROFILING_TOKEN.encode())
+
+
+def _new_name(kind, label):
+    slug = re.sub(r'[^\w-]+', '_', label).strip('_')[:60] or 'root'
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{kind}-{slug}-{uuid.uuid4().hex[:8]}.prof"
+
+
+def _start():
+    """An enabled profiler, or None if another one is already running here"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except (ValueError, RuntimeError):  # One profiler at a time
+        return None
+    return profiler
+
+
+def _save(profiler, name):
+    profiler.disable()
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILES_DIR, name))
+    profiles = sorted(os.scandir(PROFILES_DIR), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in [entry for entry in profiles if PROFILE_NAME.match(entry.name)][MAX_PROFILES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def profiled(kind, label, enabled=True):
+    """Profile the block if enabled; yields the profile name (or None)"""
+    profiler = _start() if enabled else None
+    if profiler is None:
+        yield None
+        return
+    name = _new_name(kind, label)
+    try:
+        yield name
+    finally:
+        _save(profiler, name)
+
+
+def profile_requests(app):
+    """Profile requests that carry the token (no-op without PROFILING_TOKEN)"""
+    if not PROFILING_TOKEN:
+        return
+    from flask import request
+
+    @app.before_request
+    def start_profile():
+        # The /profiles endpoints take the token too but are not profiled
+        if profile_requested(request) and not request.path.startswith('/profiles'):
+            g.profiler = _start()
+
+    @app.after_request
+    def finish_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        name = _new_name('request', request.path)
+        response.headers['X-Profile-Id'] = name
+        # Streamed bodies are produced after this hook; stop when they are done
+        response.call_on_close(lambda: _save(profiler, name))
+        return response
+
+
+def profiles_response(request):
+    """GET /profiles: saved profiles, newest first"""
+    if not profile_requested(request):
+        return jsonify({'error': 'Not found'}), 404
+    profiles = []
+    if os.path.isdir(PROFILES_DIR):
+        for entry in os.scandir(PROFILES_DIR):
+            if PROFILE_NAME.match(entry.name):
+                stat = entry.stat()
+                profiles.append({'name': entry.name, 'size': stat.st_size, 'created': stat.st_mtime})
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return jsonify({'profiles': profiles})
+
+
+def profile_response(name, request):
+    """GET /profiles/<name>: the pstats file, or a text report with ?format=text"""
+    if not profile_requested(request):
+        return jsonify({'error': 'Not found'}), 404
+    path = os.path.join(PROFILES_DIR, name)
+    if not PROFILE_NAME.match(name) or not os.path.isfile(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'text':
+        report = io.StringIO()
+        pstats.Stats(path, stream=report).sort_stats('cumulative').print_stats(TEXT_LINES)
+        return Response(report.getvalue(), mimetype='text/plain')
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=name)
@@ -0,0 +1,315 @@
+"""
+Geocoding progress and cancel requests shared between server processes
+
+geocoding_progress used to be a plain dict of dicts, which only worked while
+a single process served every request. ProgressStore keeps the same write
+interface for the process running a job (progress[id] = {...},
+progress[id]['status'] = ..., progress[id].update(...)), but publishes each
+job's state to a small SQLite database in WAL mode, so any worker process
+can answer /progress, stream it, or request a cancel.
+
+Writes are published at most every PUBLISH_INTERVAL seconds by a background
+thread, except new entries and status changes, which are published at
+once. An entry is dropped from memory once its final status (one of
+TERMINAL_STATUSES) is published; the published row answers from then on. Readers only do a primary-key lookup on their own connection, and WAL
+lets them run in parallel with each other and with the writer.
+
+Listeners waiting for a job to change (the /progress/<id>/stream
+connections) do not poll on their own: one watcher thread per process reads
+the versions of every watched job in a single query each POLL_INTERVAL and
+wakes the listeners whose job changed through a condition variable.
+
+Each process opens one connection (on first use, so after any fork) and its
+threads take turns on it; the table is created once, with the store.
+
+Each entry also keeps recent (time, progress) samples to report throughput
+and an ETA.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+RATE_WINDOW = 30  # seconds of samples used for rows/s
+PUBLISH_INTERVAL = 0.25  # seconds between publishing progress-only changes
+POLL_INTERVAL = 0.5  # seconds between the watcher's version checks; bursts of changes coalesce to one
+CANCEL_CHECK_INTERVAL = 0.5  # seconds a cancel check result is reused
+RETENTION = 7 * 24 * 60 * 60  # seconds finished entries are kept
+TERMINAL_STATUSES = ('completed', 'canceled', 'error', 'interrupted', 'not_found')
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressEntry(dict):
+    """One job's progress fields; writes are published through the owning store"""
+
+    def __init__(self, store, progress_id, fields):
+        super().__init__(fields)
+        self._store = store
+        self.progress_id = progress_id
+        self._samples = deque()
+        self._sample(self.get('progress'))
+
+    def __setitem__(self, key, value):
+        urgent = key == 'status' and value != self.get('status')
+        super().__setitem__(key, value)
+        if key == 'progress':
+            self._sample(value)
+        self._store._changed(self, urgent)
+
+    def update(self, *args, **kwargs):
+        """Change several fields at once; readers never see half of them"""
+        status = self.get('status')
+        super().update(*args, **kwargs)
+        if 'progress' in self:
+            self._sample(self['progress'])
+        self._store._changed(self, self.get('status') != status)
+
+    def _sample(self, value):
+        if value is None:
+            return
+        now = time.monotonic()
+        self._samples.append((now, value))
+        while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+
+    def reset_rate(self):
+        """Start measuring throughput from now (e.g. after instant cache hits)"""
+        self._samples.clear()
+        self._sample(self.get('progress'))
+
+    def rate(self):
+        """(rows per second, seconds remaining) over the recent window, or (None, None)"""
+        if len(self._samples) < 2:
+            return None, None
+        (start, first), (end, last) = self._samples[0], self._samples[-1]
+        if end <= start or last <= first:
+            return None, None
+        rows_per_second = (last - first) / (end - start)
+        remaining = max(0, (self.get('total') or 0) - last)
+        return rows_per_second, remaining / rows_per_second
+
+    def snapshot(self):
+        """Plain dict copy with rows_per_second and eta_seconds added"""
+        data = dict(self)
+        rows_per_second, eta = self.rate() if data.get('status') == 'geocoding' else (None, None)
+        data['rows_per_second'] = round(rows_per_second, 2) if rows_per_second is not None else None
+        data['eta_seconds'] = round(eta) if eta is not None else None
+        return data
+
+
+class ProgressStore:
+    """progress_id -> progress fields, shared through SQLite.
+
+    Item access (store[id], id in store, store.get(id)) only sees unfinished
+    entries written by this process; use snapshot() to read any job's
+    published state.
+    """
+
+    def __init__(self, path, publish_interval=PUBLISH_INTERVAL):
+        self.path = path
+        self.publish_interval = publish_interval
+        self._entries = {}
+        self._dirty = {}  # progress_id -> entry with unpublished changes
+        self._lock = threading.Lock()
+        self._publisher = None
+        self._db_lock = threading.RLock()
+        self._conn = None
+        self._conn_pid = None
+        self._cancel_checks = {}  # progress_id -> (checked_at, requested)
+        self._watch = threading.Condition()
+        self._watching = {}  # progress_id -> number of waiting listeners
+        self._versions = {}  # progress_id -> last version seen by the watcher
+        self._watcher = None
+        with self._db() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS progress ('
+                ' id TEXT PRIMARY KEY,'
+                ' data TEXT,'
+                ' version INTEGER NOT NULL DEFAULT 0,'
+                ' cancel_requested INTEGER NOT NULL DEFAULT 0,'
+                ' updated_at REAL NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            conn.execute('DELETE FROM progress WHERE updated_at < ?', (time.time() - RETENTION,))
+        atexit.register(self.flush)
+
+    @contextmanager
+    def _db(self):
+        """This process's connection, one thread at a time; commits on success"""
+        with self._db_lock:
+            if self._conn_pid != os.getpid():  # First use in this process
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+                self._conn_pid = os.getpid()
+            with self._conn:
+                yield self._conn
+
+    # Writer side (the process running the job)
+
+    def __setitem__(self, progress_id, fields):
+        entry = ProgressEntry(self, progress_id, fields)
+        with self._lock:
+            self._entries[progress_id] = entry
+        self._changed(entry, urgent=True)
+
+    def publish(self, progress_id, fields):
+        """Publish a job's state without keeping an entry (the job runs elsewhere)"""
+        self._publish(ProgressEntry(self, progress_id, fields))
+
+    def __getitem__(self, progress_id):
+        return self._entries[progress_id]
+
+    def __contains__(self, progress_id):
+        return progress_id in self._entries
+
+    def get(self, progress_id, default=None):
+        return self._entries.get(progress_id, default)
+
+    def _changed(self, entry, urgent):
+        if urgent:
+            with self._lock:
+                self._dirty.pop(entry.progress_id, None)
+            self._publish(entry)
+            return
+        with self._lock:
+            self._dirty[entry.progress_id] = entry
+            if self._publisher is None:
+                self._publisher = threading.Thread(target=self._publish_loop, name='progress-publisher')
+                self._publisher.daemon = True
+                self._publisher.start()
+
+    def _publish(self, entry):
+        data = json.dumps(entry.snapshot())
+        with self._db() as conn:
+            conn.execute(
+                'INSERT INTO progress (id, data, version, updated_at) VALUES (?, ?, 1, ?)'
+                ' ON CONFLICT (id) DO UPDATE SET data = excluded.data, version = version + 1,'
+                ' updated_at = excluded.updated_at',
+                (entry.progress_id, data, time.time()))
+        if entry.get('status') in TERMINAL_STATUSES:
+            with self._lock:
+                if self._entries.get(entry.progress_id) is entry:
+                    del self._entries[entry.progress_id]
+                if self._dirty.get(entry.progress_id) is entry:
+                    del self._dirty[entry.progress_id]
+                self._cancel_checks.pop(entry.progress_id, None)
+
+    def flush(self):
+        """Publish every pending change now"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        for entry in dirty.values():
+            try:
+                self._publish(entry)
+            except sqlite3.Error as e:
+                logger.warning("Progress store error: %s", e)
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(self.publish_interval)
+            self.flush()
+
+    # Reader side (any process)
+
+    def snapshot(self, progress_id):
+        """Published progress of a job as a dict, or None if it is unknown"""
+        with self._db() as conn:
+            row = conn.execute('SELECT data FROM progress WHERE id = ?', (progress_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def version(self, progress_id):
+        with self._db() as conn:
+            row = conn.execute(
+                'SELECT version FROM progress WHERE id = ? AND data IS NOT NULL', (progress_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def wait_for_change(self, progress_id, seen_version, timeout):
+        """Wait until the published version differs from seen_version.
+
+        Returns the current version (None if the job is unknown), which is
+        unchanged if timeout expired first. Waiting costs no queries: the
+        shared watcher thread checks the versions of all watched jobs.
+        """
+        with self._watch:
+            self._watching[progress_id] = self._watching.get(progress_id, 0) + 1
+            try:
+                if progress_id not in self._versions:
+                    self._versions[progress_id] = self.version(progress_id)
+                if self._watcher is None:
+                    self._watcher = threading.Thread(target=self._watch_loop, name='progress-watcher')
+                    self._watcher.daemon = True
+                    self._watcher.start()
+                self._watch.notify_all()  # The watcher idles while nothing is watched
+                self._watch.wait_for(lambda: self._versions[progress_id] != seen_version, timeout)
+                return self._versions[progress_id]
+            finally:
+                listeners = self._watching.pop(progress_id) - 1
+                if listeners:
+                    self._watching[progress_id] = listeners
+                else:
+                    del self._versions[progress_id]
+
+    def _watch_loop(self):
+        while True:
+            with self._watch:
+                self._watch.wait_for(lambda: self._watching)
+                progress_ids = list(self._watching)
+            try:
+                with self._db() as conn:
+                    rows = conn.execute(
+                        'SELECT id, version FROM progress WHERE data IS NOT NULL AND id IN (%s)'
+                        % ','.join('?' * len(progress_ids)), progress_ids).fetchall()
+            except sqlite3.Error as e:
+                logger.warning("Progress store error: %s", e)
+                rows = None
+            if rows is not None:
+                versions = dict(rows)
+                with self._watch:
+                    changed = False
+                    for progress_id in progress_ids:
+                        version = versions.get(progress_id)
+                        if progress_id in self._versions and self._versions[progress_id] != version:
+                            self._versions[progress_id] = version
+                            changed = True
+                    if changed:
+                        self._watch.notify_all()
+            time.sleep(POLL_INTERVAL)
+
+    # Cancel requests
+
+    def request_cancel(self, progress_id):
+        with self._db() as conn:
+            conn.execute(
+                'INSERT INTO progress (id, cancel_requested, updated_at) VALUES (?, 1, ?)'
+                ' ON CONFLICT (id) DO UPDATE SET cancel_requested = 1',
+                (progress_id, time.time()))
+
+    def cancel_requested(self, progress_id):
+        """Whether a cancel was requested; re-read at most every CANCEL_CHECK_INTERVAL"""
+        now = time.monotonic()
+        checked = self._cancel_checks.get(progress_id)
+        if checked is not None and now - checked[0] < CANCEL_CHECK_INTERVAL:
+            return checked[1]
+        with self._db() as conn:
+            row = conn.execute(
+                'SELECT cancel_requested FROM progress WHERE id = ?', (progress_id,)).fetchone()
+        requested = bool(row and row[0])
+        self._cancel_checks[progress_id] = (now, requested)
+        return requested
+
+    def clear_cancel(self, progress_id):
+        self._cancel_checks.pop(progress_id, None)
+        with self._db() as conn:
+            conn.execute('UPDATE progress SET cancel_requested = 0 WHERE id = ?', (progress_id,))
@@ -0,0 +1,314 @@
+"""
+Vectorized geographic selection helpers
+
+Distance checks run over a dataset's cached float64 lat/lon arrays with NumPy
+instead of a per-row Python haversine. A cheap lat/lon bounding box is applied
+first so that the exact haversine only runs for candidates near the circle.
+GridIndex buckets a dataset's points into lat/lon cells so that radius and
+nearest-neighbour queries only look at nearby cells instead of scanning every
+row.
+"""
+
+import os
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000  # meters (same radius the original haversine used)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters; accepts scalars or NumPy arrays"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = np.radians(np.subtract(lat2, lat1))
+    dlambda = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def radius_bounding_box(center_lat, center_lon, radius_m):
+    """Return (min_lat, max_lat, half_width_lon) enclosing a circle.
+
+    half_width_lon is None when the circle covers a pole, in which case every
+    longitude is a candidate. The box is conservative: it never excludes a
+    point that lies within the circle.
+    """
+    angular_radius = radius_m / EARTH_RADIUS_M
+    dlat = np.degrees(angular_radius)
+    min_lat = center_lat - dlat
+    max_lat = center_lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or angular_radius >= np.pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None
+    dlon = np.degrees(np.arcsin(np.sin(angular_radius) / np.cos(np.radians(center_lat))))
+    return min_lat, max_lat, dlon
+
+
+def select_within_radius(latitudes, longitudes, center_lat, center_lon, radius_m):
+    """Return the positions of all points within radius_m of the center.
+
+    Positions are returned in ascending order so that `df.iloc[...]` keeps the
+    dataset's original row order.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    center_lat = float(center_lat)
+    center_lon = float(center_lon)
+    radius_m = float(radius_m)
+
+    # Cheap bounding-box prefilter (small margin guards against rounding)
+    min_lat, max_lat, dlon = radius_bounding_box(center_lat, center_lon, radius_m)
+    margin = 1e-9
+    positions = np.flatnonzero((latitudes >= min_lat - margin) & (latitudes <= max_lat + margin))
+    if dlon is not None and positions.size:
+        # Wrap longitude differences into [-180, 180) to handle the antimeridian
+        delta_lon = np.abs((longitudes[positions] - center_lon + 180.0) % 360.0 - 180.0)
+        positions = positions[delta_lon <= dlon + margin]
+    if positions.size == 0:
+        return positions
+
+    # Exact haversine check on the remaining candidates only
+    distances = haversine_m(center_lat, center_lon, latitudes[positions], longitudes[positions])
+    return positions[distances <= radius_m]
+
+
+def points_in_polygon(latitudes, longitudes, vertices):
+    """Boolean mask of the points inside a polygon (even-odd rule).
+
+    vertices is a sequence of (lat, lon) pairs; the ring is closed
+    implicitly. Edges are straight lines in lat/lon, which is what Leaflet
+    draws at the scale of a city, and every edge is tested against all
+    points at once instead of looping over points.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    vertices = np.asarray(vertices, dtype=np.float64)
+    inside = np.zeros(len(latitudes), dtype=bool)
+    lat_a, lon_a = vertices[:, 0], vertices[:, 1]
+    lat_b, lon_b = np.roll(lat_a, 1), np.roll(lon_a, 1)
+    for y1, x1, y2, x2 in zip(lat_a, lon_a, lat_b, lon_b):
+        if y1 == y2:
+            continue  # Horizontal edges never cross the ray
+        crosses = (y1 > latitudes) != (y2 > latitudes)
+        x_cross = x1 + (latitudes - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (longitudes < x_cross)
+    return inside
+
+
+DEFAULT_CELL_SIZE_DEG = 0.01  # ~1.1 km of latitude per grid cell
+INDEX_VERSION = 1
+
+
+class GridIndex:
+    """Lat/lon grid bucketing index over a dataset's coordinates.
+
+    Points are bucketed into fixed-size degree cells and stored sorted by cell
+    key (row-major), so every row of cells covered by a query is one
+    contiguous slice found with a binary search. Radius queries therefore only
+    run the exact haversine on points in nearby cells.
+    """
+
+    def __init__(self, keys, order, cell_size=DEFAULT_CELL_SIZE_DEG):
+        self.keys = keys  # Sorted int64 cell keys
+        self.order = order  # Dataset positions, in cell-key order
+        self.cell_size = float(cell_size)
+        self.n_rows = int(np.ceil(180.0 / self.cell_size)) + 1
+        self.n_cols = int(np.ceil(360.0 / self.cell_size))
+
+    def __len__(self):
+        return len(self.order)
+
+    @classmethod
+    def build(cls, latitudes, longitudes, cell_size=DEFAULT_CELL_SIZE_DEG):
+        index = cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), cell_size)
+        keys = index._cell_keys(np.asarray(latitudes, dtype=np.float64),
+                                np.asarray(longitudes, dtype=np.float64))
+        order = np.argsort(keys, kind='stable')
+        index.keys = keys[order]
+        index.order = order.astype(np.int64)
+        return index
+
+    def _cell_rows(self, latitudes):
+        rows = np.floor((np.asarray(latitudes) + 90.0) / self.cell_size).astype(np.int64)
+        return np.clip(rows, 0, self.n_rows - 1)
+
+    def _cell_cols(self, longitudes):
+        wrapped = (np.asarray(longitudes) + 180.0) % 360.0
+        cols = np.floor(wrapped / self.cell_size).astype(np.int64)
+        return np.clip(cols, 0, self.n_cols - 1)
+
+    def _cell_keys(self, latitudes, longitudes):
+        return self._cell_rows(latitudes) * self.n_cols + self._cell_cols(longitudes)
+
+    def query_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        """Candidate positions for points inside a lat/lon box (cell-granular).
+
+        min_lon may be greater than max_lon for boxes crossing the antimeridian.
+        Pass min_lon=None to cover every longitude.
+        """
+        if len(self.order) == 0:
+            return np.empty(0, dtype=np.int64)
+        row_start, row_end = self._cell_rows([min_lat, max_lat])
+        rows = np.arange(row_start, row_end + 1, dtype=np.int64)
+
+        if min_lon is None or max_lon - min_lon >= 360.0:
+            col_ranges = [(0, self.n_cols - 1)]
+        else:
+            col_start, col_end = self._cell_cols([min_lon, max_lon])
+            if min_lon <= max_lon:
+                col_ranges = [(col_start, col_end)]
+            else:
+                col_ranges = [(col_start, self.n_cols - 1), (0, col_end)]
+
+        slices = []
+        for col_start, col_end in col_ranges:
+            starts = np.searchsorted(self.keys, rows * self.n_cols + col_start, side='left')
+            ends = np.searchsorted(self.keys, rows * self.n_cols + col_end, side='right')
+            slices.extend(self.order[start:end] for start, end in zip(starts, ends) if end > start)
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def _radius_candidates(self, center_lat, center_lon, radius_m):
+        min_lat, max_lat, dlon = radius_bounding_box(center_lat, center_lon, radius_m)
+        if dlon is None or dlon >= 180.0:
+            return self.query_bbox(min_lat, max_lat, None, None)
+        min_lon = (center_lon - dlon + 180.0) % 360.0 - 180.0
+        max_lon = (center_lon + dlon + 180.0) % 360.0 - 180.0
+        return self.query_bbox(min_lat, max_lat, min_lon, max_lon)
+
+    def query_radius(self, latitudes, longitudes, center_lat, center_lon, radius_m):
+        """Positions (ascending) of points within radius_m of the center"""
+        center_lat = float(center_lat)
+        center_lon = float(center_lon)
+        radius_m = float(radius_m)
+        candidates = self._radius_candidates(center_lat, center_lon, radius_m)
+        if candidates.size == 0:
+            return candidates
+        candidates.sort()
+        distances = haversine_m(center_lat, center_lon, latitudes[candidates], longitudes[candidates])
+        return candidates[distances <= radius_m]
+
+    def query_nearest(self, latitudes, longitudes, center_lat, center_lon, k, max_radius_m=None):
+        """(positions, distances in meters) of the k points nearest the center, nearest first.
+
+        The search radius starts at one cell and doubles until the circle holds
+        k points, so only cells near the center are read. Points further than
+        max_radius_m are left out, which can return fewer than k. Ties are
+        broken by position.
+        """
+        center_lat = float(center_lat)
+        center_lon = float(center_lon)
+        limit = np.pi * EARTH_RADIUS_M if max_radius_m is None else min(float(max_radius_m), np.pi * EARTH_RADIUS_M)
+        radius_m = min(np.radians(self.cell_size) * EARTH_RADIUS_M, limit)
+        while True:
+            candidates = self._radius_candidates(center_lat, center_lon, radius_m)
+            distances = haversine_m(center_lat, center_lon, latitudes[candidates], longitudes[candidates])
+            within = distances <= radius_m
+            # Everything closer than the radius has been seen, so once k points
+            # are inside it no unseen point can be nearer
+            if np.count_nonzero(within) >= k or radius_m >= limit:
+                break
+            radius_m = min(radius_m * 2, limit)
+        candidates, distances = candidates[within], distances[within]
+        ranked = np.lexsort((candidates, distances))[:k]
+        return candidates[ranked], distances[ranked]
+
+    def save(self, path, source_key):
+        """Persist the index; source_key identifies the data it was built from"""
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, keys=self.keys, order=self.order,
+                 cell_size=np.float64(self.cell_size),
+                 version=np.int64(INDEX_VERSION),
+                 source_key=np.asarray(source_key, dtype=np.float64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_key):
+        """Load a persisted index, or return None if missing or stale"""
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != INDEX_VERSION:
+                    return None
+                if not np.array_equal(data['source_key'], np.asarray(source_key, dtype=np.float64)):
+                    return None
+                return cls(data['keys'], data['order'], float(data['cell_size']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+TILE_SIZE_PX = 256
+CLUSTER_CELL_PX = 64  # Points closer than this on screen are merged
+MAX_MERCATOR_LAT = 85.0511287798
+
+
+def mercator_pixels(latitudes, longitudes, zoom):
+    """Web Mercator pixel coordinates (x, y) at a zoom level, as Leaflet uses"""
+    world = TILE_SIZE_PX * 2.0 ** zoom
+    lat = np.radians(np.clip(np.asarray(latitudes, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (np.asarray(longitudes, dtype=np.float64) + 180.0) / 360.0 * world
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * world
+    return x, y
+
+
+class ClusterGrid:
+    """Points merged into screen-space grid cells for one zoom level.
+
+    Each cell becomes one cluster at the centroid of its points. Cells with
+    a single point keep that point's exact position and dataset position
+    (`ids`, -1 for real clusters), so they can be drawn as plain markers.
+    """
+
+    def __init__(self, zoom, rows, cols, latitudes, longitudes, counts, ids, cell_px=CLUSTER_CELL_PX):
+        self.zoom = zoom
+        self.rows = rows  # Cell row/column of each cluster
+        self.cols = cols
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.counts = counts
+        self.ids = ids
+        self.cell_px = cell_px
+        self.cells_per_axis = int(np.ceil(TILE_SIZE_PX * 2 ** zoom / cell_px))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _cells(self, latitudes, longitudes):
+        x, y = mercator_pixels(latitudes, longitudes, self.zoom)
+        cols = np.clip((x // self.cell_px).astype(np.int64), 0, self.cells_per_axis - 1)
+        rows = np.clip((y // self.cell_px).astype(np.int64), 0, self.cells_per_axis - 1)
+        return rows, cols
+
+    @classmethod
+    def build(cls, latitudes, longitudes, zoom, cell_px=CLUSTER_CELL_PX):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        grid = cls(zoom, None, None, None, None, None, None, cell_px)
+        rows, cols = grid._cells(latitudes, longitudes)
+        keys, inverse, counts = np.unique(rows * grid.cells_per_axis + cols, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        grid.rows, grid.cols = np.divmod(keys, grid.cells_per_axis)
+        grid.latitudes = np.bincount(inverse, weights=latitudes, minlength=len(keys)) / counts
+        grid.longitudes = np.bincount(inverse, weights=longitudes, minlength=len(keys)) / counts
+        grid.counts = counts.astype(np.int64)
+        # Dataset position of each single-point cell (the last point written
+        # wins, which is the only point when the count is 1)
+        grid.ids = np.full(len(keys), -1, dtype=np.int64)
+        grid.ids[inverse] = np.arange(len(inverse), dtype=np.int64)
+        grid.ids[counts != 1] = -1
+        return grid
+
+    def query_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        """Positions of the clusters whose cell overlaps the box.
+
+        min_lon may be greater than max_lon for boxes crossing the antimeridian.
+        Pass min_lon=None to cover every longitude.
+        """
+        (row_start, row_end), _ = self._cells([max_lat, min_lat], [0.0, 0.0])
+        mask = (self.rows >= row_start) & (self.rows <= row_end)
+        if min_lon is not None:
+            _, (col_start, col_end) = self._cells([0.0, 0.0], [min_lon, max_lon])
+            if min_lon <= max_lon:
+                mask &= (self.cols >= col_start) & (self.cols <= col_end)
+            else:
+                mask &= (self.cols >= col_start) | (self.cols <= col_end)
+        return np.flatnonzero(mask)
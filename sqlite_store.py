@@ -0,0 +1,408 @@
+"""
+Optional single-file SQLite storage for datasets (DATASET_BACKEND=sqlite)
+
+Every dataset lives in one database (DATASETS_DB_PATH) instead of the
+per-dataset column files of columnar_store.py:
+
+  datasets      one row per dataset: name, row counts, version, timestamps
+                and the metadata JSON (columns, bounds, geocode stats); the
+                dataset listing reads only this table
+  rows          geocoded rows: (dataset_id, position) key, latitude,
+                longitude and the column values as a JSON array
+  failed_rows   rows that could not be geocoded
+  points_<id>   R*Tree over one dataset's coordinates, keyed by row position
+
+SqliteDatasetWriter streams chunks into a staging dataset (committed = 0),
+one transaction per chunk, and commit() makes it live and drops the previous
+version of the same name in a single transaction: a crash mid-write leaves
+only staging rows, which readers never see and which are swept later.
+
+Circle, box and polygon selections go through RTreeIndex, a GridIndex whose
+bounding-box lookup queries the R*Tree; the exact distance/polygon tests then
+run on the in-memory coordinates as before. Checkpoints and the original
+upload still live in the dataset directory under UPLOAD_FOLDER.
+
+Each process opens one connection (on first use, so after any fork) and
+threads take turns on it; the schema is set up once, when the store is
+created.
+
+Existing columnar datasets are copied into a database with:
+
+    python sqlite_store.py import datasets/ datasets.sqlite
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+from dataset_store import Dataset
+from metrics import DATASET_LOAD_SECONDS, DATASET_ROWS_LOADED
+from spatial import GridIndex
+
+STALE_STAGING = 24 * 60 * 60  # seconds; unfinished writes older than this are swept
+IMPORT_CHUNK_ROWS = 50_000
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS datasets ('
+    ' id INTEGER PRIMARY KEY,'
+    ' name TEXT NOT NULL,'
+    ' committed INTEGER NOT NULL DEFAULT 0,'
+    ' version TEXT NOT NULL,'
+    ' updated_at REAL NOT NULL,'
+    ' row_count INTEGER NOT NULL DEFAULT 0,'
+    ' geocoded_count INTEGER NOT NULL DEFAULT 0,'
+    ' failed_count INTEGER NOT NULL DEFAULT 0,'
+    ' metadata TEXT'
+    ')',
+    'CREATE UNIQUE INDEX IF NOT EXISTS datasets_live_name ON datasets (name) WHERE committed = 1',
+    'CREATE INDEX IF NOT EXISTS datasets_listing ON datasets (committed, updated_at)',
+    'CREATE TABLE IF NOT EXISTS rows ('
+    ' dataset_id INTEGER NOT NULL,'
+    ' position INTEGER NOT NULL,'
+    ' latitude REAL NOT NULL,'
+    ' longitude REAL NOT NULL,'
+    ' data TEXT NOT NULL,'
+    ' PRIMARY KEY (dataset_id, position)'
+    ') WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS failed_rows ('
+    ' dataset_id INTEGER NOT NULL,'
+    ' position INTEGER NOT NULL,'
+    ' data TEXT NOT NULL,'
+    ' PRIMARY KEY (dataset_id, position)'
+    ') WITHOUT ROWID',
+)
+
+
+def _points_table(dataset_id):
+    return f'points_{int(dataset_id)}'
+
+
+def _drop_dataset(conn, dataset_id):
+    """Remove one dataset's rows, failed rows and R*Tree (inside a transaction)"""
+    conn.execute('DELETE FROM rows WHERE dataset_id = ?', (dataset_id,))
+    conn.execute('DELETE FROM failed_rows WHERE dataset_id = ?', (dataset_id,))
+    conn.execute(f'DROP TABLE IF EXISTS {_points_table(dataset_id)}')
+    conn.execute('DELETE FROM datasets WHERE id = ?', (dataset_id,))
+
+
+def _encode_rows(df, columns):
+    values = df[columns].fillna('').astype(str).to_numpy().tolist() if columns else [[] for _ in range(len(df))]
+    return [json.dumps(row, ensure_ascii=False) for row in values]
+
+
+class RTreeIndex(GridIndex):
+    """GridIndex whose bounding-box lookup runs on a dataset's R*Tree.
+
+    Radius and nearest queries are built on query_bbox, so they use the
+    R*Tree too. The R*Tree stores 32-bit floats rounded outward, so candidates
+    are a superset and callers keep their exact tests.
+    """
+
+    def __init__(self, store, dataset_id, count):
+        super().__init__(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.store = store
+        self.dataset_id = dataset_id
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def query_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        table = _points_table(self.dataset_id)
+        if min_lon is None or max_lon - min_lon >= 360.0:
+            ranges = [(-180.0, 180.0)]
+        elif min_lon <= max_lon:
+            ranges = [(min_lon, max_lon)]
+        else:  # Across the antimeridian
+            ranges = [(min_lon, 180.0), (-180.0, max_lon)]
+        positions = []
+        with self.store._db() as conn:
+            for low, high in ranges:
+                positions.extend(row[0] for row in conn.execute(
+                    f'SELECT id FROM {table} WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?',
+                    (float(min_lat), float(max_lat), float(low), float(high))).fetchall())
+        return np.array(positions, dtype=np.int64)
+
+
+class SqliteDataset(Dataset):
+    """Dataset whose failed rows are read from the database"""
+
+    def __init__(self, *args, store=None, dataset_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+        self.dataset_id = dataset_id
+
+    def failed_df(self):
+        if not self.metadata.get('failed_count'):
+            return pd.DataFrame()
+        return self.store._read_table('failed_rows', self.dataset_id, self.metadata['failed_columns'])
+
+
+class SqliteDatasetWriter:
+    """Same interface as columnar_store.DatasetWriter, writing to the database"""
+
+    def __init__(self, store, name, columns, failed_columns):
+        self.store = store
+        self.name = name
+        self.columns = list(columns)
+        self.failed_columns = list(failed_columns)
+        self.version = uuid.uuid4().hex[:12]
+        self.geocoded_count = 0
+        self.failed_count = 0
+        self._bounds = None
+        with store._db() as conn:
+            # Only one job writes a dataset name at a time, so any staging
+            # rows for this name are left over from a crash
+            for (stale_id,) in conn.execute('SELECT id FROM datasets WHERE name = ? AND committed = 0',
+                                            (name,)).fetchall():
+                _drop_dataset(conn, stale_id)
+            self.dataset_id = conn.execute(
+                'INSERT INTO datasets (name, committed, version, updated_at) VALUES (?, 0, ?, ?)',
+                (name, self.version, time.time())).lastrowid
+            conn.execute(f'CREATE VIRTUAL TABLE {_points_table(self.dataset_id)} '
+                         'USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+
+    def append_geocoded(self, df):
+        """Append rows with valid Latitude/Longitude (one transaction)"""
+        if len(df) == 0:
+            return
+        latitudes = df['Latitude'].to_numpy(dtype=np.float64)
+        longitudes = df['Longitude'].to_numpy(dtype=np.float64)
+        positions = range(self.geocoded_count, self.geocoded_count + len(df))
+        data = _encode_rows(df, self.columns)
+        with self.store._db() as conn:
+            conn.executemany(
+                'INSERT INTO rows (dataset_id, position, latitude, longitude, data) VALUES (?, ?, ?, ?, ?)',
+                zip([self.dataset_id] * len(df), positions, latitudes.tolist(), longitudes.tolist(), data))
+            conn.executemany(
+                f'INSERT INTO {_points_table(self.dataset_id)} VALUES (?, ?, ?, ?, ?)',
+                zip(positions, latitudes.tolist(), latitudes.tolist(), longitudes.tolist(), longitudes.tolist()))
+            conn.execute('UPDATE datasets SET updated_at = ? WHERE id = ?', (time.time(), self.dataset_id))
+        self.geocoded_count += len(df)
+        bounds = (latitudes.min(), latitudes.max(), longitudes.min(), longitudes.max())
+        if self._bounds is not None:
+            bounds = (min(bounds[0], self._bounds[0]), max(bounds[1], self._bounds[1]),
+                      min(bounds[2], self._bounds[2]), max(bounds[3], self._bounds[3]))
+        self._bounds = bounds
+
+    def append_failed(self, df):
+        if len(df) == 0:
+            return
+        positions = range(self.failed_count, self.failed_count + len(df))
+        with self.store._db() as conn:
+            conn.executemany('INSERT INTO failed_rows (dataset_id, position, data) VALUES (?, ?, ?)',
+                             zip([self.dataset_id] * len(df), positions, _encode_rows(df, self.failed_columns)))
+        self.failed_count += len(df)
+
+    def commit(self, stats=None, row_count=None):
+        """Make the dataset live, replacing any previous version; returns the metadata"""
+        bounds = None
+        if self._bounds is not None:
+            bounds = dict(zip(('min_lat', 'max_lat', 'min_lon', 'max_lon'), map(float, self._bounds)))
+        updated_at = time.time()
+        metadata = {
+            'version': self.version,
+            'updated_at': updated_at,
+            'row_count': row_count if row_count is not None else self.geocoded_count + self.failed_count,
+            'geocoded_count': self.geocoded_count,
+            'failed_count': self.failed_count,
+            'columns': self.columns,
+            'failed_columns': self.failed_columns,
+            'bounds': bounds,
+            'stats': stats or {},
+        }
+        with self.store._db() as conn:
+            for (old_id,) in conn.execute('SELECT id FROM datasets WHERE name = ? AND committed = 1',
+                                          (self.name,)).fetchall():
+                _drop_dataset(conn, old_id)
+            conn.execute(
+                'UPDATE datasets SET committed = 1, updated_at = ?, row_count = ?, geocoded_count = ?,'
+                ' failed_count = ?, metadata = ? WHERE id = ?',
+                (updated_at, metadata['row_count'], self.geocoded_count, self.failed_count,
+                 json.dumps(metadata), self.dataset_id))
+        return metadata
+
+    def abort(self):
+        with self.store._db() as conn:
+            _drop_dataset(conn, self.dataset_id)
+
+
+class SqliteDatasetStore:
+    """Same interface as dataset_store.DatasetStore, backed by one SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._datasets = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.RLock()
+        self._conn = None
+        self._conn_pid = None
+        with self._db() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for (stale_id,) in conn.execute('SELECT id FROM datasets WHERE committed = 0 AND updated_at < ?',
+                                            (time.time() - STALE_STAGING,)).fetchall():
+                _drop_dataset(conn, stale_id)
+
+    @contextmanager
+    def _db(self):
+        """This process's connection, one thread at a time; commits on success"""
+        with self._db_lock:
+            if self._conn_pid != os.getpid():  # First use in this process
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+                self._conn_pid = os.getpid()
+            with self._conn:
+                yield self._conn
+
+    def _live(self, name):
+        with self._db() as conn:
+            return conn.execute(
+                'SELECT id, version, updated_at, row_count, metadata FROM datasets WHERE name = ? AND committed = 1',
+                (name,)).fetchone()
+
+    def _read_table(self, table, dataset_id, columns):
+        with self._db() as conn:
+            rows = conn.execute(f'SELECT data FROM {table} WHERE dataset_id = ? ORDER BY position',
+                                (dataset_id,)).fetchall()
+        values = [json.loads(data) for (data,) in rows]
+        return pd.DataFrame(values, columns=columns, dtype=object) if values else pd.DataFrame(columns=columns)
+
+    def _read_rows(self, dataset_id, columns, latitudes, longitudes):
+        df = self._read_table('rows', dataset_id, columns)
+        df['Latitude'] = latitudes
+        df['Longitude'] = longitudes
+        return df
+
+    def get(self, name):
+        """Return the loaded Dataset for `name`, or None (no legacy file in this backend)"""
+        if name is None:
+            return None
+        live = self._live(name)
+        if live is None:
+            with self._lock:
+                self._datasets.pop(name, None)
+            return None
+        dataset_id, version, updated_at, row_count, metadata = live
+        with self._lock:
+            dataset = self._datasets.get(name)
+        if dataset is not None and dataset.version == version:
+            return dataset
+
+        start = time.perf_counter()
+        metadata = json.loads(metadata)
+        with self._db() as conn:
+            coordinates = conn.execute(
+                'SELECT latitude, longitude FROM rows WHERE dataset_id = ? ORDER BY position', (dataset_id,)).fetchall()
+        coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+        latitudes = np.ascontiguousarray(coordinates[:, 0])
+        longitudes = np.ascontiguousarray(coordinates[:, 1])
+        columns = metadata['columns']
+        dataset = SqliteDataset(name, self.path, (updated_at, dataset_id), row_count, latitudes, longitudes,
+                                index=RTreeIndex(self, dataset_id, len(latitudes)), metadata=metadata,
+                                load_df=lambda: self._read_rows(dataset_id, columns, latitudes, longitudes),
+                                store=self, dataset_id=dataset_id)
+        with self._lock:
+            self._datasets[name] = dataset
+        elapsed = time.perf_counter() - start
+        DATASET_LOAD_SECONDS.observe(elapsed, part='coordinates')
+        DATASET_ROWS_LOADED.inc(dataset.address_count)
+        logger.info("Loaded dataset %s (%d rows) in %.3fs", name, dataset.address_count, elapsed,
+                    extra={'dataset': name, 'rows': dataset.address_count, 'seconds': round(elapsed, 4)})
+        return dataset
+
+    def list_datasets(self):
+        """List datasets as dicts, newest first, from the datasets table alone"""
+        with self._db() as conn:
+            rows = conn.execute(
+                'SELECT name, updated_at, row_count FROM datasets WHERE committed = 1 ORDER BY updated_at DESC'
+            ).fetchall()
+        return [{'name': name,
+                 'path': self.path,
+                 'last_modified': time.strftime('%Y-%m-%d %H:%M', time.localtime(updated_at)),
+                 'address_count': row_count}
+                for name, updated_at, row_count in rows]
+
+    def exists(self, name):
+        return self._live(name) is not None
+
+    def writer(self, name, columns, failed_columns):
+        return SqliteDatasetWriter(self, name, columns, failed_columns)
+
+    def delete(self, name):
+        """Remove a dataset's rows from the database"""
+        with self._db() as conn:
+            for (dataset_id,) in conn.execute('SELECT id FROM datasets WHERE name = ?', (name,)).fetchall():
+                _drop_dataset(conn, dataset_id)
+        self.invalidate(name)
+
+    def clear(self):
+        """Remove every dataset"""
+        with self._db() as conn:
+            for (dataset_id,) in conn.execute('SELECT id FROM datasets').fetchall():
+                _drop_dataset(conn, dataset_id)
+        self.invalidate()
+
+    def invalidate(self, name=None):
+        """Forget one dataset, or every dataset when no name is given"""
+        with self._lock:
+            if name is None:
+                self._datasets.clear()
+            else:
+                self._datasets.pop(name, None)
+
+
+def import_columnar(upload_folder, store):
+    """Copy every columnar dataset under upload_folder into the store; returns the names"""
+    imported = []
+    for name in sorted(os.listdir(upload_folder)):
+        dataset_path = os.path.join(upload_folder, name)
+        metadata = columnar_store.read_metadata(dataset_path)
+        if metadata is None:
+            continue
+        geocoded = columnar_store.read_table(dataset_path, metadata)
+        failed = columnar_store.read_table(dataset_path, metadata, columnar_store.FAILED_TABLE)
+        writer = store.writer(name, metadata['columns'], metadata['failed_columns'])
+        try:
+            for start in range(0, len(geocoded), IMPORT_CHUNK_ROWS):
+                writer.append_geocoded(geocoded.iloc[start:start + IMPORT_CHUNK_ROWS])
+            writer.append_failed(failed)
+            writer.commit(metadata.get('stats'), row_count=metadata['row_count'])
+        except Exception:
+            writer.abort()
+            raise
+        logger.info("Imported %s (%d rows)", name, metadata['row_count'])
+        imported.append(name)
+    return imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SQLite dataset storage')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='copy columnar datasets into a database')
+    import_parser.add_argument('upload_folder')
+    import_parser.add_argument('database')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    imported = import_columnar(args.upload_folder, SqliteDatasetStore(args.database))
+    print(f"Imported {len(imported)} dataset(s) into {args.database}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Level-controlled, structured logging
+
+    LOG_LEVEL   DEBUG, INFO (default), WARNING or ERROR. Per-address geocoding
+                results are logged at DEBUG, so they cost nothing at INFO.
+    LOG_FORMAT  text (default): `2026-01-01 12:00:00 INFO app: message key=value ...`
+                json: one JSON object per line for log collectors
+
+Modules log through `logging.getLogger(__name__)` and pass their fields as
+`extra={...}`; both formats include them.
+"""
+
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+QUIET_LOGGERS = ('urllib3', 'geopy')  # A line per HTTP request at DEBUG; kept at WARNING
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Send log records to stderr; safe to call more than once"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, 'structured', False):
+            root.removeHandler(existing)
+    handler.structured = True
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Local Nominatim-compatible stub geocoder for offline load testing
+
+Answers `/search?q=...&format=json` with a deterministic location derived
+from a hash of the query (scattered around Dallas, TX), so the geocoding
+engine can be exercised at full speed without touching a real provider.
+Queries containing "nowhere" return no results. With --max-rate the stub
+answers 429 (with Retry-After) beyond that many requests per second, and
+--error-rate makes a fraction of requests fail with 503, to exercise the
+engine's backoff.
+
+Usage:
+    python stub_geocoder.py [--port 8088] [--latency 0.05] [--miss-rate 0.0] [--max-rate 50] [--error-rate 0.01]
+
+Then point the app at it, for example:
+    GEOCODER_BACKENDS='[{"type": "stub", "url": "http://127.0.0.1:8088", "concurrency": 8}]' python app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CENTER = (32.7767, -96.7970)  # Dallas, TX
+SPREAD = 0.3  # degrees
+
+
+def stub_location(query):
+    """Deterministic (lat, lon) for a query string"""
+    digest = hashlib.md5(query.strip().lower().encode('utf-8')).digest()
+    lat_offset = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF - 0.5
+    lon_offset = int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF - 0.5
+    return CENTER[0] + 2 * SPREAD * lat_offset, CENTER[1] + 2 * SPREAD * lon_offset
+
+
+def stub_is_miss(query, miss_rate):
+    if 'nowhere' in query.lower():
+        return True
+    if miss_rate <= 0:
+        return False
+    digest = hashlib.md5(b'miss:' + query.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF < miss_rate
+
+
+class _Throttle:
+    """Requests allowed per one-second window (None = unlimited)"""
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.max_rate:
+            return True
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window, self._count = window, 0
+            self._count += 1
+            return self._count <= self.max_rate
+
+
+def make_handler(latency=0.0, miss_rate=0.0, max_rate=None, error_rate=0.0):
+    throttle = _Throttle(max_rate)
+    errors = random.Random(0)
+
+    class StubGeocoderHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like a real provider
+        disable_nagle_algorithm = True  # Headers and body are separate writes
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            if parsed.path.rstrip('/') != '/search':
+                self.send_error(404)
+                return
+            query = parse_qs(parsed.query).get('q', [''])[0]
+            if latency:
+                time.sleep(latency)
+            if not throttle.allow():
+                self._send_error(429, {'Retry-After': '1'})
+                return
+            if error_rate and errors.random() < error_rate:
+                self._send_error(503)
+                return
+            if not query or stub_is_miss(query, miss_rate):
+                places = []
+            else:
+                lat, lon = stub_location(query)
+                places = [{
+                    'place_id': int(hashlib.md5(query.encode('utf-8')).hexdigest()[:8], 16),
+                    'lat': f'{lat:.7f}',
+                    'lon': f'{lon:.7f}',
+                    'display_name': query,
+                    'boundingbox': [f'{lat - 0.0005:.7f}', f'{lat + 0.0005:.7f}',
+                                    f'{lon - 0.0005:.7f}', f'{lon + 0.0005:.7f}'],
+                    'class': 'place',
+                    'type': 'house',
+                    'importance': 0.5,
+                }]
+            body = json.dumps(places).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass  # Keep load tests quiet
+
+    return StubGeocoderHandler
+
+
+def serve_in_thread(host='127.0.0.1', port=0, latency=0.0, miss_rate=0.0, max_rate=None, error_rate=0.0):
+    """Start the stub in a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(latency, miss_rate, max_rate, error_rate))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Nominatim-compatible stub geocoder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--miss-rate', type=float, default=0.0, help='fraction of queries with no result')
+    parser.add_argument('--max-rate', type=float, default=None, help='requests/second before answering 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 make_handler(args.latency, args.miss_rate, args.max_rate, args.error_rate))
+    server.daemon_threads = True
+    print(f"Stub geocoder listening on http://{args.host}:{args.port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,13 @@
 import requests
 
 url = 'http://127.0.0.1:5000/data'
-response = requests.get(url)
+response = requests.get(url, params={'limit': 5})
 if response.status_code == 200:
     data = response.json()
-    print('Received data rows:', len(data))
-    if len(data) > 0:
-        print('First row:', data[0])
+    print('Received data rows:', len(data['rows']), 'of', data['total'])
+    if len(data['rows']) > 0:
+        print('Fields:', data['fields'])
+        print('First row:', data['rows'][0])
     else:
         print('No data rows received.')
 else:
@@ -0,0 +1,144 @@
+"""
+Batch selection of map zones
+
+POST /export_zones takes every zone of an outreach plan in one request:
+
+  {"zones": [{"name": "North", "type": "polygon", "coordinates": [[lat, lon], ...]},
+             {"name": "Church", "type": "circle", "center": [lat, lon], "radius": 800}],
+   "format": "zip" | "csv" | "json"}
+
+Each zone is resolved against the dataset's coordinate arrays: circles with
+the spatial index plus vectorized haversine, polygons with a spatial index
+bounding-box lookup plus vectorized point-in-polygon on the candidates.
+
+  zip   one CSV per zone plus zones_summary.csv (a row in several zones is in
+        each of their files)
+  csv   every row that falls in at least one zone, with a Zone column
+        ("North; Church" when zones overlap)
+  json  row counts per zone
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from flask import jsonify, send_file
+
+from csv_export import csv_response, iter_csv, zip_bundle
+
+MAX_ZONES = 200
+MAX_POLYGON_VERTICES = 5_000
+FORMATS = ('zip', 'csv', 'json')
+
+Zone = namedtuple('Zone', ['name', 'kind', 'vertices', 'center', 'radius'])
+
+
+class ZoneError(ValueError):
+    """A zone definition that cannot be evaluated"""
+
+
+def _point(value, what):
+    try:
+        lat, lon = (float(v) for v in value)
+    except (TypeError, ValueError):
+        raise ZoneError(f"{what} must be a [lat, lon] pair")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ZoneError(f"{what} is out of range")
+    return lat, lon
+
+
+def parse_zones(zones):
+    """Validate the zones of a request body; returns a list of Zone"""
+    if not isinstance(zones, list) or not zones:
+        raise ZoneError('zones must be a non-empty list')
+    if len(zones) > MAX_ZONES:
+        raise ZoneError(f'At most {MAX_ZONES} zones per request')
+    parsed = []
+    for number, zone in enumerate(zones, start=1):
+        if not isinstance(zone, dict):
+            raise ZoneError(f'Zone {number} must be an object')
+        name = str(zone.get('name') or f'Zone {number}')
+        kind = zone.get('type')
+        if kind == 'circle':
+            center = _point(zone.get('center'), f'{name}: center')
+            try:
+                radius = float(zone['radius'])
+            except (KeyError, TypeError, ValueError):
+                raise ZoneError(f'{name}: radius must be a number (meters)')
+            if radius < 0:
+                raise ZoneError(f'{name}: radius must not be negative')
+            parsed.append(Zone(name, kind, None, center, radius))
+        elif kind == 'polygon':
+            coordinates = zone.get('coordinates')
+            if not isinstance(coordinates, list) or not 3 <= len(coordinates) <= MAX_POLYGON_VERTICES:
+                raise ZoneError(f'{name}: polygon needs 3 to {MAX_POLYGON_VERTICES} [lat, lon] vertices')
+            vertices = np.array([_point(vertex, f'{name}: vertex') for vertex in coordinates])
+            parsed.append(Zone(name, kind, vertices, None, None))
+        else:
+            raise ZoneError(f"{name}: type must be 'polygon' or 'circle'")
+    return parsed
+
+
+def select_zones(dataset, zones):
+    """Positions (ascending) of the dataset rows inside each zone"""
+    selections = []
+    for zone in zones:
+        if zone.kind == 'circle':
+            selections.append(dataset.select_radius(zone.center[0], zone.center[1], zone.radius))
+        else:
+            selections.append(dataset.select_polygon(zone.vertices))
+    return selections
+
+
+def zone_assignment(zones, selections):
+    """(positions, zone labels) for every row in at least one zone"""
+    if not selections or sum(len(s) for s in selections) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+    positions = np.concatenate(selections)
+    zone_numbers = np.concatenate([np.full(len(s), i) for i, s in enumerate(selections)])
+    order = np.argsort(positions, kind='stable')  # Keeps zones in request order per row
+    positions, zone_numbers = positions[order], zone_numbers[order]
+    unique, starts, counts = np.unique(positions, return_index=True, return_counts=True)
+    names = np.array([zone.name for zone in zones], dtype=object)
+    labels = names[zone_numbers[starts]]
+    # Only rows in overlapping zones need their names joined
+    for row in np.flatnonzero(counts > 1):
+        labels[row] = '; '.join(names[zone_numbers[starts[row]:starts[row] + counts[row]]])
+    return unique, labels
+
+
+def zones_export_response(dataset, payload, request, dataset_label):
+    """Full /export_zones response (dataset None = 404)"""
+    if dataset is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    payload = payload or {}
+    export_format = payload.get('format', 'zip')
+    if export_format not in FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(FORMATS)}"}), 400
+    try:
+        zones = parse_zones(payload.get('zones'))
+    except ZoneError as e:
+        return jsonify({'error': str(e)}), 400
+
+    selections = select_zones(dataset, zones)
+    if export_format == 'json':
+        positions, _ = zone_assignment(zones, selections)
+        return jsonify({
+            'dataset': dataset_label,
+            'zones': [{'name': zone.name, 'type': zone.kind, 'count': len(s)} for zone, s in zip(zones, selections)],
+            'assigned': len(positions),
+            'unassigned': dataset.address_count - len(positions),
+        })
+    if export_format == 'csv':
+        positions, labels = zone_assignment(zones, selections)
+        response = csv_response(iter_csv(dataset.df, positions, extra_columns={'Zone': labels}),
+                                f'zones_{dataset_label}.csv', request)
+        response.headers['X-Selected-Count'] = str(len(positions))
+        return response
+    summary = pd.DataFrame({'Zone': [zone.name for zone in zones],
+                            'Type': [zone.kind for zone in zones],
+                            'Addresses': [len(s) for s in selections]})
+    bundle = zip_bundle(dataset.df, [(zone.name, s) for zone, s in zip(zones, selections)],
+                        'zones_summary.csv', summary)
+    return send_file(bundle, mimetype='application/zip',
+                     as_attachment=True, download_name=f'zones_{dataset_label}.zip')